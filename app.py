@@ -23,6 +23,13 @@ app.config['SQLALCHEMY_DATABASE_URI'] = f"mysql+pymysql://root:{mysql_password}@
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-string-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+# Seconds a token version is trusted before re-checking for revocation
+app.config['AUTH_VERSION_TTL'] = int(os.getenv('AUTH_VERSION_TTL', 5))
+# Password hashing ('scrypt', 'pbkdf2' or 'bcrypt'); cost is the algorithm's work factor
+app.config['PASSWORD_HASH_ALGORITHM'] = os.getenv('PASSWORD_HASH_ALGORITHM', 'scrypt')
+app.config['PASSWORD_HASH_COST'] = int(os.getenv('PASSWORD_HASH_COST') or 0) or None
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE_DEPTH'] = int(os.getenv('PASSWORD_HASH_QUEUE_DEPTH', 16))
 
 # Email configuration
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
@@ -31,9 +38,49 @@ app.config['MAIL_USE_TLS'] = True
 app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 
+# Response cache configuration ('memory', 'redis' or 'none')
+app.config['RESPONSE_CACHE_BACKEND'] = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')
+app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+app.config['RESPONSE_CACHE_REDIS_URL'] = os.getenv('RESPONSE_CACHE_REDIS_URL')
+
+# Rate limiting for auth and write endpoints ('memory' or 'redis'); limits per
+# endpoint live in ratelimit.DEFAULT_RATE_LIMITS
+app.config['RATE_LIMIT_ENABLED'] = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+app.config['RATE_LIMIT_BACKEND'] = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+app.config['RATE_LIMIT_REDIS_URL'] = os.getenv('RATE_LIMIT_REDIS_URL')
+# Admin stats are cached briefly; 0 recomputes them on every request
+app.config['ADMIN_STATS_CACHE_TTL'] = int(os.getenv('ADMIN_STATS_CACHE_TTL', 10))
+
 # Razorpay configuration
 app.config['RAZORPAY_KEY_ID'] = os.getenv('RAZORPAY_KEY_ID')
 app.config['RAZORPAY_KEY_SECRET'] = os.getenv('RAZORPAY_KEY_SECRET')
+app.config['RAZORPAY_WEBHOOK_SECRET'] = os.getenv('RAZORPAY_WEBHOOK_SECRET')
+app.config['RAZORPAY_BASE_URL'] = os.getenv('RAZORPAY_BASE_URL', 'https://api.razorpay.com/v1')
+app.config['RAZORPAY_CONNECT_TIMEOUT'] = float(os.getenv('RAZORPAY_CONNECT_TIMEOUT', 2))
+app.config['RAZORPAY_READ_TIMEOUT'] = float(os.getenv('RAZORPAY_READ_TIMEOUT', 8))
+app.config['RAZORPAY_MAX_RETRIES'] = int(os.getenv('RAZORPAY_MAX_RETRIES', 2))
+app.config['RAZORPAY_BREAKER_THRESHOLD'] = int(os.getenv('RAZORPAY_BREAKER_THRESHOLD', 5))
+app.config['RAZORPAY_BREAKER_RESET'] = float(os.getenv('RAZORPAY_BREAKER_RESET', 30))
+
+# Background jobs (run workers with `flask run-jobs`)
+app.config['JOB_VISIBILITY_TIMEOUT'] = int(os.getenv('JOB_VISIBILITY_TIMEOUT', 300))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+app.config['JOB_RETRY_BACKOFF'] = int(os.getenv('JOB_RETRY_BACKOFF', 30))
+
+# Payment reconciliation (`flask reconcile-payments`)
+app.config['RECONCILE_BATCH_SIZE'] = int(os.getenv('RECONCILE_BATCH_SIZE', 500))
+app.config['RECONCILE_CONCURRENCY'] = int(os.getenv('RECONCILE_CONCURRENCY', 8))
+app.config['RECONCILE_STALE_HOURS'] = int(os.getenv('RECONCILE_STALE_HOURS', 24))
+app.config['RECONCILE_BATCHES_PER_JOB'] = int(os.getenv('RECONCILE_BATCHES_PER_JOB', 20))
+app.config['RECONCILE_REPORT_DIR'] = os.getenv('RECONCILE_REPORT_DIR')
+
+# Idempotency-Key handling for booking and payment-order creation
+app.config['IDEMPOTENCY_TTL'] = int(os.getenv('IDEMPOTENCY_TTL', 86400))
+app.config['IDEMPOTENCY_LOCK_TIMEOUT'] = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+app.config['IDEMPOTENCY_WAIT'] = float(os.getenv('IDEMPOTENCY_WAIT', 10))
+
+# Seconds a worker's precomputed availability calendars stay valid
+app.config['AVAILABILITY_INDEX_TTL'] = int(os.getenv('AVAILABILITY_INDEX_TTL', 30))
 
 # Initialize extensions
 db.init_app(app)
@@ -42,6 +89,26 @@ jwt = JWTManager(app)
 cors = CORS(app)
 mail = Mail(app)
 
+# Response cache for public catalog endpoints
+from cache import response_cache
+response_cache.init_app(app)
+
+# Reject revoked tokens and cache user identities
+import authz
+authz.init_app(app)
+
+# Hash and verify passwords on a bounded worker pool
+from passwords import password_hasher
+password_hasher.init_app(app)
+
+# Throttle login, registration, bookings and payment orders
+from ratelimit import rate_limiter
+rate_limiter.init_app(app)
+
+# Pooled Razorpay client with timeouts, retries and a circuit breaker
+from gateway import payment_gateway
+payment_gateway.init_app(app)
+
 # Import models and routes
 from models import *
 from routes.auth import auth_bp
@@ -59,6 +126,23 @@ app.register_blueprint(reviews_bp, url_prefix='/api/reviews')
 app.register_blueprint(admin_bp, url_prefix='/api/admin')
 app.register_blueprint(payments_bp, url_prefix='/api/payments')
 
+# Register CLI commands
+from ratings import rebuild_ratings_command
+app.cli.add_command(rebuild_ratings_command)
+from search import rebuild_search_index_command
+app.cli.add_command(rebuild_search_index_command)
+from metrics import backfill_metrics_command
+app.cli.add_command(backfill_metrics_command)
+import tasks  # Registers the background tasks workers can run
+from jobs import run_jobs_command
+app.cli.add_command(run_jobs_command)
+from webhooks import process_webhooks_command
+app.cli.add_command(process_webhooks_command)
+from reconcile import reconcile_payments_command
+app.cli.add_command(reconcile_payments_command)
+from idempotency import purge_idempotency_keys_command
+app.cli.add_command(purge_idempotency_keys_command)
+
 @app.route('/')
 def home():
     return render_template('index.html')
@@ -75,16 +159,7 @@ def package_detail(package_id):
         if not package or not package.is_active:
             return "Package not found", 404
         
-        # Add average rating
-        reviews = Review.query.filter_by(package_id=package_id).all()
-        if reviews:
-            avg_rating = sum(review.rating for review in reviews) / len(reviews)
-            package.average_rating = round(avg_rating, 1)
-            package.total_reviews = len(reviews)
-        else:
-            package.average_rating = 0
-            package.total_reviews = 0
-        
+        # average_rating and total_reviews come from the package's rating counters
         return render_template('package_detail.html', package=package)
     except Exception as e:
         return f"Error loading package: {str(e)}", 500
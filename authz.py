@@ -0,0 +1,126 @@
+"""
+Token claims, role checks and the user identity cache
+
+Access tokens carry the user's role, active flag and token version as
+additional claims, so handlers can authorize a request without loading the
+user. User.token_version is bumped by revoke_tokens() whenever a change must
+invalidate tokens already issued (deactivation, role change). The blocklist
+check installed by init_app() compares each token's version with the user's
+current one.
+
+That check, and any handler that only needs to read the user, go through
+load_principal(): a read-only Principal snapshot of the user row, memoized for
+the rest of the request and cached per process for AUTH_VERSION_TTL seconds
+(default 5). Handlers that change a user call invalidate_principal() after
+committing; other processes pick the change up when their entry expires, so a
+revocation takes effect everywhere within that window.
+"""
+
+from functools import wraps
+import time
+from flask import current_app, g, jsonify
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity
+from cache import LRUCache
+from models import db, User, UserRole
+
+PRINCIPAL_CACHE_SIZE = 4096
+
+# user id -> (Principal or None for a missing user, expiry)
+_principals = LRUCache(maxsize=PRINCIPAL_CACHE_SIZE)
+
+
+class Principal:
+    """Read-only snapshot of a users row, safe to share between requests"""
+    __slots__ = ('id', 'username', 'email', 'phone_number', 'role', 'is_active',
+                 'token_version', 'created_at', 'updated_at')
+
+    def __init__(self, user):
+        for name in self.__slots__:
+            object.__setattr__(self, name, getattr(user, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Principal is read-only; load the User to change it')
+
+    # Same serialization as the model
+    to_dict = User.to_dict
+
+
+def token_claims(user):
+    return {'role': user.role.value, 'active': user.is_active, 'ver': user.token_version or 0}
+
+
+def create_user_token(user):
+    """Access token for user carrying its role, active flag and token version"""
+    return create_access_token(identity=str(user.id), additional_claims=token_claims(user))
+
+
+def revoke_tokens(user):
+    """Invalidate every token issued to user so far; takes effect when the session commits"""
+    user.token_version = (user.token_version or 0) + 1
+
+
+def load_principal(user_id):
+    """Snapshot of the user with the given id, or None if there is no such user"""
+    memo = g.setdefault('principals', {})
+    if user_id in memo:
+        return memo[user_id]
+
+    entry = _principals.get(user_id)
+    if entry is not None and entry[1] > time.monotonic():
+        principal = entry[0]
+    else:
+        user = db.session.get(User, user_id)
+        principal = Principal(user) if user else None
+        ttl = current_app.config.get('AUTH_VERSION_TTL', 5)
+        _principals.set(user_id, (principal, time.monotonic() + ttl))
+
+    memo[user_id] = principal
+    return principal
+
+
+def current_principal():
+    """Snapshot of the user making the request"""
+    return load_principal(int(get_jwt_identity()))
+
+
+def invalidate_principal(user_id):
+    """Drop cached snapshots of a user; call after committing a change to it"""
+    _principals.delete(user_id)
+    g.get('principals', {}).pop(user_id, None)
+
+
+def is_token_revoked(jwt_header, jwt_payload):
+    principal = load_principal(int(jwt_payload['sub']))
+    # Tokens issued before versioning carry no claim and count as version 0
+    return principal is None or jwt_payload.get('ver', 0) != principal.token_version
+
+
+def init_app(app):
+    """Install the revocation check on the app's JWTManager"""
+    app.extensions['flask-jwt-extended'].token_in_blocklist_loader(is_token_revoked)
+
+    @app.before_request
+    def reset_principals():
+        # The snapshot memo is per request even when an app context is reused
+        g.pop('principals', None)
+
+
+def current_role():
+    """Role of the requesting user, from the token claims when present"""
+    claims = get_jwt()
+    if 'role' in claims:
+        return UserRole(claims['role'])
+    principal = current_principal()
+    return principal.role if principal else None
+
+
+def roles_required(*roles, message='Insufficient permissions'):
+    """Decorator admitting only active users with one of roles; apply below @jwt_required()"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not get_jwt().get('active', True) or current_role() not in roles:
+                return jsonify({'error': message}), 403
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
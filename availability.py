@@ -0,0 +1,129 @@
+"""
+Precomputed seat calendars for the availability endpoints
+
+For each package the index keeps one array of remaining seats, one unsigned
+short per day from available_from to available_to, built from the package's
+package_inventory rows in a single query. A month of a package's calendar is
+then a slice of that array, however long its availability window.
+
+Seat reservations and releases (inventory.py) note their change on the
+session, and once the transaction commits the change is applied to the
+array in place, so this process's calendars follow its own bookings without
+a rebuild. Other worker processes pick the change up when their copy expires
+after AVAILABILITY_INDEX_TTL seconds (default 30). Entries are also rebuilt
+when the package is edited. Booking itself always checks the ledger, so a
+briefly stale calendar can only mislead a visitor, never oversell a date.
+"""
+
+from array import array
+from datetime import date
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from cache import LRUCache
+from models import db, PackageInventory
+
+AVAILABILITY_INDEX_SIZE = 1024
+
+# Session.info key for seat changes waiting for the transaction to commit
+PENDING_CHANGES = 'availability_changes'
+
+
+class SeatCalendar:
+    """Remaining seats per day of one package's availability window"""
+
+    def __init__(self, package, remaining_by_day):
+        self.version = package.version
+        self.start = package.available_from.toordinal()
+        self.capacity = package.max_travelers
+        self.price = package.price
+        self.built_at = time.monotonic()
+        days = package.available_to.toordinal() - self.start + 1
+        self.seats = array('H', [min(self.capacity, 0xFFFF)]) * max(days, 0)
+        for day, remaining in remaining_by_day:
+            index = day.toordinal() - self.start
+            if 0 <= index < len(self.seats):
+                self.seats[index] = max(0, remaining)
+
+    def apply(self, day, delta):
+        index = day.toordinal() - self.start
+        if 0 <= index < len(self.seats):
+            self.seats[index] = min(self.capacity, max(0, self.seats[index] + delta))
+
+    def days(self, first, last):
+        """[(day, remaining seats)] for the days of first..last inside the window"""
+        start = max(first.toordinal(), self.start)
+        end = min(last.toordinal(), self.start + len(self.seats) - 1)
+        return [(date.fromordinal(ordinal), self.seats[ordinal - self.start])
+                for ordinal in range(start, end + 1)]
+
+
+class AvailabilityIndex:
+    """Per-process SeatCalendar for each recently viewed package"""
+
+    def __init__(self, maxsize=AVAILABILITY_INDEX_SIZE):
+        self._calendars = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def _fresh(self, calendar, package):
+        ttl = current_app.config.get('AVAILABILITY_INDEX_TTL', 30)
+        return (calendar is not None and calendar.version == package.version
+                and time.monotonic() - calendar.built_at < ttl)
+
+    def calendars(self, packages):
+        """{package id: SeatCalendar}, building the missing ones with one query"""
+        found, missing = {}, []
+        for package in packages:
+            calendar = self._calendars.get(package.id)
+            if self._fresh(calendar, package):
+                found[package.id] = calendar
+            else:
+                missing.append(package)
+        if not missing:
+            return found
+
+        rows = {package.id: [] for package in missing}
+        for package_id, day, remaining in db.session.execute(
+            select(PackageInventory.package_id, PackageInventory.day, PackageInventory.remaining)
+            .where(PackageInventory.package_id.in_(rows), PackageInventory.day >= date.today())
+        ):
+            rows[package_id].append((day, remaining))
+        for package in missing:
+            found[package.id] = SeatCalendar(package, rows[package.id])
+            self._calendars.set(package.id, found[package.id])
+        return found
+
+    def apply(self, changes):
+        """Patch cached calendars with committed (package id, day, seat delta) changes"""
+        with self._lock:
+            for package_id, day, delta in changes:
+                calendar = self._calendars.get(package_id)
+                if calendar is not None:
+                    calendar.apply(day, delta)
+
+    def clear(self):
+        self._calendars.clear()
+
+
+availability_index = AvailabilityIndex()
+
+
+def note_seat_change(package_id, day, delta):
+    """Record a seat change to apply to the index once the session commits"""
+    db.session.info.setdefault(PENDING_CHANGES, []).append((package_id, day, delta))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_committed_changes(session):
+    changes = session.info.pop(PENDING_CHANGES, None)
+    if changes:
+        availability_index.apply(changes)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_rolled_back_changes(session, previous_transaction):
+    # A savepoint rolling back leaves the outer transaction's changes pending
+    if not previous_transaction.nested:
+        session.info.pop(PENDING_CHANGES, None)
@@ -0,0 +1,327 @@
+"""
+Caching helpers: a bounded LRU map, the response cache for public endpoints
+and conditional GET (ETag / Last-Modified) support
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+import hashlib
+import json
+from urllib.parse import urlencode
+import threading
+import time
+from flask import current_app, request
+
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used entry past maxsize"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MemoryCacheBackend:
+    """Per-process LRU store with per-entry expiry"""
+
+    def __init__(self, maxsize=1024):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            self._entries.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        self._entries.set(key, (value, time.monotonic() + ttl))
+
+    def generation(self, namespace):
+        return self._generations.get(namespace, 0)
+
+    def bump_generation(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    def clear(self):
+        self._entries.clear()
+        with self._lock:
+            self._generations.clear()
+
+
+class RedisCacheBackend:
+    """Store shared by every worker process, backed by Redis"""
+
+    def __init__(self, url, prefix='response_cache:'):
+        import redis  # Optional dependency, only needed for the shared backend
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        return self._client.get(self._prefix + key)
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + key, value, ex=max(1, int(ttl)))
+
+    def generation(self, namespace):
+        return int(self._client.get(f'{self._prefix}gen:{namespace}') or 0)
+
+    def bump_generation(self, namespace):
+        self._client.incr(f'{self._prefix}gen:{namespace}')
+
+    def clear(self):
+        for key in self._client.scan_iter(f'{self._prefix}*'):
+            self._client.delete(key)
+
+
+class NullCacheBackend:
+    """Backend that never stores anything, used to switch caching off"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def generation(self, namespace):
+        return 0
+
+    def bump_generation(self, namespace):
+        pass
+
+    def clear(self):
+        pass
+
+
+class ResponseCache:
+    """
+    Cache of successful GET responses for anonymous, read-heavy endpoints.
+
+    Every cached view belongs to a namespace such as ``packages:list`` or
+    ``packages:detail:5``. Keys combine the namespace, its current generation
+    and the normalized query string, so write handlers invalidate a namespace
+    by bumping its generation; the orphaned entries age out of the store.
+
+    Configuration:
+        RESPONSE_CACHE_BACKEND  'memory' (default), 'redis' or 'none'
+        RESPONSE_CACHE_TTL      seconds an entry stays fresh (default 60)
+        RESPONSE_CACHE_MAXSIZE  entries kept by the memory backend (default 1024)
+        RESPONSE_CACHE_REDIS_URL  connection URL for the redis backend
+    """
+
+    def __init__(self, app=None):
+        self._stats_lock = threading.Lock()
+        self._endpoints = {}
+        self._invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.setdefault('RESPONSE_CACHE_BACKEND', 'memory')
+        app.config.setdefault('RESPONSE_CACHE_TTL', 60)
+        app.config.setdefault('RESPONSE_CACHE_MAXSIZE', 1024)
+
+        if backend == 'memory':
+            store = MemoryCacheBackend(maxsize=app.config['RESPONSE_CACHE_MAXSIZE'])
+        elif backend == 'redis':
+            store = RedisCacheBackend(app.config['RESPONSE_CACHE_REDIS_URL'])
+        elif backend == 'none':
+            store = NullCacheBackend()
+        else:
+            raise ValueError(f'Unknown RESPONSE_CACHE_BACKEND: {backend}')
+
+        app.extensions['response_cache'] = store
+
+    @property
+    def backend(self):
+        return current_app.extensions.get('response_cache') or NullCacheBackend()
+
+    def _count(self, endpoint, outcome):
+        with self._stats_lock:
+            counters = self._endpoints.setdefault(endpoint, {'hits': 0, 'misses': 0})
+            counters[outcome] += 1
+
+    def stats(self):
+        """Hit/miss counters per cached view and the number of invalidations, for this process"""
+        with self._stats_lock:
+            return {
+                'endpoints': {name: dict(counters) for name, counters in self._endpoints.items()},
+                'invalidations': self._invalidations
+            }
+
+    def cached(self, namespace, ttl_config='RESPONSE_CACHE_TTL'):
+        """
+        Decorator caching a view's 200 responses.
+
+        ``namespace`` is a string, or a callable receiving the view arguments
+        and returning one. ``ttl_config`` names the config key holding the
+        entry lifetime in seconds; a value of 0 disables caching for the view.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                ttl = current_app.config.get(ttl_config, current_app.config.get('RESPONSE_CACHE_TTL'))
+                if request.method != 'GET' or not ttl:
+                    return f(*args, **kwargs)
+
+                backend = self.backend
+                ns = namespace(**kwargs) if callable(namespace) else namespace
+                args_key = urlencode(sorted(request.args.items(multi=True)))
+                key = f'{ns}:{backend.generation(ns)}:{args_key}'
+
+                entry = backend.get(key)
+                if entry is not None:
+                    self._count(f.__name__, 'hits')
+                    status, mimetype, etag, last_modified, body = _unpack_response(entry)
+                    if etag and request.if_none_match.contains(etag):
+                        response = not_modified_response(etag, last_modified)
+                    else:
+                        response = current_app.response_class(body, status=status, mimetype=mimetype)
+                        if etag:
+                            add_validators(response, etag, last_modified)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                self._count(f.__name__, 'misses')
+                response = current_app.make_response(f(*args, **kwargs))
+                if response.status_code == 200 and not response.direct_passthrough:
+                    backend.set(key, _pack_response(response), ttl)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return decorated_function
+        return decorator
+
+    def memoize(self, namespace, ttl_config='RESPONSE_CACHE_TTL'):
+        """
+        Decorator caching the JSON-serializable result of a function that takes
+        no arguments, so several views can share one computation.
+        """
+        def decorator(f):
+            @wraps(f)
+            def decorated_function():
+                ttl = current_app.config.get(ttl_config, current_app.config.get('RESPONSE_CACHE_TTL'))
+                if not ttl:
+                    return f()
+
+                backend = self.backend
+                key = f'{namespace}:{backend.generation(namespace)}'
+                entry = backend.get(key)
+                if entry is not None:
+                    self._count(f.__name__, 'hits')
+                    return json.loads(entry)
+
+                self._count(f.__name__, 'misses')
+                value = f()
+                backend.set(key, json.dumps(value).encode(), ttl)
+                return value
+            return decorated_function
+        return decorator
+
+    def invalidate(self, *namespaces):
+        """Drop every cached response in the given namespaces"""
+        backend = self.backend
+        for ns in namespaces:
+            backend.bump_generation(ns)
+        with self._stats_lock:
+            self._invalidations += len(namespaces)
+
+    def clear(self):
+        self.backend.clear()
+        with self._stats_lock:
+            self._endpoints.clear()
+            self._invalidations = 0
+
+
+def _pack_response(response):
+    etag, _ = response.get_etag()
+    last_modified = response.last_modified.isoformat() if response.last_modified else ''
+    header = f'{response.status_code}\n{response.mimetype}\n{etag or ""}\n{last_modified}\n'.encode()
+    return header + response.get_data()
+
+
+def _unpack_response(entry):
+    status, mimetype, etag, last_modified, body = entry.split(b'\n', 4)
+    last_modified = datetime.fromisoformat(last_modified.decode()) if last_modified else None
+    return int(status), mimetype.decode(), etag.decode() or None, last_modified, body
+
+
+def make_etag(*parts):
+    """Strong ETag value derived from the given version parts"""
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Return a 304 response when the client's copy is still current, else None.
+
+    If-None-Match takes precedence over If-Modified-Since, as in RFC 9110.
+    Call this before serializing anything so unchanged resources cost no
+    more than computing their validators.
+    """
+    if request.if_none_match:
+        matched = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified:
+        matched = _as_utc(last_modified).replace(microsecond=0) <= request.if_modified_since
+    else:
+        matched = False
+
+    if matched:
+        return not_modified_response(etag, last_modified)
+    return None
+
+
+def not_modified_response(etag, last_modified=None):
+    response = current_app.response_class(status=304)
+    add_validators(response, etag, last_modified)
+    return response
+
+
+def add_validators(response, etag, last_modified=None):
+    """Attach ETag/Last-Modified and ask clients to revalidate before reuse"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = _as_utc(last_modified)
+    response.headers['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+def _as_utc(value):
+    # Model timestamps are naive UTC (datetime.utcnow)
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+response_cache = ResponseCache()
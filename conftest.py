@@ -0,0 +1,182 @@
+"""
+Shared pytest fixtures for in-process API tests.
+
+The test_*.py scripts in this directory talk to a running server on
+localhost:5000. The fixtures below instead build a throwaway Flask app on an
+in-memory SQLite database so endpoints can be exercised with the test client.
+"""
+
+from contextlib import contextmanager
+from datetime import date, timedelta
+import json
+
+import pytest
+from flask import Flask
+from flask_jwt_extended import JWTManager
+from sqlalchemy import event
+
+import authz
+from authz import create_user_token
+from availability import availability_index
+from cache import response_cache
+from gateway import payment_gateway
+from passwords import password_hasher
+from ratelimit import rate_limiter
+from database import db
+
+
+@pytest.fixture
+def app():
+    """Flask app with every API blueprint on a fresh in-memory database"""
+    from routes.auth import auth_bp
+    from routes.packages import packages_bp
+    from routes.bookings import bookings_bp
+    from routes.reviews import reviews_bp
+    from routes.itineraries import itineraries_bp
+    from routes.admin import admin_bp
+    from routes.payments import payments_bp
+    from routes.wishlist import wishlist_bp
+    import tasks  # Registers background tasks
+
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    app.config['SECRET_KEY'] = 'test-secret-key'
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['JWT_SECRET_KEY'] = 'test-jwt-secret-key'
+    # Tests that exercise caching switch to the memory backend themselves
+    app.config['RESPONSE_CACHE_BACKEND'] = 'none'
+    # A cheap work factor keeps user fixtures fast
+    app.config['PASSWORD_HASH_COST'] = 1024
+
+    db.init_app(app)
+    JWTManager(app)
+    authz.init_app(app)
+    response_cache.init_app(app)
+    password_hasher.init_app(app)
+    rate_limiter.init_app(app)
+    payment_gateway.init_app(app)
+
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(packages_bp, url_prefix='/api/packages')
+    app.register_blueprint(bookings_bp, url_prefix='/api/bookings')
+    app.register_blueprint(reviews_bp, url_prefix='/api/reviews')
+    app.register_blueprint(itineraries_bp, url_prefix='/api/itineraries')
+    app.register_blueprint(admin_bp, url_prefix='/api/admin')
+    app.register_blueprint(payments_bp, url_prefix='/api/payments')
+    app.register_blueprint(wishlist_bp, url_prefix='/api/wishlist')
+
+    # Process-wide caches are keyed on ids that every test database reuses
+    from models import _package_lists_cache
+    _package_lists_cache.clear()
+    authz._principals.clear()
+    availability_index.clear()
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def fake_razorpay(app):
+    """Local fake Razorpay server with the app's gateway pointed at it"""
+    from fake_razorpay import FakeRazorpay
+
+    fake = FakeRazorpay().start()
+    app.config.update(RAZORPAY_BASE_URL=fake.base_url, RAZORPAY_KEY_ID='rzp_test_key',
+                      RAZORPAY_KEY_SECRET='rzp_test_secret', RAZORPAY_READ_TIMEOUT=0.5,
+                      RAZORPAY_BACKOFF=0)
+    payment_gateway.init_app(app)
+    yield fake
+    payment_gateway.client.close()
+    fake.stop()
+
+
+@pytest.fixture
+def count_queries(app):
+    """Context manager that records every SQL statement sent to the engine"""
+    @contextmanager
+    def counter():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return counter
+
+
+def make_user(username, role=None, password='password123'):
+    """Create and commit a user"""
+    from models import User, UserRole
+
+    user = User(
+        username=username,
+        email=f'{username}@example.com',
+        phone_number='+1234567890',
+        role=role or UserRole.END_USER
+    )
+    user.set_password(password)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def make_package(title='Test Package', **overrides):
+    """Create and commit an active travel package"""
+    from models import TravelPackage
+
+    fields = {
+        'title': title,
+        'description': f'{title} description',
+        'destination': 'Paris, France',
+        'duration_days': 5,
+        'price': 1000.0,
+        'max_travelers': 8,
+        'available_from': date.today(),
+        'available_to': date.today() + timedelta(days=365),
+        'includes': json.dumps(['Hotel accommodation']),
+        'excludes': json.dumps(['Flights']),
+        'images': json.dumps([])
+    }
+    fields.update(overrides)
+    package = TravelPackage(**fields)
+    db.session.add(package)
+    db.session.commit()
+    return package
+
+
+def make_booking(user, package=None, **overrides):
+    """Create and commit a pending booking for two travelers"""
+    from models import Booking
+
+    package = package or make_package()
+    fields = {
+        'user_id': user.id,
+        'package_id': package.id,
+        'booking_date': date.today(),
+        'number_of_travelers': 2,
+        'total_amount': 2 * package.price
+    }
+    fields.update(overrides)
+    booking = Booking(**fields)
+    db.session.add(booking)
+    db.session.commit()
+    return booking
+
+
+def auth_headers(user):
+    """Authorization header carrying a JWT for the given user"""
+    return {'Authorization': f'Bearer {create_user_token(user)}'}
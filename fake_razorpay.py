@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Razorpay orders and refunds API
+
+The payment tests run it in a background thread, and it doubles as a target
+for load benchmarks of the gateway adapter:
+
+    python fake_razorpay.py serve --port 9100 --latency 0.05
+    RAZORPAY_BASE_URL=http://127.0.0.1:9100/v1 python app_sqlite.py
+
+    python fake_razorpay.py bench --requests 2000 --concurrency 32 --latency 0.02
+
+Latency and failing answers can be injected to exercise the adapter's
+timeouts, retries and circuit breaker.
+"""
+
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import re
+import threading
+import time
+
+
+class FakeRazorpay:
+    """In-process fake gateway; start() serves it on a free local port"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.orders = {}
+        self.refunds = {}
+        self.requests = []
+        self.connections = 0
+        self._ids = itertools.count(1)
+        self._failures = deque()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        # A short poll interval keeps stop() quick between tests
+        self._thread = threading.Thread(target=self._server.serve_forever, kwargs={'poll_interval': 0.05},
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def fail_next(self, *statuses):
+        """Answer the next requests with these HTTP statuses, in order"""
+        with self._lock:
+            self._failures.extend(statuses)
+
+    def _next_failure(self):
+        with self._lock:
+            return self._failures.popleft() if self._failures else None
+
+    def _next_id(self, prefix):
+        with self._lock:
+            return f'{prefix}_{next(self._ids):014d}'
+
+    def handle(self, method, path, body):
+        """(status, payload) for one API call"""
+        with self._lock:
+            self.requests.append((method, path))
+        if self.latency:
+            time.sleep(self.latency)
+        failure = self._next_failure()
+        if failure:
+            return failure, _error('SERVER_ERROR', 'Injected failure')
+
+        if method == 'POST' and path == '/v1/orders':
+            amount = body.get('amount')
+            if not isinstance(amount, int) or amount < 100:
+                return 400, _error('BAD_REQUEST_ERROR', 'The amount must be atleast INR 1.00')
+            order = {
+                'id': self._next_id('order'), 'entity': 'order', 'amount': amount,
+                'amount_paid': 0, 'currency': body.get('currency', 'INR'),
+                'receipt': body.get('receipt'), 'status': 'created',
+                'notes': body.get('notes', {}), 'created_at': int(time.time())
+            }
+            self.orders[order['id']] = order
+            return 200, order
+
+        match = re.fullmatch(r'/v1/orders/([\w]+)', path)
+        if method == 'GET' and match:
+            order = self.orders.get(match.group(1))
+            return (200, order) if order else (404, _error('BAD_REQUEST_ERROR', 'The id provided does not exist'))
+
+        match = re.fullmatch(r'/v1/payments/([\w]+)/refund', path)
+        if method == 'POST' and match:
+            if any(r['payment_id'] == match.group(1) for r in self.refunds.values()):
+                return 400, _error('BAD_REQUEST_ERROR', 'The payment has been fully refunded already')
+            refund = {
+                'id': self._next_id('rfnd'), 'entity': 'refund', 'payment_id': match.group(1),
+                'amount': body.get('amount'), 'currency': 'INR', 'receipt': body.get('receipt'),
+                'notes': body.get('notes', {}), 'status': 'processed', 'created_at': int(time.time())
+            }
+            self.refunds[refund['id']] = refund
+            return 200, refund
+
+        match = re.fullmatch(r'/v1/payments/([\w]+)/refunds', path)
+        if method == 'GET' and match:
+            items = [r for r in self.refunds.values() if r['payment_id'] == match.group(1)]
+            return 200, {'entity': 'collection', 'count': len(items), 'items': items}
+
+        return 404, _error('BAD_REQUEST_ERROR', 'The requested URL was not found on the server.')
+
+
+def _error(code, description):
+    return {'error': {'code': code, 'description': description}}
+
+
+def _handler_for(fake):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so clients can reuse pooled connections
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            with fake._lock:
+                fake.connections += 1
+
+        def _dispatch(self, method):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            if not self.headers.get('Authorization', '').startswith('Basic '):
+                status, payload = 401, _error('BAD_REQUEST_ERROR', 'Authentication failed')
+            else:
+                try:
+                    body = json.loads(raw) if raw else {}
+                except ValueError:
+                    body = None
+                if body is None:
+                    status, payload = 400, _error('BAD_REQUEST_ERROR', 'Invalid JSON body')
+                else:
+                    status, payload = fake.handle(method, self.path, body)
+
+            data = json.dumps(payload).encode()
+            try:
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client timed out and hung up while the answer was delayed
+                self.close_connection = True
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def bench(requests_total, concurrency, latency, pool_size):
+    """Drive create_order through the adapter and report throughput and connections opened"""
+    from gateway import RazorpayGateway
+
+    fake = FakeRazorpay(latency=latency).start()
+    gateway = RazorpayGateway('rzp_test_bench', 'secret', base_url=fake.base_url, pool_size=pool_size)
+    order = {'amount': 50000, 'currency': 'INR', 'receipt': 'bench'}
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda _: gateway.create_order(order), range(requests_total)))
+        elapsed = time.perf_counter() - started
+    finally:
+        gateway.close()
+        fake.stop()
+
+    print(f'{requests_total} orders in {elapsed:.2f}s '
+          f'({requests_total / elapsed:.0f}/s, concurrency {concurrency}, '
+          f'{fake.connections} connections opened)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('mode', choices=['serve', 'bench'])
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every answer')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--pool-size', type=int, default=16)
+    args = parser.parse_args()
+
+    if args.mode == 'bench':
+        bench(args.requests, args.concurrency, args.latency, args.pool_size)
+        return
+
+    fake = FakeRazorpay(port=args.port, latency=args.latency)
+    print(f'Fake Razorpay listening on {fake.base_url}')
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
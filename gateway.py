@@ -0,0 +1,270 @@
+"""
+Razorpay gateway adapter with a pooled session, timeouts, retries and a
+circuit breaker
+
+RazorpayGateway talks to the Razorpay REST API over one keep-alive
+requests.Session per app, so calls reuse connections instead of paying for a
+TLS handshake each time. Every call has a connect and a read timeout. Transient
+failures (connection errors, timeouts, 429 and 5xx answers) are retried with
+exponential backoff and full jitter, but only where repeating the call is
+harmless: an unpaid duplicate order simply expires, while a refund is retried
+only when the connection could not be opened at all.
+
+A circuit breaker counts consecutive transient failures. Once
+RAZORPAY_BREAKER_THRESHOLD is reached it opens and calls fail immediately with
+GatewayUnavailable for RAZORPAY_BREAKER_RESET seconds, then a single trial
+call decides whether it closes again. A slow or failing gateway therefore
+costs a request thread at most one timeout instead of tying up every worker.
+
+Configuration:
+    RAZORPAY_KEY_ID / RAZORPAY_KEY_SECRET  API credentials
+    RAZORPAY_WEBHOOK_SECRET     secret webhook deliveries are signed with
+    RAZORPAY_BASE_URL           API root (default https://api.razorpay.com/v1);
+                                point it at fake_razorpay for tests and benchmarks
+    RAZORPAY_CONNECT_TIMEOUT    seconds to open a connection (default 2)
+    RAZORPAY_READ_TIMEOUT       seconds to wait for an answer (default 8)
+    RAZORPAY_MAX_RETRIES        retries after the first attempt (default 2)
+    RAZORPAY_BACKOFF            base backoff in seconds (default 0.2, capped at 2)
+    RAZORPAY_POOL_SIZE          keep-alive connections kept open (default 10)
+    RAZORPAY_BREAKER_THRESHOLD  consecutive failures that open the breaker (default 5)
+    RAZORPAY_BREAKER_RESET      seconds the breaker stays open (default 30)
+"""
+
+import hashlib
+import hmac
+import math
+import random
+import threading
+import time
+from flask import current_app, jsonify
+import requests
+from requests.adapters import HTTPAdapter
+
+MAX_BACKOFF = 2.0
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class GatewayError(Exception):
+    """Base class for payment gateway failures"""
+
+
+class GatewayUnavailable(GatewayError):
+    """The gateway could not be reached in time, or the breaker is open"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GatewayRejected(GatewayError):
+    """The gateway answered with a client error; repeating the call will not help"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open -> closed"""
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        """Raise GatewayUnavailable unless a call may go through now"""
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return
+            retry_after = self.reset_timeout - (time.monotonic() - self._opened_at)
+        raise GatewayUnavailable('Payment gateway circuit is open', retry_after=max(1, math.ceil(retry_after)))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class RazorpayGateway:
+    """Client for the Razorpay endpoints the app uses"""
+
+    def __init__(self, key_id, key_secret, base_url='https://api.razorpay.com/v1',
+                 connect_timeout=2.0, read_timeout=8.0, max_retries=2, backoff=0.2,
+                 pool_size=10, breaker=None, webhook_secret=None):
+        self.key_secret = key_secret or ''
+        self.webhook_secret = webhook_secret or ''
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        self.session.auth = (key_id or '', self.key_secret)
+        # Retries are handled below, where the breaker can see every attempt
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter keeps workers that failed together from retrying together
+        time.sleep(random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt)))
+
+    def _request(self, method, path, payload=None, idempotent=True):
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                response = self.session.request(method, self.base_url + path, json=payload,
+                                                timeout=self.timeout)
+            except requests.exceptions.ConnectTimeout as e:
+                error, retryable = e, True
+            except requests.exceptions.RequestException as e:
+                # The gateway may have acted on a request that timed out mid-way
+                error, retryable = e, idempotent
+            else:
+                if response.status_code < 400:
+                    self.breaker.record_success()
+                    return response.json()
+                if response.status_code not in RETRY_STATUSES:
+                    # A client error says nothing about the gateway's health
+                    self.breaker.record_success()
+                    raise GatewayRejected(_error_description(response), response.status_code)
+                error = f'Payment gateway returned {response.status_code}'
+                retryable = idempotent or response.status_code == 429
+
+            self.breaker.record_failure()
+            if not retryable or attempt >= self.max_retries:
+                raise GatewayUnavailable(f'Payment gateway unavailable: {error}')
+            self._sleep_before_retry(attempt)
+            attempt += 1
+
+    def create_order(self, data):
+        return self._request('POST', '/orders', data)
+
+    def fetch_order(self, order_id):
+        return self._request('GET', f'/orders/{order_id}')
+
+    def refund(self, razorpay_payment_id, data):
+        return self._request('POST', f'/payments/{razorpay_payment_id}/refund', data, idempotent=False)
+
+    def fetch_refunds(self, razorpay_payment_id):
+        return self._request('GET', f'/payments/{razorpay_payment_id}/refunds')['items']
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        """Whether signature is the checkout's HMAC of order_id|payment_id"""
+        expected = hmac.new(self.key_secret.encode(), f'{order_id}|{payment_id}'.encode(),
+                            hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected.encode(), str(signature).encode())
+
+    def verify_webhook_signature(self, body, signature):
+        """Whether signature is the HMAC of the raw webhook body; always False without a secret"""
+        if not self.webhook_secret:
+            return False
+        expected = hmac.new(self.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected.encode(), str(signature).encode())
+
+    def close(self):
+        self.session.close()
+
+
+def to_paise(amount):
+    """Rupees as the whole paise Razorpay expects; int() would turn 7499.97 into 749996"""
+    return round(amount * 100)
+
+
+def _error_description(response):
+    try:
+        return response.json()['error']['description']
+    except (ValueError, KeyError, TypeError):
+        return f'Payment gateway returned {response.status_code}'
+
+
+class PaymentGateway:
+    """Per-app RazorpayGateway built from config, reached through current_app"""
+
+    def init_app(self, app):
+        app.config.setdefault('RAZORPAY_BASE_URL', 'https://api.razorpay.com/v1')
+        app.config.setdefault('RAZORPAY_CONNECT_TIMEOUT', 2.0)
+        app.config.setdefault('RAZORPAY_READ_TIMEOUT', 8.0)
+        app.config.setdefault('RAZORPAY_MAX_RETRIES', 2)
+        app.config.setdefault('RAZORPAY_BACKOFF', 0.2)
+        app.config.setdefault('RAZORPAY_POOL_SIZE', 10)
+        app.config.setdefault('RAZORPAY_BREAKER_THRESHOLD', 5)
+        app.config.setdefault('RAZORPAY_BREAKER_RESET', 30.0)
+
+        app.extensions['payment_gateway'] = RazorpayGateway(
+            app.config.get('RAZORPAY_KEY_ID'),
+            app.config.get('RAZORPAY_KEY_SECRET'),
+            webhook_secret=app.config.get('RAZORPAY_WEBHOOK_SECRET'),
+            base_url=app.config['RAZORPAY_BASE_URL'],
+            connect_timeout=app.config['RAZORPAY_CONNECT_TIMEOUT'],
+            read_timeout=app.config['RAZORPAY_READ_TIMEOUT'],
+            max_retries=app.config['RAZORPAY_MAX_RETRIES'],
+            backoff=app.config['RAZORPAY_BACKOFF'],
+            pool_size=app.config['RAZORPAY_POOL_SIZE'],
+            breaker=CircuitBreaker(app.config['RAZORPAY_BREAKER_THRESHOLD'],
+                                   app.config['RAZORPAY_BREAKER_RESET'])
+        )
+
+    @property
+    def client(self):
+        return current_app.extensions['payment_gateway']
+
+    def create_order(self, data):
+        return self.client.create_order(data)
+
+    def fetch_order(self, order_id):
+        return self.client.fetch_order(order_id)
+
+    def refund(self, razorpay_payment_id, data):
+        return self.client.refund(razorpay_payment_id, data)
+
+    def fetch_refunds(self, razorpay_payment_id):
+        return self.client.fetch_refunds(razorpay_payment_id)
+
+    def verify_payment_signature(self, order_id, payment_id, signature):
+        return self.client.verify_payment_signature(order_id, payment_id, signature)
+
+    def verify_webhook_signature(self, body, signature):
+        return self.client.verify_webhook_signature(body, signature)
+
+
+def unavailable_response(error):
+    """503 answer for a call the gateway could not serve, with Retry-After when the breaker is open"""
+    response = jsonify({'error': 'Payment gateway is unavailable, please retry shortly'})
+    response.status_code = 503
+    if error.retry_after:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+
+payment_gateway = PaymentGateway()
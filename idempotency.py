@@ -0,0 +1,179 @@
+"""
+Idempotency-Key support for write endpoints that clients retry
+
+A request carrying an Idempotency-Key header claims (user, key) by inserting
+an idempotency_keys row; the unique constraint makes exactly one request win
+across every worker process. The winner runs the view and stores its status
+and body on the row. Later requests with the same key get that response back
+without the view running again, marked with an Idempotent-Replayed header.
+
+A duplicate that arrives while the first request is still running polls the
+row until the response is stored, for up to IDEMPOTENCY_WAIT seconds, and
+gets 409 with Retry-After if it is still not there. A key reused with a
+different method, path or body gets 422. Server errors are not stored: the
+row is dropped so a retry runs the view again. A claim whose request died
+without answering can be taken over after IDEMPOTENCY_LOCK_TIMEOUT seconds.
+
+Rows expire after IDEMPOTENCY_TTL seconds; an expired key is simply claimed
+afresh, and `flask purge-idempotency-keys` deletes expired rows in bulk.
+
+Configuration:
+    IDEMPOTENCY_TTL            seconds a stored response is replayed (default 86400)
+    IDEMPOTENCY_LOCK_TIMEOUT   seconds before a stuck claim is taken over (default 60)
+    IDEMPOTENCY_WAIT           seconds a duplicate waits for the first request (default 10)
+    IDEMPOTENCY_POLL_INTERVAL  seconds between looks while waiting (default 0.05)
+"""
+
+from datetime import datetime, timedelta
+from functools import wraps
+import hashlib
+import math
+import time
+import click
+from flask import current_app, jsonify, make_response, request
+from flask.cli import with_appcontext
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from models import db, IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Expired rows deleted per statement by purge_expired_keys
+PURGE_BATCH_SIZE = 1000
+
+
+def _request_hash():
+    return hashlib.sha256(f'{request.method} {request.path}\n'.encode() + request.get_data()).hexdigest()
+
+
+def _error(message, status_code, retry_after=None):
+    response = jsonify({'error': message})
+    response.status_code = status_code
+    if retry_after:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _replay(row):
+    response = current_app.response_class(row.response_body, status=row.status_code,
+                                           mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(user_id, key, request_hash):
+    """(row id, None) when this request should run the view, or (None, response) to answer with"""
+    config = current_app.config
+    ttl = timedelta(seconds=config.get('IDEMPOTENCY_TTL', 86400))
+    lock_timeout = timedelta(seconds=config.get('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+    wait = config.get('IDEMPOTENCY_WAIT', 10)
+    deadline = time.monotonic() + wait
+
+    while True:
+        now = datetime.utcnow()
+        row = IdempotencyKey(user_id=user_id, key=key, request_hash=request_hash,
+                             locked_until=now + lock_timeout, expires_at=now + ttl)
+        db.session.add(row)
+        try:
+            db.session.commit()
+            return row.id, None
+        except IntegrityError:
+            db.session.rollback()
+
+        existing = db.session.execute(
+            select(IdempotencyKey.id, IdempotencyKey.request_hash, IdempotencyKey.status_code,
+                   IdempotencyKey.response_body, IdempotencyKey.locked_until, IdempotencyKey.expires_at)
+            .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+        ).one_or_none()
+        if existing is None:
+            # The first request failed and dropped its claim
+            continue
+        if existing.expires_at <= now:
+            db.session.execute(delete(IdempotencyKey).where(
+                IdempotencyKey.id == existing.id, IdempotencyKey.expires_at == existing.expires_at))
+            db.session.commit()
+            continue
+        if existing.request_hash != request_hash:
+            return None, _error('Idempotency-Key was already used for a different request', 422)
+        if existing.status_code is not None:
+            return None, _replay(existing)
+        if existing.locked_until <= now:
+            # Whoever updates the stale lock first runs the view
+            taken = db.session.execute(
+                update(IdempotencyKey)
+                .where(IdempotencyKey.id == existing.id, IdempotencyKey.status_code.is_(None),
+                       IdempotencyKey.locked_until == existing.locked_until)
+                .values(locked_until=now + lock_timeout)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+            if taken:
+                return existing.id, None
+            continue
+        if time.monotonic() >= deadline:
+            return None, _error('A request with this Idempotency-Key is still in progress', 409,
+                                retry_after=max(1, math.ceil(wait)))
+        # End the transaction so the next look sees the first request's commit
+        db.session.rollback()
+        time.sleep(config.get('IDEMPOTENCY_POLL_INTERVAL', 0.05))
+
+
+def _finish(row_id, response):
+    # Whatever the view left uncommitted is not part of its answer
+    db.session.rollback()
+    if response is None or response.status_code >= 500:
+        # Let a retry run the view again
+        db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == row_id))
+    else:
+        db.session.execute(
+            update(IdempotencyKey).where(IdempotencyKey.id == row_id)
+            .values(status_code=response.status_code, response_body=response.get_data(as_text=True),
+                    locked_until=None)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+
+
+def idempotent(f):
+    """Run the view at most once per Idempotency-Key and user; place it below @jwt_required()"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return _error(f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters', 400)
+
+        row_id, answer = _claim(int(get_jwt_identity()), key, _request_hash())
+        if answer is not None:
+            return answer
+
+        response = None
+        try:
+            response = make_response(f(*args, **kwargs))
+        finally:
+            _finish(row_id, response)
+        return response
+    return decorated_function
+
+
+def purge_expired_keys(batch_size=PURGE_BATCH_SIZE):
+    """Delete expired keys in batches; returns how many were deleted"""
+    deleted = 0
+    while True:
+        ids = db.session.execute(
+            select(IdempotencyKey.id).where(IdempotencyKey.expires_at <= datetime.utcnow()).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            return deleted
+        deleted += db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id.in_(ids))).rowcount
+        db.session.commit()
+
+
+@click.command('purge-idempotency-keys')
+@with_appcontext
+def purge_idempotency_keys_command():
+    """Delete expired idempotency keys"""
+    click.echo(f'Deleted {purge_expired_keys()} expired idempotency keys')
@@ -5,6 +5,7 @@ Database initialization script for Tourism Management System
 
 from app import app, db
 from models import User, TravelPackage, UserRole
+from search import rebuild_search_index
 from datetime import datetime, date, timedelta
 import json
 
@@ -142,6 +143,9 @@ def init_database():
         
         # Commit all changes
         db.session.commit()
+        
+        # Index packages for full-text search
+        rebuild_search_index()
         print("Database initialization completed successfully!")
 
 if __name__ == '__main__':
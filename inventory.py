@@ -0,0 +1,149 @@
+"""
+Seat inventory per package and departure date
+
+Each (package, day) that has ever been booked has a package_inventory row
+holding its capacity (the package's max_travelers) and the seats remaining.
+The migration that added the table wrote rows for every date already booked,
+so a day without a row has all of its seats free.
+
+Seats are taken with a single conditional UPDATE ... WHERE remaining >= n, so
+two requests racing for the last seats cannot both succeed: the database
+serialises the updates on the row and the loser matches nothing. A missing
+row is created on first use, from the bookings already on that date.
+
+Every change of a booking's status goes through set_booking_status(), which
+gives the seats back when a booking is cancelled or refunded and takes them
+again if it is reinstated. A payment captured for a booking that was
+cancelled meanwhile re-reserves its seats through confirm_paid_booking(); if
+they have been sold since, the payment is queued for a refund instead.
+Changing a package's max_travelers goes through change_capacity(), which
+moves the capacity and remaining seats of its rows by the same amount.
+
+All of it happens in the caller's transaction; the committed changes are
+also applied to the precomputed calendars in availability.py.
+"""
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from models import db, Booking, BookingStatus, PackageInventory
+from availability import note_seat_change
+from jobs import enqueue
+
+# Bookings in these statuses hold their seats
+ACTIVE_STATUSES = (BookingStatus.PENDING, BookingStatus.CONFIRMED, BookingStatus.COMPLETED)
+
+
+class SoldOut(Exception):
+    """Not enough seats left on the date"""
+
+    def __init__(self, remaining):
+        super().__init__(f'Only {remaining} seats left on this date' if remaining else 'This date is sold out')
+        self.remaining = remaining
+
+
+class CapacityBelowBookings(Exception):
+    """A package's capacity cannot drop below the seats already booked on a date"""
+
+    def __init__(self, day, booked):
+        super().__init__(f'{booked} seats are already booked on {day.isoformat()}')
+        self.day = day
+        self.booked = booked
+
+
+def _create_row(package, day):
+    booked = db.session.execute(
+        select(func.coalesce(func.sum(Booking.number_of_travelers), 0)).where(
+            Booking.package_id == package.id, Booking.booking_date == day,
+            Booking.status.in_(ACTIVE_STATUSES)
+        )
+    ).scalar()
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(PackageInventory).values(
+                package_id=package.id, day=day, capacity=package.max_travelers,
+                remaining=max(0, package.max_travelers - booked)
+            ))
+    except IntegrityError:
+        pass  # Created by a concurrent request
+
+
+def reserve_seats(package, day, seats):
+    """Take seats on the package's departure day or raise SoldOut"""
+    for _ in range(2):
+        reserved = db.session.execute(
+            update(PackageInventory)
+            .where(PackageInventory.package_id == package.id, PackageInventory.day == day,
+                   PackageInventory.remaining >= seats)
+            .values(remaining=PackageInventory.remaining - seats)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if reserved:
+            note_seat_change(package.id, day, -seats)
+            return
+        remaining = db.session.execute(
+            select(PackageInventory.remaining).where(
+                PackageInventory.package_id == package.id, PackageInventory.day == day)
+        ).scalar()
+        if remaining is not None:
+            raise SoldOut(remaining)
+        _create_row(package, day)
+    raise SoldOut(0)
+
+
+def release_seats(package_id, day, seats):
+    """Give seats back to the departure day"""
+    released = db.session.execute(
+        update(PackageInventory)
+        .where(PackageInventory.package_id == package_id, PackageInventory.day == day)
+        .values(remaining=PackageInventory.remaining + seats)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if released:
+        note_seat_change(package_id, day, seats)
+
+
+def change_capacity(package, max_travelers):
+    """Shift every ledger row of the package to a new max_travelers; may raise CapacityBelowBookings"""
+    delta = max_travelers - package.max_travelers
+    if delta:
+        db.session.execute(
+            update(PackageInventory)
+            .where(PackageInventory.package_id == package.id)
+            .values(capacity=PackageInventory.capacity + delta, remaining=PackageInventory.remaining + delta)
+            .execution_options(synchronize_session=False)
+        )
+        # Checked after the UPDATE, which holds the rows against concurrent reservations
+        overbooked = db.session.execute(
+            select(PackageInventory.day, PackageInventory.capacity - PackageInventory.remaining)
+            .where(PackageInventory.package_id == package.id, PackageInventory.remaining < 0)
+            .order_by(PackageInventory.day).limit(1)
+        ).first()
+        if overbooked:
+            raise CapacityBelowBookings(*overbooked)
+    package.max_travelers = max_travelers
+
+
+def set_booking_status(booking, status):
+    """Change a booking's status, releasing or re-reserving its seats; may raise SoldOut"""
+    was_active = booking.status in ACTIVE_STATUSES
+    if status in ACTIVE_STATUSES and not was_active:
+        reserve_seats(booking.package, booking.booking_date, booking.number_of_travelers)
+    elif was_active and status not in ACTIVE_STATUSES:
+        release_seats(booking.package_id, booking.booking_date, booking.number_of_travelers)
+    booking.status = status
+
+
+def confirm_paid_booking(payment):
+    """Confirm the booking of a captured payment; returns False and queues a refund when its seats are gone"""
+    booking = payment.booking
+    if booking.status in (BookingStatus.CONFIRMED, BookingStatus.COMPLETED):
+        return True
+    try:
+        set_booking_status(booking, BookingStatus.CONFIRMED)
+    except SoldOut:
+        enqueue('refund_payment', {
+            'payment_id': payment.id,
+            'reason': 'Seats sold out before the payment was captured'
+        }, key=f'refund:{payment.id}')
+        return False
+    return True
@@ -0,0 +1,177 @@
+"""
+Database-backed background jobs
+
+Handlers call enqueue() to add a Job row to the current session, so the job
+commits or rolls back together with the request's own changes and the request
+can answer 202 straight away. Workers started with `flask run-jobs` claim due
+jobs with a conditional UPDATE, which is safe across processes without row
+locks, run the registered task and record its result.
+
+A claimed job stays invisible to other workers for JOB_VISIBILITY_TIMEOUT
+seconds; if its worker dies the job becomes claimable again after that, so
+tasks must tolerate running more than once. Failures are retried with
+exponential backoff and jitter until the job's max_attempts is used up, then
+the job is dead until an admin retries it. Tasks raise PermanentJobError for
+failures that retrying cannot fix.
+
+Configuration:
+    JOB_VISIBILITY_TIMEOUT  seconds a claimed job stays invisible (default 300)
+    JOB_MAX_ATTEMPTS        attempts before a job is dead (default 5)
+    JOB_RETRY_BACKOFF       base delay in seconds before a retry (default 30)
+    JOB_POLL_INTERVAL       seconds an idle worker sleeps between polls (default 1)
+"""
+
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import socket
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, or_, select, update
+from models import db, Job, JobStatus
+
+# Task name -> function called with the job's payload as keyword arguments
+TASKS = {}
+
+# Due jobs looked at per claim; others may be taken by competing workers
+CLAIM_CANDIDATES = 10
+
+
+class PermanentJobError(Exception):
+    """Raised by a task whose failure retrying cannot fix"""
+
+
+def task(name):
+    """Decorator registering a function as the task called name"""
+    def decorator(f):
+        TASKS[name] = f
+        return f
+    return decorator
+
+
+def enqueue(task_name, payload=None, key=None, max_attempts=None, delay=0):
+    """
+    Add a job to the session; it runs once the caller commits.
+
+    With a key, an unfinished job with the same key is returned instead of
+    adding a second one.
+    """
+    if key is not None:
+        existing = Job.query.filter(
+            Job.key == key, Job.status.in_([JobStatus.QUEUED, JobStatus.RUNNING])
+        ).first()
+        if existing:
+            return existing
+
+    job = Job(
+        task=task_name,
+        payload=json.dumps(payload or {}),
+        key=key,
+        max_attempts=max_attempts or current_app.config.get('JOB_MAX_ATTEMPTS', 5),
+        run_at=datetime.utcnow() + timedelta(seconds=delay)
+    )
+    db.session.add(job)
+    return job
+
+
+def _due(now):
+    return or_(
+        and_(Job.status == JobStatus.QUEUED, Job.run_at <= now),
+        # Running jobs whose worker died before the visibility timeout ran out
+        and_(Job.status == JobStatus.RUNNING, Job.locked_until < now)
+    )
+
+
+def claim_job(worker_id):
+    """Claim the next due job for worker_id, or return None when there is none"""
+    now = datetime.utcnow()
+    visibility = timedelta(seconds=current_app.config.get('JOB_VISIBILITY_TIMEOUT', 300))
+    candidates = db.session.execute(
+        select(Job.id).where(_due(now)).order_by(Job.run_at, Job.id).limit(CLAIM_CANDIDATES)
+    ).scalars().all()
+
+    for job_id in candidates:
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, _due(now))
+            .values(status=JobStatus.RUNNING, locked_by=worker_id, locked_until=now + visibility,
+                    attempts=Job.attempts + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def _finish(job_id, worker_id, **values):
+    """Record the outcome unless another worker has taken the job over meanwhile"""
+    db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.locked_by == worker_id, Job.status == JobStatus.RUNNING)
+        .values(locked_until=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def run_job(job, worker_id):
+    """Run a claimed job, committing the task's changes together with its outcome"""
+    job_id, attempts, max_attempts = job.id, job.attempts, job.max_attempts
+    try:
+        if attempts > max_attempts:
+            raise PermanentJobError('Visibility timeout expired on the last attempt')
+        handler = TASKS.get(job.task)
+        if handler is None:
+            raise PermanentJobError(f'Unknown task: {job.task}')
+        result = handler(**json.loads(job.payload))
+        _finish(job_id, worker_id, status=JobStatus.SUCCEEDED, result=json.dumps(result),
+                finished_at=datetime.utcnow())
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        error = f'{type(e).__name__}: {e}'
+        if isinstance(e, PermanentJobError) or attempts >= max_attempts:
+            _finish(job_id, worker_id, status=JobStatus.DEAD, last_error=error, finished_at=datetime.utcnow())
+        else:
+            backoff = current_app.config.get('JOB_RETRY_BACKOFF', 30) * 2 ** (attempts - 1)
+            run_at = datetime.utcnow() + timedelta(seconds=backoff * random.uniform(0.5, 1.5))
+            _finish(job_id, worker_id, status=JobStatus.QUEUED, last_error=error, run_at=run_at)
+        db.session.commit()
+        return False
+
+
+def work(worker_id=None, burst=False, max_jobs=None):
+    """Claim and run jobs until stopped; with burst, return once none are due"""
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        job = claim_job(worker_id)
+        if job is None:
+            if burst:
+                break
+            time.sleep(current_app.config.get('JOB_POLL_INTERVAL', 1))
+            continue
+        run_job(job, worker_id)
+        processed += 1
+    return processed
+
+
+def retry_job(job):
+    """Queue a dead job again with a fresh set of attempts"""
+    job.status = JobStatus.QUEUED
+    job.attempts = 0
+    job.run_at = datetime.utcnow()
+    job.finished_at = None
+
+
+@click.command('run-jobs')
+@click.option('--burst', is_flag=True, help='Exit once no jobs are due')
+@with_appcontext
+def run_jobs_command(burst):
+    """Run a background job worker; start several processes for more throughput"""
+    processed = work(burst=burst)
+    click.echo(f'Processed {processed} jobs')
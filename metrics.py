@@ -0,0 +1,270 @@
+"""
+Daily metrics rollup
+
+The daily_metrics table holds one row per (day, package) with bookings by
+status, revenue from completed payments, reviews and, on the site-wide
+package_id 0 row, new users. Days are UTC and come from each record's
+created_at, so a booking stays on the day it was made and moves between the
+status columns as its status changes.
+
+An after_flush listener derives the changes from every booking, payment,
+review and user written through the session and applies them as increments
+within the same transaction, so the rollup commits or rolls back with the
+write that caused it. backfill_metrics() rebuilds a date range from the
+source tables.
+"""
+
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, inspect
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Booking, BookingStatus, DailyMetric, Payment, PaymentStatus, Review, User
+
+GRANULARITIES = ('day', 'week', 'month')
+
+
+def _day(value):
+    return (value or datetime.utcnow()).date()
+
+
+def _booking_status(status):
+    # Some handlers assign the raw value rather than the enum member
+    return status if isinstance(status, BookingStatus) else BookingStatus(status)
+
+
+def _contributions(session, obj, value):
+    """
+    Rollup counters a record adds while it exists, as (day, package_id, counters).
+
+    ``value(name)`` returns the attribute to use, so the same rules give both
+    the before and after picture of a changed record.
+    """
+    if isinstance(obj, Booking):
+        status = _booking_status(value('status') or BookingStatus.PENDING)
+        return [(_day(value('created_at')), value('package_id'), {f'bookings_{status.value}': 1})]
+    if isinstance(obj, Payment):
+        if value('status') != PaymentStatus.COMPLETED:
+            return []
+        booking = session.get(Booking, value('booking_id'))
+        package_id = booking.package_id if booking else DailyMetric.SITE_WIDE
+        return [(_day(value('created_at')), package_id, {'revenue': value('amount')})]
+    if isinstance(obj, Review):
+        return [(_day(value('created_at')), value('package_id'),
+                 {'reviews': 1, 'review_rating_sum': value('rating')})]
+    if isinstance(obj, User):
+        return [(_day(value('created_at')), DailyMetric.SITE_WIDE, {'new_users': 1})]
+    return []
+
+
+def _previous_value(obj):
+    state = inspect(obj)
+
+    def value(name):
+        history = state.attrs[name].history
+        return history.deleted[0] if history.deleted else getattr(obj, name)
+    return value
+
+
+# Attributes the rollup is derived from. Listening with active_history makes
+# SQLAlchemy load the previous value even when an expired attribute is
+# assigned, so the old contribution can always be subtracted.
+TRACKED_ATTRIBUTES = (
+    Booking.status, Booking.created_at, Booking.package_id,
+    Payment.status, Payment.amount, Payment.created_at, Payment.booking_id,
+    Review.rating, Review.created_at, Review.package_id,
+    User.created_at
+)
+
+
+def _keep_history(target, value, oldvalue, initiator):
+    pass
+
+
+for attribute in TRACKED_ATTRIBUTES:
+    event.listen(attribute, 'set', _keep_history, active_history=True)
+
+
+def _collect_deltas(session):
+    deltas = defaultdict(Counter)
+
+    def add(contributions, sign):
+        for day, package_id, counters in contributions:
+            for name, amount in counters.items():
+                deltas[(day, package_id)][name] += sign * amount
+
+    for obj in session.new:
+        add(_contributions(session, obj, lambda name: getattr(obj, name)), 1)
+    for obj in session.dirty:
+        add(_contributions(session, obj, lambda name: getattr(obj, name)), 1)
+        add(_contributions(session, obj, _previous_value(obj)), -1)
+    for obj in session.deleted:
+        add(_contributions(session, obj, _previous_value(obj)), -1)
+
+    return {key: {name: amount for name, amount in counters.items() if amount}
+            for key, counters in deltas.items()}
+
+
+def _increment(connection, day, package_id, counters):
+    """Add counters to a rollup row, creating it on first use"""
+    table = DailyMetric.__table__
+    increments = {name: table.c[name] + amount for name, amount in counters.items()}
+    row = {'day': day, 'package_id': package_id, **counters}
+    dialect = connection.dialect.name
+
+    if dialect == 'sqlite':
+        statement = sqlite_insert(table).values(**row).on_conflict_do_update(
+            index_elements=['day', 'package_id'], set_=increments
+        )
+    elif dialect == 'mysql':
+        statement = mysql_insert(table).values(**row).on_duplicate_key_update(**increments)
+    else:
+        result = connection.execute(table.update().where(
+            table.c.day == day, table.c.package_id == package_id
+        ).values(**increments))
+        if result.rowcount:
+            return
+        statement = table.insert().values(**row)
+    connection.execute(statement)
+
+
+@event.listens_for(db.session, 'after_flush')
+def record_metrics(session, flush_context):
+    deltas = _collect_deltas(session)
+    if not deltas:
+        return
+    connection = session.connection()
+    for (day, package_id), counters in sorted(deltas.items()):
+        if counters:
+            _increment(connection, day, package_id, counters)
+
+
+def backfill_metrics(start=None, end=None):
+    """
+    Recompute the rollup rows between start and end (inclusive, default all
+    history) from the bookings, payments, reviews and users tables.
+    """
+    def in_range(query, column):
+        if start:
+            query = query.filter(column >= datetime.combine(start, datetime.min.time()))
+        if end:
+            query = query.filter(column < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+        return query
+
+    rows = defaultdict(Counter)
+
+    bookings = in_range(db.session.query(
+        func.date(Booking.created_at), Booking.package_id, Booking.status, func.count(Booking.id)
+    ), Booking.created_at).group_by(func.date(Booking.created_at), Booking.package_id, Booking.status)
+    for day, package_id, status, count in bookings:
+        rows[(day, package_id)][f'bookings_{status.value}'] += count
+
+    payments = in_range(db.session.query(
+        func.date(Payment.created_at), Booking.package_id, func.sum(Payment.amount)
+    ).join(Booking, Payment.booking_id == Booking.id).filter(
+        Payment.status == PaymentStatus.COMPLETED
+    ), Payment.created_at).group_by(func.date(Payment.created_at), Booking.package_id)
+    for day, package_id, revenue in payments:
+        rows[(day, package_id)]['revenue'] += revenue
+
+    reviews = in_range(db.session.query(
+        func.date(Review.created_at), Review.package_id, func.count(Review.id), func.sum(Review.rating)
+    ), Review.created_at).group_by(func.date(Review.created_at), Review.package_id)
+    for day, package_id, count, rating_sum in reviews:
+        rows[(day, package_id)]['reviews'] += count
+        rows[(day, package_id)]['review_rating_sum'] += rating_sum
+
+    users = in_range(db.session.query(
+        func.date(User.created_at), func.count(User.id)
+    ), User.created_at).group_by(func.date(User.created_at))
+    for day, count in users:
+        rows[(day, DailyMetric.SITE_WIDE)]['new_users'] += count
+
+    deleted = DailyMetric.query
+    if start:
+        deleted = deleted.filter(DailyMetric.day >= start)
+    if end:
+        deleted = deleted.filter(DailyMetric.day <= end)
+    deleted.delete(synchronize_session=False)
+
+    if rows:
+        # SQLite returns DATE() as text
+        db.session.execute(DailyMetric.__table__.insert(), [
+            {'day': date.fromisoformat(day) if isinstance(day, str) else day,
+             'package_id': package_id,
+             **{name: counters[name] for name in DailyMetric.COUNTERS}}
+            for (day, package_id), counters in rows.items()
+        ])
+    db.session.commit()
+    return len(rows)
+
+
+def _period_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _next_period(start, granularity):
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def _summary(counters):
+    bookings = {status.value: int(counters[f'bookings_{status.value}']) for status in BookingStatus}
+    bookings['total'] = sum(bookings.values())
+    reviews = int(counters['reviews'])
+    return {
+        'bookings': bookings,
+        'revenue': round(float(counters['revenue']), 2),
+        'new_users': int(counters['new_users']),
+        'reviews': reviews,
+        'average_rating': round(counters['review_rating_sum'] / reviews, 2) if reviews else None
+    }
+
+
+def metrics_series(start, end, granularity='day', package_id=None):
+    """
+    Rollup totals per period between start and end (inclusive), read from
+    daily_metrics only. Periods with no activity are included as zeros.
+
+    With package_id the package-level figures are limited to that package;
+    new_users is site-wide either way.
+    """
+    query = db.session.query(
+        DailyMetric.day, *[func.sum(getattr(DailyMetric, name)) for name in DailyMetric.COUNTERS]
+    ).filter(DailyMetric.day >= start, DailyMetric.day <= end)
+    if package_id is not None:
+        query = query.filter(DailyMetric.package_id.in_([package_id, DailyMetric.SITE_WIDE]))
+
+    periods = defaultdict(Counter)
+    totals = Counter()
+    for day, *sums in query.group_by(DailyMetric.day):
+        counters = {name: value or 0 for name, value in zip(DailyMetric.COUNTERS, sums)}
+        periods[_period_start(day, granularity)].update(counters)
+        totals.update(counters)
+
+    series = []
+    period = _period_start(start, granularity)
+    while period <= end:
+        series.append({'period': period.isoformat(), **_summary(periods[period])})
+        period = _next_period(period, granularity)
+
+    return {'series': series, 'totals': _summary(totals)}
+
+
+@click.command('backfill-metrics')
+@click.option('--from', 'start', type=click.DateTime(formats=['%Y-%m-%d']), help='First day to rebuild')
+@click.option('--to', 'end', type=click.DateTime(formats=['%Y-%m-%d']), help='Last day to rebuild')
+@with_appcontext
+def backfill_metrics_command(start, end):
+    """Rebuild the daily metrics rollup from the source tables"""
+    rebuilt = backfill_metrics(start.date() if start else None, end.date() if end else None)
+    click.echo(f'Rebuilt {rebuilt} daily metric rows')
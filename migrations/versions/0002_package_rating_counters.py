@@ -0,0 +1,35 @@
+"""package rating counters
+
+Revision ID: 0002_package_rating_counters
+Revises: 0001_initial_schema
+Create Date: 2026-10-17 10:03:47.118520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_package_rating_counters'
+down_revision = '0001_initial_schema'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('travel_packages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('rating_sum', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill the counters from existing reviews
+    op.execute("""
+        UPDATE travel_packages SET
+            rating_sum = COALESCE((SELECT SUM(reviews.rating) FROM reviews WHERE reviews.package_id = travel_packages.id), 0),
+            rating_count = (SELECT COUNT(reviews.id) FROM reviews WHERE reviews.package_id = travel_packages.id)
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('travel_packages', schema=None) as batch_op:
+        batch_op.drop_column('rating_count')
+        batch_op.drop_column('rating_sum')
@@ -0,0 +1,37 @@
+"""package rating score
+
+Revision ID: 0003_package_rating_score
+Revises: 0002_package_rating_counters
+Create Date: 2026-10-17 11:20:05.637914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_package_rating_score'
+down_revision = '0002_package_rating_counters'
+branch_labels = None
+depends_on = None
+
+# Mirrors RATING_PRIOR_MEAN and RATING_PRIOR_WEIGHT in models.py at the time of this revision
+PRIOR_MEAN = 3.0
+PRIOR_WEIGHT = 5
+
+
+def upgrade():
+    with op.batch_alter_table('travel_packages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('rating_score', sa.Float(), server_default=str(PRIOR_MEAN), nullable=False))
+        batch_op.create_index('ix_travel_packages_active_rating', ['is_active', 'rating_score', 'rating_count'], unique=False)
+
+    op.execute(
+        f"UPDATE travel_packages SET rating_score = "
+        f"({PRIOR_MEAN * PRIOR_WEIGHT} + rating_sum) / ({PRIOR_WEIGHT} + rating_count)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('travel_packages', schema=None) as batch_op:
+        batch_op.drop_index('ix_travel_packages_active_rating')
+        batch_op.drop_column('rating_score')
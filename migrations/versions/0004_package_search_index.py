@@ -0,0 +1,46 @@
+"""package full-text search index
+
+Revision ID: 0004_package_search_index
+Revises: 0003_package_rating_score
+Create Date: 2026-10-17 12:41:18.250963
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_package_search_index'
+down_revision = '0003_package_rating_score'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS travel_packages_fts "
+            "USING fts5(title, destination, description, includes)"
+        )
+        # includes is indexed as stored; 'flask rebuild-search-index' flattens the JSON lists
+        op.execute(
+            "INSERT INTO travel_packages_fts (rowid, title, destination, description, includes) "
+            "SELECT id, title, destination, COALESCE(description, ''), COALESCE(includes, '') "
+            "FROM travel_packages"
+        )
+    elif dialect == 'mysql':
+        op.execute(
+            "CREATE FULLTEXT INDEX ix_travel_packages_fulltext "
+            "ON travel_packages (title, destination, description, includes)"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS travel_packages_fts")
+    elif dialect == 'mysql':
+        op.drop_index('ix_travel_packages_fulltext', table_name='travel_packages')
@@ -0,0 +1,31 @@
+"""package reviews_updated_at
+
+Revision ID: 0005_package_reviews_updated_at
+Revises: 0004_package_search_index
+Create Date: 2026-10-17 14:08:52.774301
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_package_reviews_updated_at'
+down_revision = '0004_package_search_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('travel_packages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reviews_updated_at', sa.DateTime(), nullable=True))
+
+    op.execute(
+        "UPDATE travel_packages SET reviews_updated_at = "
+        "(SELECT MAX(reviews.updated_at) FROM reviews WHERE reviews.package_id = travel_packages.id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('travel_packages', schema=None) as batch_op:
+        batch_op.drop_column('reviews_updated_at')
@@ -0,0 +1,39 @@
+"""daily metrics rollup
+
+Revision ID: 0006_daily_metrics
+Revises: 0005_package_reviews_updated_at
+Create Date: 2026-10-17 15:02:11.418230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_daily_metrics'
+down_revision = '0005_package_reviews_updated_at'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Populate with `flask backfill-metrics` after upgrading
+    op.create_table('daily_metrics',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('package_id', sa.Integer(), nullable=False),
+        sa.Column('bookings_pending', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('bookings_confirmed', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('bookings_completed', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('bookings_cancelled', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('revenue', sa.Float(), server_default='0', nullable=False),
+        sa.Column('new_users', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('reviews', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('review_rating_sum', sa.Integer(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('day', 'package_id', name='uq_daily_metrics_day_package')
+    )
+
+
+def downgrade():
+    op.drop_table('daily_metrics')
@@ -0,0 +1,26 @@
+"""user token_version
+
+Revision ID: 0007_user_token_version
+Revises: 0006_daily_metrics
+Create Date: 2026-10-17 16:21:47.095512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_user_token_version'
+down_revision = '0006_daily_metrics'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('token_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('token_version')
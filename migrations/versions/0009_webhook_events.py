@@ -0,0 +1,47 @@
+"""webhook events
+
+Revision ID: 0009_webhook_events
+Revises: 0008_jobs
+Create Date: 2026-10-17 22:59:31.364652
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_webhook_events'
+down_revision = '0008_jobs'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('webhook_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('event_id', sa.String(length=100), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('received_at', sa.DateTime(), nullable=False),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.Column('outcome', sa.String(length=20), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('webhook_events', schema=None) as batch_op:
+        batch_op.create_index('ix_webhook_events_event_id', ['event_id'], unique=False)
+        batch_op.create_index('ix_webhook_events_processed_at', ['processed_at'], unique=False)
+
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.create_index('ix_payments_razorpay_order_id', ['razorpay_order_id'], unique=False)
+        batch_op.create_index('ix_payments_razorpay_payment_id', ['razorpay_payment_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.drop_index('ix_payments_razorpay_payment_id')
+        batch_op.drop_index('ix_payments_razorpay_order_id')
+
+    with op.batch_alter_table('webhook_events', schema=None) as batch_op:
+        batch_op.drop_index('ix_webhook_events_processed_at')
+        batch_op.drop_index('ix_webhook_events_event_id')
+
+    op.drop_table('webhook_events')
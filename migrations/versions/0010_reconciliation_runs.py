@@ -0,0 +1,35 @@
+"""reconciliation runs
+
+Revision ID: 0010_reconciliation_runs
+Revises: 0009_webhook_events
+Create Date: 2026-10-17 23:02:30.924491
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_reconciliation_runs'
+down_revision = '0009_webhook_events'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('reconciliation_runs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('upper_payment_id', sa.Integer(), nullable=False),
+        sa.Column('last_payment_id', sa.Integer(), nullable=False),
+        sa.Column('checked', sa.Integer(), nullable=False),
+        sa.Column('fixed', sa.Integer(), nullable=False),
+        sa.Column('discrepancies', sa.Integer(), nullable=False),
+        sa.Column('report_path', sa.String(length=255), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('reconciliation_runs')
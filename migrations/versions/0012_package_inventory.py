@@ -0,0 +1,44 @@
+"""package inventory
+
+Revision ID: 0012_package_inventory
+Revises: 0011_idempotency_keys
+Create Date: 2026-10-17 23:10:41.212517
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012_package_inventory'
+down_revision = '0011_idempotency_keys'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('package_inventory',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('package_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('capacity', sa.Integer(), nullable=False),
+        sa.Column('remaining', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['package_id'], ['travel_packages.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('package_id', 'day', name='uq_package_inventory_package_day')
+    )
+
+    # Seats already held by bookings that are not cancelled
+    op.execute("""
+        INSERT INTO package_inventory (package_id, day, capacity, remaining)
+        SELECT bookings.package_id, bookings.booking_date, travel_packages.max_travelers,
+            CASE WHEN travel_packages.max_travelers > SUM(bookings.number_of_travelers)
+                THEN travel_packages.max_travelers - SUM(bookings.number_of_travelers) ELSE 0 END
+        FROM bookings JOIN travel_packages ON travel_packages.id = bookings.package_id
+        WHERE bookings.status != 'CANCELLED'
+        GROUP BY bookings.package_id, bookings.booking_date, travel_packages.max_travelers
+    """)
+
+
+def downgrade():
+    op.drop_table('package_inventory')
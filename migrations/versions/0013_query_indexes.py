@@ -0,0 +1,101 @@
+"""query indexes
+
+Revision ID: 0013_query_indexes
+Revises: 0012_package_inventory
+Create Date: 2026-10-17 23:21:07.508113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0013_query_indexes'
+down_revision = '0012_package_inventory'
+branch_labels = None
+depends_on = None
+
+# Mirrors RATING_PRIOR_MEAN and RATING_PRIOR_WEIGHT in models.py at the time of this revision
+PRIOR_MEAN = 3.0
+PRIOR_WEIGHT = 5
+
+# Every review but the earliest of each (user, package) pair
+DUPLICATE_REVIEW = """reviews.id NOT IN (
+    SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM reviews GROUP BY user_id, package_id) AS kept
+)"""
+
+
+def upgrade():
+    # The API refuses a second review or wishlist entry, but racing requests
+    # could get past that check; keep the earliest row of each pair
+    op.execute("""
+        DELETE FROM wishlist WHERE id NOT IN (
+            SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM wishlist GROUP BY user_id, package_id) AS kept
+        )
+    """)
+    # Take the duplicate reviews back out of the daily_metrics rollup they were counted in
+    op.execute(f"""
+        UPDATE daily_metrics SET
+            reviews = reviews - (
+                SELECT COUNT(reviews.id) FROM reviews
+                WHERE {DUPLICATE_REVIEW} AND reviews.package_id = daily_metrics.package_id
+                  AND DATE(reviews.created_at) = daily_metrics.day
+            ),
+            review_rating_sum = review_rating_sum - (
+                SELECT COALESCE(SUM(reviews.rating), 0) FROM reviews
+                WHERE {DUPLICATE_REVIEW} AND reviews.package_id = daily_metrics.package_id
+                  AND DATE(reviews.created_at) = daily_metrics.day
+            )
+    """)
+    op.execute(f"DELETE FROM reviews WHERE {DUPLICATE_REVIEW}")
+    op.execute("""
+        UPDATE travel_packages SET
+            rating_sum = COALESCE((SELECT SUM(reviews.rating) FROM reviews WHERE reviews.package_id = travel_packages.id), 0),
+            rating_count = (SELECT COUNT(reviews.id) FROM reviews WHERE reviews.package_id = travel_packages.id)
+    """)
+    op.execute(
+        f"UPDATE travel_packages SET rating_score = "
+        f"({PRIOR_MEAN * PRIOR_WEIGHT} + rating_sum) / ({PRIOR_WEIGHT} + rating_count)"
+    )
+
+    with op.batch_alter_table('bookings', schema=None) as batch_op:
+        batch_op.create_index('ix_bookings_package_status', ['package_id', 'status'], unique=False)
+        batch_op.create_index('ix_bookings_user_status', ['user_id', 'status'], unique=False)
+
+    with op.batch_alter_table('itineraries', schema=None) as batch_op:
+        batch_op.create_index('ix_itineraries_booking_day', ['booking_id', 'day_number'], unique=False)
+
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.create_index('ix_payments_booking_id', ['booking_id'], unique=False)
+
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.create_index('ix_reviews_package_created', ['package_id', 'created_at'], unique=False)
+        batch_op.create_unique_constraint('uq_reviews_user_package', ['user_id', 'package_id'])
+
+    with op.batch_alter_table('travel_packages', schema=None) as batch_op:
+        batch_op.create_index('ix_travel_packages_active_price', ['is_active', 'price'], unique=False)
+
+    with op.batch_alter_table('wishlist', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_wishlist_user_package', ['user_id', 'package_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('wishlist', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_wishlist_user_package', type_='unique')
+
+    with op.batch_alter_table('travel_packages', schema=None) as batch_op:
+        batch_op.drop_index('ix_travel_packages_active_price')
+
+    with op.batch_alter_table('reviews', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_reviews_user_package', type_='unique')
+        batch_op.drop_index('ix_reviews_package_created')
+
+    with op.batch_alter_table('payments', schema=None) as batch_op:
+        batch_op.drop_index('ix_payments_booking_id')
+
+    with op.batch_alter_table('itineraries', schema=None) as batch_op:
+        batch_op.drop_index('ix_itineraries_booking_day')
+
+    with op.batch_alter_table('bookings', schema=None) as batch_op:
+        batch_op.drop_index('ix_bookings_user_status')
+        batch_op.drop_index('ix_bookings_package_status')
@@ -0,0 +1,28 @@
+"""package version
+
+Revision ID: 0014_package_version
+Revises: 0013_query_indexes
+Create Date: 2026-10-18 09:42:13.418206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0014_package_version'
+down_revision = '0013_query_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('travel_packages', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        batch_op.create_index('ix_travel_packages_version', ['version'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('travel_packages', schema=None) as batch_op:
+        batch_op.drop_index('ix_travel_packages_version')
+        batch_op.drop_column('version')
@@ -1,8 +1,12 @@
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import object_session
 import enum
+import json
 from database import db
+from cache import LRUCache
+from passwords import password_hasher
 
 class UserRole(enum.Enum):
     END_USER = "end_user"
@@ -21,6 +25,17 @@ class PaymentStatus(enum.Enum):
     FAILED = "failed"
     REFUNDED = "refunded"
 
+class JobStatus(enum.Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    DEAD = "dead"
+
+# Bayesian prior for package rating scores: every package starts as if it had
+# RATING_PRIOR_WEIGHT reviews of RATING_PRIOR_MEAN stars
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 5
+
 class User(db.Model):
     __tablename__ = 'users'
     
@@ -31,6 +46,7 @@ class User(db.Model):
     password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.Enum(UserRole), default=UserRole.END_USER, nullable=False)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+    token_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # Bumped to revoke issued tokens
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -39,10 +55,13 @@ class User(db.Model):
     reviews = db.relationship('Review', backref='user', lazy=True)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        return password_hasher.needs_rehash(self.password_hash)
     
     def to_dict(self):
         return {
@@ -56,8 +75,27 @@ class User(db.Model):
             'updated_at': self.updated_at.isoformat()
         }
 
+# Parsed includes/excludes/images keyed on (package id, version); any edit
+# bumps the version, so stale entries are simply never looked up again
+PACKAGE_LISTS_CACHE_SIZE = 2048
+_package_lists_cache = LRUCache(maxsize=PACKAGE_LISTS_CACHE_SIZE)
+
+def _load_json_list(value):
+    if not value:
+        return []
+    try:
+        return json.loads(value)
+    except (json.JSONDecodeError, TypeError):
+        return []
+
 class TravelPackage(db.Model):
     __tablename__ = 'travel_packages'
+    __table_args__ = (
+        db.Index('ix_travel_packages_active_rating', 'is_active', 'rating_score', 'rating_count'),
+        db.Index('ix_travel_packages_active_price', 'is_active', 'price'),
+        # Covers the catalog version aggregate behind the listing ETag
+        db.Index('ix_travel_packages_version', 'version'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -72,6 +110,11 @@ class TravelPackage(db.Model):
     excludes = db.Column(db.Text, nullable=True)  # JSON string of excluded services
     images = db.Column(db.Text, nullable=True)  # JSON string of image URLs
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+    rating_sum = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # Sum of review ratings
+    rating_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # Number of reviews
+    rating_score = db.Column(db.Float, default=RATING_PRIOR_MEAN, server_default=str(RATING_PRIOR_MEAN), nullable=False)  # Smoothed rating for sorting
+    reviews_updated_at = db.Column(db.DateTime, nullable=True)  # Last review write for this package
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)  # Bumped by every package edit and review write
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -79,31 +122,36 @@ class TravelPackage(db.Model):
     bookings = db.relationship('Booking', backref='package', lazy=True)
     reviews = db.relationship('Review', backref='package', lazy=True)
     
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return 0
+        return round(self.rating_sum / self.rating_count, 1)
+    
+    @property
+    def total_reviews(self):
+        return self.rating_count or 0
+    
+    @property
+    def last_modified(self):
+        """Last change to the package or any of its reviews"""
+        if self.reviews_updated_at and self.reviews_updated_at > self.updated_at:
+            return self.reviews_updated_at
+        return self.updated_at
+    
+    def parsed_lists(self):
+        """Return (includes, excludes, images) decoded from their JSON columns"""
+        key = (self.id, self.version)
+        cached = _package_lists_cache.get(key) if self.id is not None else None
+        if cached is None:
+            cached = tuple(_load_json_list(value) for value in (self.includes, self.excludes, self.images))
+            if self.id is not None:
+                _package_lists_cache.set(key, cached)
+        # Hand out copies so callers cannot mutate the cached lists
+        return tuple(list(values) for values in cached)
+    
     def to_dict(self):
-        import json
-        
-        # Parse JSON strings for includes, excludes, and images
-        includes = []
-        excludes = []
-        images = []
-        
-        if self.includes:
-            try:
-                includes = json.loads(self.includes)
-            except (json.JSONDecodeError, TypeError):
-                includes = []
-        
-        if self.excludes:
-            try:
-                excludes = json.loads(self.excludes)
-            except (json.JSONDecodeError, TypeError):
-                excludes = []
-        
-        if self.images:
-            try:
-                images = json.loads(self.images)
-            except (json.JSONDecodeError, TypeError):
-                images = []
+        includes, excludes, images = self.parsed_lists()
         
         return {
             'id': self.id,
@@ -119,12 +167,39 @@ class TravelPackage(db.Model):
             'excludes': excludes,
             'images': images,
             'is_active': self.is_active,
+            'average_rating': self.average_rating,
+            'total_reviews': self.total_reviews,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
 
+# Every flushed edit to a package row takes the next version, in SQL so that
+# concurrent edits cannot both claim the same one
+@event.listens_for(TravelPackage, 'before_update')
+def _bump_package_version(mapper, connection, target):
+    if object_session(target).is_modified(target, include_collections=False):
+        target.version = TravelPackage.version + 1
+
+# Full-text search index over packages, queried and kept in sync by search.py.
+# SQLite keeps a separate FTS5 table; MySQL maintains a FULLTEXT index itself.
+event.listen(TravelPackage.__table__, 'after_create', DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS travel_packages_fts "
+    "USING fts5(title, destination, description, includes)"
+).execute_if(dialect='sqlite'))
+event.listen(TravelPackage.__table__, 'after_drop', DDL(
+    "DROP TABLE IF EXISTS travel_packages_fts"
+).execute_if(dialect='sqlite'))
+event.listen(TravelPackage.__table__, 'after_create', DDL(
+    "CREATE FULLTEXT INDEX ix_travel_packages_fulltext "
+    "ON travel_packages (title, destination, description, includes)"
+).execute_if(dialect='mysql'))
+
 class Booking(db.Model):
     __tablename__ = 'bookings'
+    __table_args__ = (
+        db.Index('ix_bookings_user_status', 'user_id', 'status'),
+        db.Index('ix_bookings_package_status', 'package_id', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -140,8 +215,14 @@ class Booking(db.Model):
     # Relationships
     payments = db.relationship('Payment', backref='booking', lazy=True)
     
-    def to_dict(self):
-        return {
+    def to_dict(self, expand=('package', 'user'), fields=None):
+        """
+        Serialize the booking, embedding the related objects named in expand.
+        
+        fields limits the booking's own attributes to the given names; the id
+        is always included.
+        """
+        data = {
             'id': self.id,
             'user_id': self.user_id,
             'package_id': self.package_id,
@@ -151,13 +232,37 @@ class Booking(db.Model):
             'status': self.status.value,
             'special_requests': self.special_requests,
             'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat(),
-            'package': self.package.to_dict() if self.package else None,
-            'user': self.user.to_dict() if self.user else None
+            'updated_at': self.updated_at.isoformat()
         }
+        if fields is not None:
+            data = {key: value for key, value in data.items() if key == 'id' or key in fields}
+        if 'package' in expand:
+            data['package'] = self.package.to_dict() if self.package else None
+        if 'user' in expand:
+            data['user'] = self.user.to_dict() if self.user else None
+        return data
+
+class PackageInventory(db.Model):
+    """Seats left on one departure date of a package; see inventory.py"""
+    __tablename__ = 'package_inventory'
+    __table_args__ = (
+        db.UniqueConstraint('package_id', 'day', name='uq_package_inventory_package_day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    package_id = db.Column(db.Integer, db.ForeignKey('travel_packages.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    capacity = db.Column(db.Integer, nullable=False)
+    remaining = db.Column(db.Integer, nullable=False)  # Only changed by conditional UPDATEs
 
 class Review(db.Model):
     __tablename__ = 'reviews'
+    __table_args__ = (
+        # One review per user and package
+        db.UniqueConstraint('user_id', 'package_id', name='uq_reviews_user_package'),
+        # Package review lists, newest first
+        db.Index('ix_reviews_package_created', 'package_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -181,6 +286,12 @@ class Review(db.Model):
 
 class Payment(db.Model):
     __tablename__ = 'payments'
+    __table_args__ = (
+        # Gateway webhooks and reconciliation look payments up by these
+        db.Index('ix_payments_razorpay_order_id', 'razorpay_order_id'),
+        db.Index('ix_payments_razorpay_payment_id', 'razorpay_payment_id'),
+        db.Index('ix_payments_booking_id', 'booking_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'), nullable=False)
@@ -209,6 +320,9 @@ class Payment(db.Model):
 
 class Itinerary(db.Model):
     __tablename__ = 'itineraries'
+    __table_args__ = (
+        db.Index('ix_itineraries_booking_day', 'booking_id', 'day_number'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     booking_id = db.Column(db.Integer, db.ForeignKey('bookings.id'), nullable=False)
@@ -237,6 +351,9 @@ class Itinerary(db.Model):
 
 class Wishlist(db.Model):
     __tablename__ = 'wishlist'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'package_id', name='uq_wishlist_user_package'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -253,4 +370,126 @@ class Wishlist(db.Model):
             'user_id': self.user_id,
             'package_id': self.package_id,
             'added_at': self.added_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+class DailyMetric(db.Model):
+    """Per-day, per-package rollup of booking, payment, review and signup activity"""
+    __tablename__ = 'daily_metrics'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'package_id', name='uq_daily_metrics_day_package'),
+    )
+    
+    # package_id 0 holds site-wide figures that belong to no package (new users)
+    SITE_WIDE = 0
+    COUNTERS = ('bookings_pending', 'bookings_confirmed', 'bookings_completed', 'bookings_cancelled',
+                'revenue', 'new_users', 'reviews', 'review_rating_sum')
+    
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    package_id = db.Column(db.Integer, nullable=False, default=SITE_WIDE)
+    bookings_pending = db.Column(db.Integer, default=0, server_default='0', nullable=False)  # Bookings created this day, by current status
+    bookings_confirmed = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    bookings_completed = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    bookings_cancelled = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    revenue = db.Column(db.Float, default=0, server_default='0', nullable=False)  # Completed payments created this day
+    new_users = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    reviews = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    review_rating_sum = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+class Job(db.Model):
+    """Unit of background work claimed and run by `flask run-jobs` workers"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+        db.Index('ix_jobs_key', 'key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON arguments for the task
+    key = db.Column(db.String(100), nullable=True)  # At most one unfinished job per key
+    status = db.Column(db.Enum(JobStatus), default=JobStatus.QUEUED, nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Not claimed before this
+    locked_until = db.Column(db.DateTime, nullable=True)  # Visibility timeout of a running job
+    locked_by = db.Column(db.String(100), nullable=True)
+    result = db.Column(db.Text, nullable=True)  # JSON
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'task': self.task,
+            'payload': json.loads(self.payload),
+            'status': self.status.value,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_at': self.run_at.isoformat(),
+            'result': json.loads(self.result) if self.result else None,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class WebhookEvent(db.Model):
+    """Raw gateway webhook as received; webhooks.py applies it later in batches"""
+    __tablename__ = 'webhook_events'
+    __table_args__ = (
+        db.Index('ix_webhook_events_event_id', 'event_id'),
+        db.Index('ix_webhook_events_processed_at', 'processed_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(100), nullable=False)  # Gateway event id; redeliveries repeat it
+    payload = db.Column(db.Text, nullable=False)  # Request body, unparsed
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    outcome = db.Column(db.String(20), nullable=True)  # applied, refund_queued, ignored, duplicate, unmatched or invalid
+
+class ReconciliationRun(db.Model):
+    """Pass of `flask reconcile-payments` over payment ids up to upper_payment_id, with its checkpoint"""
+    __tablename__ = 'reconciliation_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    upper_payment_id = db.Column(db.Integer, nullable=False)  # Highest payment id when the run started
+    last_payment_id = db.Column(db.Integer, default=0, nullable=False)  # Checkpoint: checked up to here
+    checked = db.Column(db.Integer, default=0, nullable=False)
+    fixed = db.Column(db.Integer, default=0, nullable=False)
+    discrepancies = db.Column(db.Integer, default=0, nullable=False)
+    report_path = db.Column(db.String(255), nullable=True)  # CSV discrepancy report
+    started_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'upper_payment_id': self.upper_payment_id,
+            'last_payment_id': self.last_payment_id,
+            'checked': self.checked,
+            'fixed': self.fixed,
+            'discrepancies': self.discrepancies,
+            'report_path': self.report_path,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class IdempotencyKey(db.Model):
+    """Idempotency-Key of a write request and the response it produced; see idempotency.py"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),
+        db.Index('ix_idempotency_keys_expires_at', 'expires_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)  # sha256 of method, path and body
+    status_code = db.Column(db.Integer, nullable=True)  # None while the first request is running
+    response_body = db.Column(db.Text, nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)  # Taken over after this if the first request died
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,137 @@
+"""
+Keyset (cursor) pagination for list endpoints
+
+List endpoints accept an opt-in ``cursor`` query parameter. An empty cursor
+starts at the first page; each response carries an opaque ``next_cursor`` that
+encodes the sort key and id of the last row returned. The next page is then
+found with a seek predicate on (sort key, id) instead of OFFSET, so deep pages
+cost the same as the first one. The total row count is only computed when the
+caller asks for it with ``include_total=true``. Page sizes are clamped to
+1..MAX_PER_PAGE, and responses echo the clamped size.
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from flask import request
+from sqlalchemy import and_, or_
+from database import db
+
+# Largest page keyset_paginate returns, whatever per_page asks for
+MAX_PER_PAGE = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor cannot be decoded for the requested ordering"""
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, per_page, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.per_page = per_page
+        self.total = total
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(column, value):
+    if value is None:
+        return None
+    if isinstance(column.type, db.DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, db.Date):
+        return date.fromisoformat(value)
+    return value
+
+
+def encode_cursor(values):
+    payload = json.dumps([_encode_value(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, order):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(order):
+            raise InvalidCursor('Invalid cursor')
+        return [_decode_value(column, value) for (column, _), value in zip(order, values)]
+    except InvalidCursor:
+        raise
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def order_clauses(order):
+    """ORDER BY clauses for a list of (column, descending) pairs"""
+    return [column.desc() if descending else column.asc() for column, descending in order]
+
+
+def _seek_predicate(order, values):
+    """Rows strictly after ``values`` in the lexicographic ``order``"""
+    clauses = []
+    for i, (column, descending) in enumerate(order):
+        equal_prefix = [col == value for (col, _), value in zip(order[:i], values[:i])]
+        step = column < values[i] if descending else column > values[i]
+        clauses.append(and_(*equal_prefix, step))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, order, per_page, cursor='', include_total=False):
+    """
+    Return one page of ``query`` ordered by ``order``.
+
+    ``order`` is a list of (column, descending) pairs whose last column must be
+    unique, normally the primary key.
+    """
+    per_page = min(max(per_page, 1), MAX_PER_PAGE)
+
+    if include_total:
+        total = query.order_by(None).count()
+    else:
+        total = None
+
+    if cursor:
+        query = query.filter(_seek_predicate(order, decode_cursor(cursor, order)))
+
+    query = query.order_by(*order_clauses(order))
+    rows = query.limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column, _ in order])
+
+    return KeysetPage(rows, next_cursor, per_page, total)
+
+
+def cursor_page(query, order, per_page, serialize):
+    """
+    Response fields for the keyset page the request's ``cursor`` and
+    ``include_total`` arguments ask for.
+
+    ``serialize`` turns the page's rows into the list fields of the response,
+    e.g. ``lambda users: {'users': [user.to_dict() for user in users]}``.
+    """
+    page = keyset_paginate(
+        query, order, per_page,
+        cursor=request.args.get('cursor', ''),
+        include_total=request.args.get('include_total', '').lower() == 'true'
+    )
+    return {
+        **serialize(page.items),
+        'next_cursor': page.next_cursor,
+        'total': page.total,
+        'per_page': page.per_page
+    }
+
+
+def newest_first(model):
+    """Default cursor ordering for list endpoints: creation time, then id"""
+    return [(model.created_at, True), (model.id, True)]
@@ -0,0 +1,137 @@
+"""
+Password hashing on a bounded worker pool
+
+Hashing a password is deliberately slow, so running it on the request thread
+lets a burst of logins tie up every worker. PasswordHasher runs hashing and
+verification on a small thread pool instead (the KDFs release the GIL while
+they work). At most PASSWORD_HASH_WORKERS calls run at once and
+PASSWORD_HASH_QUEUE_DEPTH more may wait for a slot; past that PasswordHasherBusy
+is raised and handlers answer 503 with a Retry-After header rather than
+queueing without bound.
+
+Configuration:
+    PASSWORD_HASH_ALGORITHM    'scrypt' (default), 'pbkdf2' or 'bcrypt'
+    PASSWORD_HASH_COST         scrypt N, pbkdf2 iterations or bcrypt rounds
+                               (defaults 32768, 600000 and 12)
+    PASSWORD_HASH_WORKERS      concurrent hash computations (default 2)
+    PASSWORD_HASH_QUEUE_DEPTH  calls allowed to wait for a worker (default 16)
+    PASSWORD_HASH_RETRY_AFTER  seconds suggested to rejected clients (default 1)
+
+Hashes made with other parameters keep verifying; needs_rehash() tells the
+login handler to replace them once the password is known.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from flask import current_app, has_app_context, jsonify
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_COSTS = {'scrypt': 32768, 'pbkdf2': 600000, 'bcrypt': 12}
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool and its queue are full"""
+
+
+class HashingPool:
+    """Thread pool that refuses work beyond a fixed number of queued calls"""
+
+    def __init__(self, workers, queue_depth):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy('Too many password operations in progress')
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+
+def hash_settings(config=None):
+    """Configured (algorithm, cost), from the current app when config is not given"""
+    if config is None:
+        config = current_app.config if has_app_context() else {}
+    algorithm = config.get('PASSWORD_HASH_ALGORITHM', 'scrypt')
+    if algorithm not in DEFAULT_COSTS:
+        raise ValueError(f'Unknown PASSWORD_HASH_ALGORITHM: {algorithm}')
+    return algorithm, int(config.get('PASSWORD_HASH_COST') or DEFAULT_COSTS[algorithm])
+
+
+def _is_bcrypt(pwhash):
+    return pwhash.startswith(('$2a$', '$2b$', '$2y$'))
+
+
+def hash_password(password, algorithm, cost):
+    """Hash password on the calling thread"""
+    if algorithm == 'bcrypt':
+        import bcrypt  # Optional dependency, only needed for the bcrypt algorithm
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=cost)).decode()
+    if algorithm == 'pbkdf2':
+        return generate_password_hash(password, method=f'pbkdf2:sha256:{cost}')
+    return generate_password_hash(password, method=f'scrypt:{cost}:8:1')
+
+
+def verify_password(pwhash, password):
+    """Check password against a hash in any supported format, on the calling thread"""
+    if _is_bcrypt(pwhash):
+        import bcrypt
+        return bcrypt.checkpw(password.encode(), pwhash.encode())
+    return check_password_hash(pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """Whether pwhash was made with other parameters than the configured ones"""
+    algorithm, cost = hash_settings()
+    if _is_bcrypt(pwhash):
+        return algorithm != 'bcrypt' or int(pwhash.split('$')[2]) != cost
+    method = pwhash.split('$', 1)[0]
+    if algorithm == 'pbkdf2':
+        return method != f'pbkdf2:sha256:{cost}'
+    return method != f'scrypt:{cost}:8:1'
+
+
+class PasswordHasher:
+    """Runs hash_password/verify_password on the app's hashing pool"""
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_ALGORITHM', 'scrypt')
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 2)
+        app.config.setdefault('PASSWORD_HASH_QUEUE_DEPTH', 16)
+        app.config.setdefault('PASSWORD_HASH_RETRY_AFTER', 1)
+        hash_settings(app.config)
+
+        app.extensions['password_hasher'] = HashingPool(
+            app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE_DEPTH']
+        )
+
+    def _run(self, fn, *args):
+        pool = current_app.extensions.get('password_hasher') if has_app_context() else None
+        # Scripts and apps without init_app hash inline
+        if pool is None:
+            return fn(*args)
+        return pool.run(fn, *args)
+
+    def hash(self, password):
+        # Workers have no app context, so read the settings here
+        return self._run(hash_password, password, *hash_settings())
+
+    def verify(self, pwhash, password):
+        return self._run(verify_password, pwhash, password)
+
+    needs_rehash = staticmethod(needs_rehash)
+
+
+def busy_response():
+    """503 answer for a request turned away by the hashing pool"""
+    response = jsonify({'error': 'Server is busy, please retry shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(current_app.config.get('PASSWORD_HASH_RETRY_AFTER', 1))
+    return response
+
+
+password_hasher = PasswordHasher()
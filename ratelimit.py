@@ -0,0 +1,241 @@
+"""
+Sliding-window rate limiting for auth and write endpoints
+
+Each limit counts requests in fixed windows and weighs the previous window by
+how much of it still overlaps the sliding window, so a check is O(1) in time
+and memory per key. Keys combine a scope ('ip' or 'user'), the client's
+address or user id and the endpoint, so every route is limited separately.
+
+Limits are read from the RATE_LIMITS config, a mapping from an endpoint
+('auth.login') or a whole blueprint ('auth') to per-scope specs such as
+{'ip': '10/minute'}; the endpoint entry wins. Views opt in with
+@rate_limiter.limit(), placed below @jwt_required() when a 'user' scope
+applies. Rejected requests get 429 with a Retry-After header and do not count
+against the window.
+
+Configuration:
+    RATE_LIMIT_ENABLED   False turns every check off (default True)
+    RATE_LIMIT_BACKEND   'memory' (default, per process) or 'redis' (shared)
+    RATE_LIMIT_MAXSIZE   keys kept by the memory backend (default 10000)
+    RATE_LIMIT_REDIS_URL connection URL for the redis backend
+    RATE_LIMITS          limits per endpoint or blueprint (DEFAULT_RATE_LIMITS)
+"""
+
+from functools import wraps
+import math
+import threading
+import time
+from flask import current_app, jsonify, request
+from flask_jwt_extended import get_jwt_identity
+from cache import LRUCache
+
+# Who a limit counts requests for
+SCOPES = ('ip', 'user')
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+DEFAULT_RATE_LIMITS = {
+    'auth.login': {'ip': '10/minute'},
+    'auth.register': {'ip': '5/minute'},
+    'bookings.create_booking': {'user': '20/minute', 'ip': '60/minute'},
+    'payments.create_payment_order': {'user': '10/minute', 'ip': '30/minute'},
+}
+
+
+def parse_limit(spec):
+    """'10/minute' -> (10, 60)"""
+    try:
+        count, period = spec.split('/')
+        return int(count), PERIODS[period.strip().rstrip('s')]
+    except (ValueError, KeyError):
+        raise ValueError(f'Invalid rate limit: {spec}')
+
+
+def _sliding_count(previous, current, elapsed, window):
+    return previous * (1 - elapsed / window) + current
+
+
+def _retry_after(previous, current, elapsed, limit, window):
+    """Seconds until one more request fits under the limit"""
+    if current + 1 > limit or not previous:
+        wait = window - elapsed
+    else:
+        # previous * (1 - (elapsed + wait) / window) + current + 1 <= limit
+        wait = window * (1 - (limit - current - 1) / previous) - elapsed
+    return max(1, math.ceil(wait))
+
+
+class MemoryRateLimitStore:
+    """Per-process counters: key -> [window number, current count, previous count]"""
+
+    def __init__(self, maxsize=10000):
+        self._windows = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, window, now=None):
+        """Count a request if it fits; returns (allowed, seconds to wait when not)"""
+        number, elapsed = divmod(now or time.time(), window)
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is None or entry[0] < number - 1:
+                entry = [number, 0, 0]
+            elif entry[0] == number - 1:
+                entry = [number, 0, entry[1]]
+
+            _, current, previous = entry
+            if _sliding_count(previous, current + 1, elapsed, window) > limit:
+                self._windows.set(key, entry)
+                return False, _retry_after(previous, current, elapsed, limit, window)
+
+            entry[1] += 1
+            self._windows.set(key, entry)
+            return True, 0
+
+    def undo(self, key, window, now):
+        """Give back a request hit() counted at now"""
+        number = now // window
+        with self._lock:
+            entry = self._windows.get(key)
+            if entry is not None and entry[0] == number and entry[1] > 0:
+                entry[1] -= 1
+
+    def clear(self):
+        self._windows.clear()
+
+
+class RedisRateLimitStore:
+    """Counters shared by every worker process, backed by Redis"""
+
+    def __init__(self, url, prefix='rate_limit:'):
+        import redis  # Optional dependency, only needed for the shared backend
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def hit(self, key, limit, window, now=None):
+        number, elapsed = divmod(now or time.time(), window)
+        current_key = f'{self._prefix}{key}:{int(number)}'
+        pipe = self._client.pipeline()
+        pipe.incr(current_key)
+        pipe.expire(current_key, int(window * 2))
+        pipe.get(f'{self._prefix}{key}:{int(number) - 1}')
+        current, _, previous = pipe.execute()
+        previous = int(previous or 0)
+
+        if _sliding_count(previous, current, elapsed, window) > limit:
+            # Give the slot back so rejected requests do not extend the block
+            self._client.decr(current_key)
+            return False, _retry_after(previous, current - 1, elapsed, limit, window)
+        return True, 0
+
+    def undo(self, key, window, now):
+        self._client.decr(f'{self._prefix}{key}:{int(now // window)}')
+
+    def clear(self):
+        for key in self._client.scan_iter(f'{self._prefix}*'):
+            self._client.delete(key)
+
+
+class RateLimiter:
+    """Applies the configured limits to views decorated with limit()"""
+
+    def __init__(self, app=None):
+        self._stats_lock = threading.Lock()
+        self._endpoints = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend = app.config.setdefault('RATE_LIMIT_BACKEND', 'memory')
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RATE_LIMIT_MAXSIZE', 10000)
+        app.config.setdefault('RATE_LIMITS', DEFAULT_RATE_LIMITS)
+
+        # Fail at startup on a malformed spec rather than on the first request
+        for scopes in app.config['RATE_LIMITS'].values():
+            for scope, spec in scopes.items():
+                if scope not in SCOPES:
+                    raise ValueError(f'Unknown rate limit scope: {scope}')
+                parse_limit(spec)
+
+        if backend == 'memory':
+            store = MemoryRateLimitStore(maxsize=app.config['RATE_LIMIT_MAXSIZE'])
+        elif backend == 'redis':
+            store = RedisRateLimitStore(app.config['RATE_LIMIT_REDIS_URL'])
+        else:
+            raise ValueError(f'Unknown RATE_LIMIT_BACKEND: {backend}')
+
+        app.extensions['rate_limiter'] = store
+
+    @property
+    def store(self):
+        return current_app.extensions['rate_limiter']
+
+    def _limits_for(self, endpoint):
+        limits = current_app.config.get('RATE_LIMITS', {})
+        if endpoint in limits:
+            return limits[endpoint]
+        return limits.get(endpoint.split('.')[0], {})
+
+    def _count(self, endpoint, outcome):
+        with self._stats_lock:
+            counters = self._endpoints.setdefault(endpoint, {'allowed': 0, 'limited': 0})
+            counters[outcome] += 1
+
+    def stats(self):
+        """Allowed/limited counters per endpoint, for this process"""
+        with self._stats_lock:
+            return {'endpoints': {name: dict(counters) for name, counters in self._endpoints.items()}}
+
+    def check(self):
+        """Count the current request; returns a 429 response when it is over a limit"""
+        endpoint = request.endpoint
+        scopes = self._limits_for(endpoint)
+        if not current_app.config.get('RATE_LIMIT_ENABLED', True) or not scopes:
+            return None
+
+        now = time.time()
+        counted = []
+        for scope, spec in scopes.items():
+            if scope == 'user':
+                identity = get_jwt_identity()
+                if identity is None:
+                    continue
+            else:
+                identity = request.remote_addr
+            limit, window = parse_limit(spec)
+            key = f'{scope}:{identity}:{endpoint}'
+            allowed, retry_after = self.store.hit(key, limit, window, now)
+            if allowed:
+                counted.append((key, window))
+            else:
+                # A rejected request counts against none of its scopes
+                for key, window in counted:
+                    self.store.undo(key, window, now)
+                self._count(endpoint, 'limited')
+                response = jsonify({'error': 'Too many requests, please retry later'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+
+        self._count(endpoint, 'allowed')
+        return None
+
+    def limit(self):
+        """Decorator enforcing the limits configured for the view's endpoint or blueprint"""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                rejected = self.check()
+                if rejected is not None:
+                    return rejected
+                return f(*args, **kwargs)
+            return decorated_function
+        return decorator
+
+    def clear(self):
+        self.store.clear()
+        with self._stats_lock:
+            self._endpoints.clear()
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,72 @@
+"""
+Denormalized package rating counters
+
+TravelPackage.rating_sum and TravelPackage.rating_count are kept in step with
+the reviews table by the review write handlers, so rating reads never have to
+aggregate reviews. TravelPackage.rating_score is a Bayesian-smoothed average
+derived from them and backs the indexed rating_desc sort.
+rebuild_rating_stats() recomputes all three from scratch.
+TravelPackage.reviews_updated_at records the last review write and feeds the
+package Last-Modified header; every review write also bumps
+TravelPackage.version, which the package and listing ETags are built from.
+"""
+
+import click
+from flask.cli import with_appcontext
+from datetime import datetime
+from sqlalchemy import func, select
+from models import db, TravelPackage, Review, RATING_PRIOR_MEAN, RATING_PRIOR_WEIGHT
+
+
+def rating_score(rating_sum, rating_count):
+    """Bayesian-smoothed average rating; works on numbers and SQL expressions alike"""
+    return (RATING_PRIOR_MEAN * RATING_PRIOR_WEIGHT + rating_sum) / (RATING_PRIOR_WEIGHT + rating_count)
+
+
+def adjust_rating_stats(package_id, rating_delta, count_delta):
+    """Apply a review write to a package's rating counters in the current transaction"""
+    # Increment in SQL so concurrent review writes cannot overwrite each other.
+    # rating_score is assigned first because MySQL evaluates SET clauses left to
+    # right against already updated values.
+    TravelPackage.query.filter_by(id=package_id).update([
+        (TravelPackage.rating_score, rating_score(
+            TravelPackage.rating_sum + rating_delta,
+            TravelPackage.rating_count + count_delta
+        )),
+        (TravelPackage.rating_sum, TravelPackage.rating_sum + rating_delta),
+        (TravelPackage.rating_count, TravelPackage.rating_count + count_delta),
+        (TravelPackage.reviews_updated_at, datetime.utcnow()),
+        (TravelPackage.version, TravelPackage.version + 1),
+        # Rating changes are not edits to the package itself
+        (TravelPackage.updated_at, TravelPackage.updated_at)
+    ], synchronize_session=False, update_args={'preserve_parameter_order': True})
+
+
+def rebuild_rating_stats():
+    """Recompute the rating counters and scores of every package from the reviews table"""
+    rating_sum = select(func.coalesce(func.sum(Review.rating), 0)).where(
+        Review.package_id == TravelPackage.id
+    ).scalar_subquery()
+    rating_count = select(func.count(Review.id)).where(
+        Review.package_id == TravelPackage.id
+    ).scalar_subquery()
+
+    result = db.session.execute(
+        TravelPackage.__table__.update().values(
+            rating_score=rating_score(rating_sum, rating_count),
+            rating_sum=rating_sum,
+            rating_count=rating_count,
+            version=TravelPackage.version + 1,
+            updated_at=TravelPackage.updated_at
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+@click.command('rebuild-ratings')
+@with_appcontext
+def rebuild_ratings_command():
+    """Recompute denormalized rating counters for all packages"""
+    updated = rebuild_rating_stats()
+    click.echo(f'Rebuilt rating counters for {updated} packages')
@@ -0,0 +1,229 @@
+"""
+Reconciliation of local payments against Razorpay orders
+
+A run walks the payments table in id order, RECONCILE_BATCH_SIZE rows at a
+time, up to the highest id that existed when it started. For each batch it
+fetches the gateway orders with RECONCILE_CONCURRENCY parallel requests over
+the gateway's pooled session, compares status and amount, applies the status
+fixes through the ORM, so the daily metrics rollup follows them, and appends
+what it found to the run's CSV report. The batch's fixes and the run's checkpoint commit together,
+so an interrupted run resumes at the first unchecked payment; report rows of
+the batch that was in flight may then appear twice.
+
+Fixes are only made when the gateway is unambiguous:
+    order paid, payment pending or failed   -> payment completed, booking confirmed
+                                               (refund queued if its seats are gone)
+    order unpaid, payment pending too long  -> payment failed
+Amount mismatches, completed payments whose order is unpaid and orders the
+gateway does not know are only reported.
+
+Run it with `flask reconcile-payments`, or hand it to the job workers with
+--enqueue (from cron, for instance); each job checks RECONCILE_BATCHES_PER_JOB
+batches and queues the next one, so no job outlives its visibility timeout.
+
+Configuration:
+    RECONCILE_BATCH_SIZE       payments checked per batch (default 500)
+    RECONCILE_CONCURRENCY      parallel order fetches (default 8, at most RAZORPAY_POOL_SIZE)
+    RECONCILE_STALE_HOURS      age after which an unpaid pending payment fails (default 24)
+    RECONCILE_BATCHES_PER_JOB  batches per background job (default 20)
+    RECONCILE_REPORT_DIR       where reports are written (default <instance>/reconciliation)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from datetime import datetime, timedelta
+import os
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from gateway import payment_gateway, to_paise, GatewayRejected, GatewayUnavailable
+from inventory import confirm_paid_booking
+from jobs import enqueue
+from models import db, Job, JobStatus, Payment, PaymentStatus, ReconciliationRun
+
+REPORT_FIELDS = ('payment_id', 'booking_id', 'order_id', 'issue', 'action', 'local_status',
+                 'gateway_status', 'local_amount', 'gateway_amount')
+
+# Order lookups that failed for good, keyed as issues in the report
+MISSING_ORDER = 'missing_order'
+GATEWAY_ERROR = 'gateway_error'
+
+
+def _settings():
+    config = current_app.config
+    return {
+        'batch_size': config.get('RECONCILE_BATCH_SIZE', 500),
+        'concurrency': min(config.get('RECONCILE_CONCURRENCY', 8), config.get('RAZORPAY_POOL_SIZE', 10)),
+        'stale_before': datetime.utcnow() - timedelta(hours=config.get('RECONCILE_STALE_HOURS', 24)),
+    }
+
+
+def start_run():
+    """The unfinished run to resume, or a new one covering every payment so far. The caller commits."""
+    run = ReconciliationRun.query.filter(ReconciliationRun.finished_at.is_(None)) \
+        .order_by(ReconciliationRun.id.desc()).first()
+    if run:
+        return run
+
+    run = ReconciliationRun(upper_payment_id=db.session.query(func.max(Payment.id)).scalar() or 0)
+    db.session.add(run)
+    db.session.flush()
+    report_dir = current_app.config.get('RECONCILE_REPORT_DIR') or \
+        os.path.join(current_app.instance_path, 'reconciliation')
+    run.report_path = os.path.join(report_dir, f'run_{run.id}.csv')
+    return run
+
+
+def _fetch(client, order_id):
+    try:
+        return client.fetch_order(order_id)
+    except GatewayRejected as e:
+        return MISSING_ORDER if e.status_code == 404 else GATEWAY_ERROR
+
+
+def _compare(payment, order, stale_before):
+    """(issue, action) for one payment, or None when it matches the gateway"""
+    if isinstance(order, str):
+        return order, None
+    if order.get('amount') != to_paise(payment.amount):
+        # Money disagrees; leave the status to a human
+        return 'amount_mismatch', None
+    paid = order.get('status') == 'paid'
+    if paid and payment.status in (PaymentStatus.PENDING, PaymentStatus.FAILED):
+        return f'paid_but_{payment.status.value}', 'complete'
+    if not paid and payment.status == PaymentStatus.COMPLETED:
+        return 'completed_but_unpaid', None
+    if not paid and payment.status == PaymentStatus.PENDING and payment.created_at < stale_before:
+        return 'stale_pending', 'fail'
+    return None
+
+
+def _apply(actions):
+    """Status fixes made through the ORM, so the metrics rollup sees them; returns how many payments changed"""
+    wanted = {payment.id: action for payment, action in actions if action}
+    if not wanted:
+        return 0
+    # Read again under a row lock: a webhook may have moved a payment since the batch was read
+    payments = Payment.query.options(selectinload(Payment.booking)).populate_existing() \
+        .with_for_update().filter(Payment.id.in_(wanted)).all()
+    fixed = 0
+    for payment in payments:
+        action = wanted[payment.id]
+        if action == 'complete' and payment.status in (PaymentStatus.PENDING, PaymentStatus.FAILED):
+            payment.status = PaymentStatus.COMPLETED
+            confirm_paid_booking(payment)
+            fixed += 1
+        elif action == 'fail' and payment.status == PaymentStatus.PENDING:
+            payment.status = PaymentStatus.FAILED
+            fixed += 1
+    return fixed
+
+
+def _write_report(path, rows):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    new = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+        if new:
+            writer.writeheader()
+        writer.writerows(rows)
+
+
+def reconcile_batch(run, client, pool, settings):
+    """Check the next batch of the run and commit it with the checkpoint; returns payments checked"""
+    payments = Payment.query.filter(
+        Payment.id > run.last_payment_id,
+        Payment.id <= run.upper_payment_id,
+        Payment.razorpay_order_id.isnot(None)
+    ).order_by(Payment.id).limit(settings['batch_size']).all()
+    if not payments:
+        return 0
+
+    # GatewayUnavailable propagates and the batch is checked again later
+    order_ids = sorted({payment.razorpay_order_id for payment in payments})
+    orders = dict(zip(order_ids, pool.map(lambda order_id: _fetch(client, order_id), order_ids)))
+
+    actions, report = [], []
+    for payment in payments:
+        order = orders[payment.razorpay_order_id]
+        found = _compare(payment, order, settings['stale_before'])
+        if found is None:
+            continue
+        issue, action = found
+        actions.append((payment, action))
+        gateway_order = order if isinstance(order, dict) else {}
+        report.append({
+            'payment_id': payment.id, 'booking_id': payment.booking_id,
+            'order_id': payment.razorpay_order_id, 'issue': issue, 'action': action or 'report',
+            'local_status': payment.status.value, 'gateway_status': gateway_order.get('status', ''),
+            'local_amount': to_paise(payment.amount), 'gateway_amount': gateway_order.get('amount', '')
+        })
+
+    try:
+        run.fixed += _apply(actions)
+        if report:
+            _write_report(run.report_path, report)
+        run.checked += len(payments)
+        run.discrepancies += len(report)
+        run.last_payment_id = payments[-1].id
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(payments)
+
+
+def reconcile(run, max_batches=None):
+    """Check batches of the run until it is finished or max_batches have been checked"""
+    settings = _settings()
+    client = payment_gateway.client
+    batches = 0
+    with ThreadPoolExecutor(max_workers=settings['concurrency']) as pool:
+        while max_batches is None or batches < max_batches:
+            if not reconcile_batch(run, client, pool, settings):
+                run.finished_at = datetime.utcnow()
+                db.session.commit()
+                break
+            batches += 1
+    return run
+
+
+def reconciliation_job():
+    """The queued or running reconciliation job, if there is one"""
+    return Job.query.filter(
+        Job.task == 'reconcile_payments', Job.status.in_([JobStatus.QUEUED, JobStatus.RUNNING])
+    ).first()
+
+
+def enqueue_reconciliation():
+    """Queue a reconciliation job unless one is already queued or running. The caller commits."""
+    return reconciliation_job() or enqueue('reconcile_payments')
+
+
+@click.command('reconcile-payments')
+@click.option('--enqueue', 'queue', is_flag=True, help='Queue the run for `flask run-jobs` workers instead')
+@click.option('--restart', is_flag=True, help='Abandon an unfinished run and start over')
+@with_appcontext
+def reconcile_payments_command(queue, restart):
+    """Compare payments with Razorpay orders, fix clear-cut statuses and report the rest"""
+    if restart:
+        ReconciliationRun.query.filter(ReconciliationRun.finished_at.is_(None)) \
+            .update({'finished_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+    if queue:
+        job = enqueue_reconciliation()
+        db.session.commit()
+        click.echo(f'Reconciliation job {job.id} queued')
+        return
+
+    run = start_run()
+    db.session.commit()
+    try:
+        reconcile(run)
+    except GatewayUnavailable as e:
+        click.echo(f'Stopped at payment {run.last_payment_id}, run again to resume: {e}')
+        return
+    click.echo(f'Checked {run.checked} payments: {run.fixed} fixed, {run.discrepancies} discrepancies; '
+               f'report in {run.report_path}')
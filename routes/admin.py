@@ -1,21 +1,29 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, User, TravelPackage, Booking, Review, UserRole, BookingStatus
+from sqlalchemy import case, func, select
+from sqlalchemy.orm import joinedload
+from models import db, User, TravelPackage, Booking, Review, Payment, UserRole, BookingStatus, Job, JobStatus, ReconciliationRun
+from pagination import keyset_paginate, cursor_page, newest_first, InvalidCursor
+from cache import response_cache
+from ratelimit import rate_limiter
+from authz import roles_required, revoke_tokens, load_principal, invalidate_principal
+from passwords import PasswordHasherBusy, busy_response
+from routes.bookings import BookingListing, InvalidListingArgument
+from metrics import metrics_series, GRANULARITIES
+from jobs import retry_job
+from reconcile import enqueue_reconciliation
+from inventory import SoldOut, set_booking_status
 from datetime import datetime, date, timedelta
 import json
+import time
 
 admin_bp = Blueprint('admin', __name__)
 
-def admin_required(f):
-    """Decorator to check if user is admin"""
-    def decorated_function(*args, **kwargs):
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        if not user or user.role != UserRole.ADMIN:
-            return jsonify({'error': 'Admin access required'}), 403
-        return f(*args, **kwargs)
-    decorated_function.__name__ = f.__name__
-    return decorated_function
+# Longest range /metrics will return in one response
+MAX_METRICS_DAYS = 3660
+
+# Checks the role claim in the token; no user lookup per request
+admin_required = roles_required(UserRole.ADMIN, message='Admin access required')
 
 @admin_bp.route('/users', methods=['GET'])
 @jwt_required()
@@ -44,6 +52,13 @@ def get_all_users():
                 (User.email.ilike(f'%{search}%'))
             )
         
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            return jsonify(cursor_page(
+                query, newest_first(User), per_page,
+                lambda users: {'users': [user.to_dict() for user in users]}
+            )), 200
+        
         # Paginate results
         users = query.paginate(
             page=page, per_page=per_page, error_out=False
@@ -59,6 +74,8 @@ def get_all_users():
             'per_page': per_page
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -67,7 +84,7 @@ def get_all_users():
 @admin_required
 def get_user(user_id):
     try:
-        user = User.query.get(user_id)
+        user = load_principal(user_id)
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
@@ -107,17 +124,24 @@ def update_user(user_id):
         
         if 'role' in data:
             try:
-                user.role = UserRole(data['role'])
+                role = UserRole(data['role'])
             except ValueError:
                 return jsonify({'error': 'Invalid role'}), 400
+            if role != user.role:
+                user.role = role
+                # Issued tokens carry the old role
+                revoke_tokens(user)
         
         if 'is_active' in data:
+            if user.is_active and not data['is_active']:
+                revoke_tokens(user)
             user.is_active = data['is_active']
         
         if 'password' in data and data['password']:
             user.set_password(data['password'])
         
         db.session.commit()
+        invalidate_principal(user.id)
         
         return jsonify({
             'success': True,
@@ -125,6 +149,9 @@ def update_user(user_id):
             'user': user.to_dict()
         }), 200
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return busy_response()
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -139,7 +166,9 @@ def deactivate_user(user_id):
             return jsonify({'error': 'User not found'}), 404
         
         user.is_active = False
+        revoke_tokens(user)
         db.session.commit()
+        invalidate_principal(user.id)
         
         return jsonify({'message': 'User deactivated successfully'}), 200
         
@@ -158,6 +187,7 @@ def activate_user(user_id):
         
         user.is_active = True
         db.session.commit()
+        invalidate_principal(user.id)
         
         return jsonify({'message': 'User activated successfully'}), 200
         
@@ -207,6 +237,9 @@ def create_user():
         
     except ValueError as e:
         return jsonify({'error': 'Invalid role'}), 400
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return busy_response()
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -227,6 +260,7 @@ def delete_user(user_id):
         
         db.session.delete(user)
         db.session.commit()
+        invalidate_principal(user_id)
         
         return jsonify({
             'success': True,
@@ -252,7 +286,10 @@ def toggle_user_status(user_id):
             return jsonify({'error': 'Cannot deactivate your own account'}), 400
         
         user.is_active = not user.is_active
+        if not user.is_active:
+            revoke_tokens(user)
         db.session.commit()
+        invalidate_principal(user.id)
         
         return jsonify({
             'success': True,
@@ -284,6 +321,13 @@ def get_all_packages():
         if is_active is not None:
             query = query.filter_by(is_active=is_active.lower() == 'true')
         
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            return jsonify(cursor_page(
+                query, newest_first(TravelPackage), per_page,
+                lambda packages: {'packages': [package.to_dict() for package in packages]}
+            )), 200
+        
         # Paginate results
         packages = query.paginate(
             page=page, per_page=per_page, error_out=False
@@ -299,6 +343,8 @@ def get_all_packages():
             'per_page': per_page
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -330,21 +376,31 @@ def get_all_bookings():
         if package_id:
             query = query.filter_by(package_id=package_id)
         
+        listing = BookingListing.from_request()
+        query = query.options(*listing.load_options())
+        
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            return jsonify(cursor_page(
+                query, newest_first(Booking), per_page,
+                listing.serialize
+            )), 200
+        
         # Paginate results
         bookings = query.paginate(
             page=page, per_page=per_page, error_out=False
         )
         
-        booking_list = [booking.to_dict() for booking in bookings.items]
-        
         return jsonify({
-            'bookings': booking_list,
+            **listing.serialize(bookings.items),
             'total': bookings.total,
             'pages': bookings.pages,
             'current_page': page,
             'per_page': per_page
         }), 200
         
+    except (InvalidCursor, InvalidListingArgument) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -380,10 +436,11 @@ def update_booking_status(booking_id):
             return jsonify({'error': 'Status is required'}), 400
         
         try:
-            booking.status = BookingStatus(data['status'])
+            status = BookingStatus(data['status'])
         except ValueError:
             return jsonify({'error': 'Invalid status'}), 400
         
+        set_booking_status(booking, status)
         db.session.commit()
         
         return jsonify({
@@ -391,60 +448,111 @@ def update_booking_status(booking_id):
             'booking': booking.to_dict()
         }), 200
         
+    except SoldOut as e:
+        db.session.rollback()
+        return jsonify({'error': str(e), 'remaining': e.remaining}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@response_cache.memoize('admin:stats:data', ttl_config='ADMIN_STATS_CACHE_TTL')
+def admin_stats():
+    """System-wide counters and revenue, shared by /stats and /dashboard"""
+    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
+    
+    def status_count(status):
+        return func.coalesce(func.sum(case((Booking.status == status, 1), else_=0)), 0)
+    
+    # Booking counters and revenue in one pass over the bookings table
+    bookings = db.session.query(
+        func.count(Booking.id).label('total'),
+        status_count(BookingStatus.PENDING).label('pending'),
+        status_count(BookingStatus.CONFIRMED).label('confirmed'),
+        status_count(BookingStatus.COMPLETED).label('completed'),
+        status_count(BookingStatus.CANCELLED).label('cancelled'),
+        func.coalesce(func.sum(case((Booking.created_at >= thirty_days_ago, 1), else_=0)), 0).label('recent'),
+        func.coalesce(func.sum(case((Booking.status == BookingStatus.COMPLETED, Booking.total_amount),
+                                    else_=0)), 0).label('revenue')
+    ).one()
+    
+    # Users, packages and reviews as scalar subqueries of a single statement
+    def active_count(model):
+        return func.coalesce(func.sum(case((model.is_active == True, 1), else_=0)), 0)
+    
+    others = db.session.query(
+        select(func.count(User.id)).scalar_subquery().label('users'),
+        select(active_count(User)).scalar_subquery().label('active_users'),
+        select(func.count(TravelPackage.id)).scalar_subquery().label('packages'),
+        select(active_count(TravelPackage)).scalar_subquery().label('active_packages'),
+        select(func.count(Review.id)).scalar_subquery().label('reviews')
+    ).one()
+    
+    return {
+        'users': {
+            'total': others.users,
+            'active': others.active_users,
+            'inactive': others.users - others.active_users
+        },
+        'packages': {
+            'total': others.packages,
+            'active': others.active_packages,
+            'inactive': others.packages - others.active_packages
+        },
+        'bookings': {
+            'total': bookings.total,
+            'pending': bookings.pending,
+            'confirmed': bookings.confirmed,
+            'completed': bookings.completed,
+            'cancelled': bookings.cancelled,
+            'recent_30_days': bookings.recent
+        },
+        'reviews': {
+            'total': others.reviews
+        },
+        'revenue': {
+            'total': float(bookings.revenue)
+        }
+    }
+
 @admin_bp.route('/stats', methods=['GET'])
 @jwt_required()
 @admin_required
 def get_admin_stats():
     try:
-        # Get statistics
-        total_users = User.query.count()
-        active_users = User.query.filter_by(is_active=True).count()
-        total_packages = TravelPackage.query.count()
-        active_packages = TravelPackage.query.filter_by(is_active=True).count()
-        total_bookings = Booking.query.count()
-        pending_bookings = Booking.query.filter_by(status=BookingStatus.PENDING).count()
-        confirmed_bookings = Booking.query.filter_by(status=BookingStatus.CONFIRMED).count()
-        completed_bookings = Booking.query.filter_by(status=BookingStatus.COMPLETED).count()
-        cancelled_bookings = Booking.query.filter_by(status=BookingStatus.CANCELLED).count()
-        total_reviews = Review.query.count()
-        
-        # Calculate total revenue
-        completed_bookings_query = Booking.query.filter_by(status=BookingStatus.COMPLETED)
-        total_revenue = sum(booking.total_amount for booking in completed_bookings_query.all())
-        
-        # Get recent bookings (last 30 days)
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        recent_bookings = Booking.query.filter(Booking.created_at >= thirty_days_ago).count()
+        return jsonify(admin_stats()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/metrics', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_metrics():
+    try:
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in GRANULARITIES:
+            return jsonify({'error': f'granularity must be one of: {", ".join(GRANULARITIES)}'}), 400
+        
+        try:
+            end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else date.today()
+            start = (datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from')
+                     else end - timedelta(days=29))
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        
+        if start > end:
+            return jsonify({'error': 'from must not be after to'}), 400
+        if (end - start).days >= MAX_METRICS_DAYS:
+            return jsonify({'error': f'Date range is limited to {MAX_METRICS_DAYS} days'}), 400
+        
+        package_id = request.args.get('package_id', type=int)
         
         return jsonify({
-            'users': {
-                'total': total_users,
-                'active': active_users,
-                'inactive': total_users - active_users
-            },
-            'packages': {
-                'total': total_packages,
-                'active': active_packages,
-                'inactive': total_packages - active_packages
-            },
-            'bookings': {
-                'total': total_bookings,
-                'pending': pending_bookings,
-                'confirmed': confirmed_bookings,
-                'completed': completed_bookings,
-                'cancelled': cancelled_bookings,
-                'recent_30_days': recent_bookings
-            },
-            'reviews': {
-                'total': total_reviews
-            },
-            'revenue': {
-                'total': total_revenue
-            }
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'granularity': granularity,
+            'package_id': package_id,
+            **metrics_series(start, end, granularity, package_id)
         }), 200
         
     except Exception as e:
@@ -470,6 +578,13 @@ def get_all_reviews():
         if user_id:
             query = query.filter_by(user_id=user_id)
         
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            return jsonify(cursor_page(
+                query, newest_first(Review), per_page,
+                lambda reviews: {'reviews': [review.to_dict() for review in reviews]}
+            )), 200
+        
         # Paginate results
         reviews = query.paginate(
             page=page, per_page=per_page, error_out=False
@@ -485,5 +600,202 @@ def get_all_reviews():
             'per_page': per_page
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_cache_stats():
+    try:
+        return jsonify(response_cache.stats()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/rate-limits/stats', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_rate_limit_stats():
+    try:
+        return jsonify(rate_limiter.stats()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/jobs', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_jobs():
+    try:
+        per_page = request.args.get('per_page', 20, type=int)
+        status = request.args.get('status')
+        task = request.args.get('task')
+        
+        query = Job.query
+        if status:
+            try:
+                query = query.filter(Job.status == JobStatus(status))
+            except ValueError:
+                return jsonify({'error': 'Invalid status'}), 400
+        if task:
+            query = query.filter(Job.task == task)
+        
+        return jsonify(cursor_page(
+            query, newest_first(Job), per_page,
+            lambda jobs: {'jobs': [job.to_dict() for job in jobs]}
+        )), 200
+        
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_job(job_id):
+    try:
+        job = db.session.get(Job, job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify({'job': job.to_dict()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/jobs/<int:job_id>/retry', methods=['POST'])
+@jwt_required()
+@admin_required
+def retry_dead_job(job_id):
+    try:
+        job = db.session.get(Job, job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        if job.status != JobStatus.DEAD:
+            return jsonify({'error': 'Only dead jobs can be retried'}), 400
+        
+        retry_job(job)
+        db.session.commit()
+        
+        return jsonify({'message': 'Job queued again', 'job': job.to_dict()}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/reconciliation', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_reconciliation_runs():
+    try:
+        per_page = request.args.get('per_page', 20, type=int)
+        
+        return jsonify(cursor_page(
+            ReconciliationRun.query, [(ReconciliationRun.id, True)], per_page,
+            lambda runs: {'runs': [run.to_dict() for run in runs]}
+        )), 200
+        
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/reconciliation', methods=['POST'])
+@jwt_required()
+@admin_required
+def start_reconciliation():
+    try:
+        # Resumes the unfinished run if there is one
+        job = enqueue_reconciliation()
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Reconciliation queued',
+            'job_id': job.id,
+            'status_url': f'/api/admin/jobs/{job.id}'
+        }), 202
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+# Sections /dashboard can assemble, in response order
+DASHBOARD_SECTIONS = ('stats', 'recent_bookings', 'recent_reviews', 'users', 'packages', 'payments')
+RECENT_ITEMS = 5
+
+def _newest_page(query, model, per_page, key, serialize):
+    """First page of a list newest first; next_cursor continues on the list endpoint"""
+    page = keyset_paginate(query, newest_first(model), per_page)
+    return {key: serialize(page.items), 'next_cursor': page.next_cursor}
+
+def _review_with_package(review):
+    return {**review.to_dict(), 'package': review.package.to_dict() if review.package else None}
+
+def _dashboard_section(name, per_page):
+    if name == 'stats':
+        return admin_stats()
+    if name == 'recent_bookings':
+        listing = BookingListing()
+        return _newest_page(Booking.query.options(*listing.load_options()), Booking, RECENT_ITEMS,
+                            'bookings', lambda items: listing.serialize(items)['bookings'])
+    if name == 'recent_reviews':
+        query = Review.query.options(joinedload(Review.user), joinedload(Review.package))
+        return _newest_page(query, Review, RECENT_ITEMS, 'reviews',
+                            lambda items: [_review_with_package(review) for review in items])
+    if name == 'users':
+        return _newest_page(User.query, User, per_page, 'users',
+                            lambda items: [user.to_dict() for user in items])
+    if name == 'packages':
+        return _newest_page(TravelPackage.query, TravelPackage, per_page, 'packages',
+                            lambda items: [package.to_dict() for package in items])
+    if name == 'payments':
+        return _newest_page(Payment.query, Payment, per_page, 'payments',
+                            lambda items: [payment.to_dict() for payment in items])
+
+@admin_bp.route('/dashboard', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_dashboard():
+    """
+    Everything the admin dashboard needs in one request: ``sections`` picks
+    from DASHBOARD_SECTIONS (default all). Sections share the request's
+    session and the admin check; stats come from the same short-lived cache
+    as /stats. A failing section is reported under ``errors`` without
+    failing the others.
+    """
+    try:
+        value = request.args.get('sections')
+        sections = [name.strip() for name in value.split(',') if name.strip()] if value else list(DASHBOARD_SECTIONS)
+        unknown = [name for name in sections if name not in DASHBOARD_SECTIONS]
+        if unknown:
+            return jsonify({'error': f'Unknown sections: {", ".join(unknown)}'}), 400
+        per_page = request.args.get('per_page', 10, type=int)
+        
+        result = {}
+        errors = {}
+        timings = {}
+        started = time.perf_counter()
+        for name in sections:
+            section_started = time.perf_counter()
+            try:
+                result[name] = _dashboard_section(name, per_page)
+            except Exception as e:
+                db.session.rollback()
+                result[name] = None
+                errors[name] = str(e)
+            timings[name] = round((time.perf_counter() - section_started) * 1000, 2)
+        total = round((time.perf_counter() - started) * 1000, 2)
+        
+        response = jsonify({**result, 'errors': errors, 'timings_ms': {**timings, 'total': total}})
+        response.headers['Server-Timing'] = ', '.join(
+            f'{name};dur={duration}' for name, duration in {**timings, 'total': total}.items()
+        )
+        return response, 200
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
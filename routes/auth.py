@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, User, UserRole
+from authz import create_user_token, current_principal, invalidate_principal
+from passwords import PasswordHasherBusy, busy_response
+from ratelimit import rate_limiter
 from email_validator import validate_email, EmailNotValidError
 import re
 
@@ -12,6 +15,7 @@ def validate_phone(phone):
     return re.match(pattern, phone) is not None
 
 @auth_bp.route('/register', methods=['POST'])
+@rate_limiter.limit()
 def register():
     try:
         data = request.get_json()
@@ -52,7 +56,7 @@ def register():
         db.session.commit()
         
         # Create access token
-        access_token = create_access_token(identity=str(user.id))
+        access_token = create_user_token(user)
         
         return jsonify({
             'message': 'User registered successfully',
@@ -60,11 +64,15 @@ def register():
             'user': user.to_dict()
         }), 201
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return busy_response()
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/login', methods=['POST'])
+@rate_limiter.limit()
 def login():
     try:
         data = request.get_json()
@@ -83,8 +91,17 @@ def login():
         if not user.is_active:
             return jsonify({'error': 'Account is deactivated'}), 401
         
+        # Upgrade hashes made with older algorithm or cost settings; when the
+        # pool is full the upgrade simply waits for a later login
+        if user.password_needs_rehash():
+            try:
+                user.set_password(data['password'])
+                db.session.commit()
+            except PasswordHasherBusy:
+                pass
+        
         # Create access token
-        access_token = create_access_token(identity=str(user.id))
+        access_token = create_user_token(user)
         
         return jsonify({
             'message': 'Login successful',
@@ -92,6 +109,9 @@ def login():
             'user': user.to_dict()
         }), 200
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return busy_response()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -99,8 +119,7 @@ def login():
 @jwt_required()
 def get_profile():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(int(user_id))
+        user = current_principal()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -143,12 +162,16 @@ def update_profile():
             user.set_password(data['password'])
         
         db.session.commit()
+        invalidate_principal(user.id)
         
         return jsonify({
             'message': 'Profile updated successfully',
             'user': user.to_dict()
         }), 200
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return busy_response()
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -176,6 +199,9 @@ def change_password():
         
         return jsonify({'message': 'Password changed successfully'}), 200
         
+    except PasswordHasherBusy:
+        db.session.rollback()
+        return busy_response()
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -1,13 +1,86 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.orm import joinedload
 from models import db, Booking, TravelPackage, User, UserRole, BookingStatus
+from authz import current_role, roles_required
+from pagination import cursor_page, newest_first, InvalidCursor
+from ratelimit import rate_limiter
+from idempotency import idempotent
+from inventory import SoldOut, reserve_seats, set_booking_status
 from datetime import datetime, date
 import json
 
 bookings_bp = Blueprint('bookings', __name__)
 
+class InvalidListingArgument(ValueError):
+    """Raised for unknown names in the expand, sideload or fields parameters"""
+
+class BookingListing:
+    """
+    Shapes booking list responses from the expand, sideload and fields query args.
+    
+    expand    related objects embedded in every booking (default: package,user)
+    sideload  related objects returned once each in top-level packages/users
+              maps keyed by id instead of being embedded
+    fields    booking attributes to return (default: all)
+    
+    Related objects are eager loaded with the page and serialized once per
+    response however many bookings share them.
+    """
+    RELATED = ('package', 'user')
+    FIELDS = ('user_id', 'package_id', 'booking_date', 'number_of_travelers', 'total_amount',
+              'status', 'special_requests', 'created_at', 'updated_at')
+    
+    def __init__(self, expand=('package', 'user'), sideload=(), fields=None):
+        self.sideload = tuple(sideload)
+        self.expand = tuple(name for name in expand if name not in self.sideload)
+        self.fields = fields
+    
+    @classmethod
+    def from_request(cls):
+        expand = cls._names('expand', 'package,user', cls.RELATED)
+        sideload = cls._names('sideload', '', cls.RELATED)
+        fields = cls._names('fields', None, cls.FIELDS)
+        return cls(expand, sideload, fields)
+    
+    @staticmethod
+    def _names(arg, default, allowed):
+        value = request.args.get(arg, default)
+        if value is None:
+            return None
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise InvalidListingArgument(f'Unknown {arg}: {", ".join(unknown)}')
+        return names
+    
+    def load_options(self):
+        """Eager loading options for the related objects this listing serializes"""
+        return [joinedload(getattr(Booking, name)) for name in self.expand + self.sideload]
+    
+    def serialize(self, bookings, key='bookings'):
+        serialized = {'package': {}, 'user': {}}
+        booking_list = []
+        for booking in bookings:
+            booking_dict = booking.to_dict(expand=(), fields=self.fields)
+            for name in self.expand + self.sideload:
+                related = getattr(booking, name)
+                related_id = getattr(booking, f'{name}_id')
+                if related is not None and related_id not in serialized[name]:
+                    serialized[name][related_id] = related.to_dict()
+                if name in self.expand:
+                    booking_dict[name] = serialized[name][related_id] if related is not None else None
+            booking_list.append(booking_dict)
+        
+        result = {key: booking_list}
+        for name in self.sideload:
+            result[f'{name}s'] = {str(related_id): data for related_id, data in serialized[name].items()}
+        return result
+
 @bookings_bp.route('/', methods=['POST'])
 @jwt_required()
+@rate_limiter.limit()
+@idempotent
 def create_booking():
     try:
         user_id = get_jwt_identity()
@@ -48,6 +121,9 @@ def create_booking():
         # Calculate total amount
         total_amount = package.price * data['number_of_travelers']
         
+        # Take the seats first; fails when the date cannot fit the group
+        reserve_seats(package, booking_date, data['number_of_travelers'])
+        
         # Create booking
         booking = Booking(
             user_id=user_id,
@@ -66,6 +142,9 @@ def create_booking():
             'booking': booking.to_dict()
         }), 201
         
+    except SoldOut as e:
+        db.session.rollback()
+        return jsonify({'error': str(e), 'remaining': e.remaining}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -75,7 +154,6 @@ def create_booking():
 def get_user_bookings():
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
         
         # Get query parameters
         page = request.args.get('page', 1, type=int)
@@ -92,21 +170,31 @@ def get_user_bookings():
             except ValueError:
                 return jsonify({'error': 'Invalid status'}), 400
         
+        listing = BookingListing.from_request()
+        query = query.options(*listing.load_options())
+        
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            return jsonify(cursor_page(
+                query, newest_first(Booking), per_page,
+                listing.serialize
+            )), 200
+        
         # Paginate results
         bookings = query.paginate(
             page=page, per_page=per_page, error_out=False
         )
         
-        booking_list = [booking.to_dict() for booking in bookings.items]
-        
         return jsonify({
-            'bookings': booking_list,
+            **listing.serialize(bookings.items),
             'total': bookings.total,
             'pages': bookings.pages,
             'current_page': page,
             'per_page': per_page
         }), 200
         
+    except (InvalidCursor, InvalidListingArgument) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -115,14 +203,14 @@ def get_user_bookings():
 def get_booking(booking_id):
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        role = current_role()
         
         booking = Booking.query.get(booking_id)
         if not booking:
             return jsonify({'error': 'Booking not found'}), 404
         
         # Check if user owns the booking or is admin/travel agent
-        if booking.user_id != user_id and user.role not in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
+        if booking.user_id != user_id and role not in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
             return jsonify({'error': 'Access denied'}), 403
         
         return jsonify({
@@ -137,15 +225,15 @@ def get_booking(booking_id):
 @jwt_required()
 def update_booking(booking_id):
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user_id = int(get_jwt_identity())
+        role = current_role()
         
         booking = Booking.query.get(booking_id)
         if not booking:
             return jsonify({'error': 'Booking not found'}), 404
         
         # Check if user owns the booking or is admin/travel agent
-        if booking.user_id != user_id and user.role not in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
+        if booking.user_id != user_id and role not in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
             return jsonify({'error': 'Access denied'}), 403
         
         data = request.get_json()
@@ -155,11 +243,12 @@ def update_booking(booking_id):
             booking.special_requests = data['special_requests']
         
         # Only admin and travel agents can change status
-        if 'status' in data and user.role in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
+        if 'status' in data and role in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
             try:
-                booking.status = BookingStatus(data['status'])
+                status = BookingStatus(data['status'])
             except ValueError:
                 return jsonify({'error': 'Invalid status'}), 400
+            set_booking_status(booking, status)
         
         db.session.commit()
         
@@ -168,6 +257,9 @@ def update_booking(booking_id):
             'booking': booking.to_dict()
         }), 200
         
+    except SoldOut as e:
+        db.session.rollback()
+        return jsonify({'error': str(e), 'remaining': e.remaining}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -176,15 +268,15 @@ def update_booking(booking_id):
 @jwt_required()
 def cancel_booking(booking_id):
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user_id = int(get_jwt_identity())
+        role = current_role()
         
         booking = Booking.query.get(booking_id)
         if not booking:
             return jsonify({'error': 'Booking not found'}), 404
         
         # Check if user owns the booking or is admin/travel agent
-        if booking.user_id != user_id and user.role not in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
+        if booking.user_id != user_id and role not in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
             return jsonify({'error': 'Access denied'}), 403
         
         # Check if booking can be cancelled
@@ -194,8 +286,8 @@ def cancel_booking(booking_id):
         if booking.status == BookingStatus.COMPLETED:
             return jsonify({'error': 'Cannot cancel completed booking'}), 400
         
-        # Cancel booking
-        booking.status = BookingStatus.CANCELLED
+        # Cancel booking and give its seats back
+        set_booking_status(booking, BookingStatus.CANCELLED)
         db.session.commit()
         
         return jsonify({
@@ -209,15 +301,9 @@ def cancel_booking(booking_id):
 
 @bookings_bp.route('/all', methods=['GET'])
 @jwt_required()
+@roles_required(UserRole.ADMIN, UserRole.TRAVEL_AGENT)
 def get_all_bookings():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        # Check if user is admin or travel agent
-        if user.role not in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
-            return jsonify({'error': 'Insufficient permissions'}), 403
-        
         # Get query parameters
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
@@ -237,20 +323,30 @@ def get_all_bookings():
         if user_filter:
             query = query.filter_by(user_id=user_filter)
         
+        listing = BookingListing.from_request()
+        query = query.options(*listing.load_options())
+        
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            return jsonify(cursor_page(
+                query, newest_first(Booking), per_page,
+                listing.serialize
+            )), 200
+        
         # Paginate results
         bookings = query.paginate(
             page=page, per_page=per_page, error_out=False
         )
         
-        booking_list = [booking.to_dict() for booking in bookings.items]
-        
         return jsonify({
-            'bookings': booking_list,
+            **listing.serialize(bookings.items),
             'total': bookings.total,
             'pages': bookings.pages,
             'current_page': page,
             'per_page': per_page
         }), 200
         
+    except (InvalidCursor, InvalidListingArgument) as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Itinerary, Booking, User
+from models import db, Itinerary, Booking, User, UserRole
+from authz import current_role
 from datetime import datetime
 import json
 
@@ -18,8 +19,8 @@ def get_booking_itineraries(booking_id):
             return jsonify({'error': 'Booking not found'}), 404
         
         # Check if user owns the booking or is admin
-        user = User.query.get(user_id)
-        if booking.user_id != user_id and user.role.value != 'admin':
+        role = current_role()
+        if booking.user_id != user_id and role != UserRole.ADMIN:
             return jsonify({'error': 'Unauthorized'}), 403
         
         # Get itineraries for the booking
@@ -47,8 +48,8 @@ def create_itinerary(booking_id):
             return jsonify({'error': 'Booking not found'}), 404
         
         # Check if user owns the booking or is admin
-        user = User.query.get(user_id)
-        if booking.user_id != user_id and user.role.value != 'admin':
+        role = current_role()
+        if booking.user_id != user_id and role != UserRole.ADMIN:
             return jsonify({'error': 'Unauthorized'}), 403
         
         data = request.get_json()
@@ -104,8 +105,8 @@ def update_itinerary(itinerary_id):
             return jsonify({'error': 'Itinerary not found'}), 404
         
         # Check if user owns the booking or is admin
-        user = User.query.get(user_id)
-        if itinerary.booking.user_id != user_id and user.role.value != 'admin':
+        role = current_role()
+        if itinerary.booking.user_id != user_id and role != UserRole.ADMIN:
             return jsonify({'error': 'Unauthorized'}), 403
         
         data = request.get_json()
@@ -158,8 +159,8 @@ def delete_itinerary(itinerary_id):
             return jsonify({'error': 'Itinerary not found'}), 404
         
         # Check if user owns the booking or is admin
-        user = User.query.get(user_id)
-        if itinerary.booking.user_id != user_id and user.role.value != 'admin':
+        role = current_role()
+        if itinerary.booking.user_id != user_id and role != UserRole.ADMIN:
             return jsonify({'error': 'Unauthorized'}), 403
         
         db.session.delete(itinerary)
@@ -1,17 +1,37 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from models import db, TravelPackage, User, UserRole, Review
+from authz import roles_required
+from pagination import cursor_page, newest_first, order_clauses, InvalidCursor
+from search import search_packages, index_package, remove_package
+from availability import availability_index
+from inventory import change_capacity, CapacityBelowBookings
+from cache import response_cache, make_etag, not_modified, add_validators
+from sqlalchemy import func
 from datetime import datetime, date
+import calendar
 import json
 
 packages_bp = Blueprint('packages', __name__)
 
+# Orderings for sort_by, each ending with the id as a unique tie-breaker
+SORT_ORDERS = {
+    'price_asc': [(TravelPackage.price, False), (TravelPackage.id, False)],
+    'price_desc': [(TravelPackage.price, True), (TravelPackage.id, True)],
+    'duration_asc': [(TravelPackage.duration_days, False), (TravelPackage.id, False)],
+    'duration_desc': [(TravelPackage.duration_days, True), (TravelPackage.id, True)],
+    # Served by ix_travel_packages_active_rating on the precomputed score
+    'rating_desc': [(TravelPackage.rating_score, True), (TravelPackage.rating_count, True), (TravelPackage.id, True)]
+}
+
 @packages_bp.route('/', methods=['GET'])
+@response_cache.cached('packages:list')
 def get_packages():
     try:
         # Get query parameters
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
+        q = request.args.get('q', '').strip()
         destination = request.args.get('destination', '')
         min_price = request.args.get('min_price', type=float)
         max_price = request.args.get('max_price', type=float)
@@ -20,8 +40,24 @@ def get_packages():
         available_to = request.args.get('available_to')
         sort_by = request.args.get('sort_by', '')
         
+        # Answer revalidation from the catalog version before running the page query
+        # (MAX(id) tells a delete plus a create apart from no change at all)
+        catalog_version = db.session.query(
+            func.count(TravelPackage.id),
+            func.max(TravelPackage.id),
+            func.coalesce(func.sum(TravelPackage.version), 0)
+        ).one()
+        etag = make_etag('packages', *catalog_version, sorted(request.args.items(multi=True)))
+        response = not_modified(etag)
+        if response:
+            return response
+        
         # Build query
         query = TravelPackage.query.filter_by(is_active=True)
+        relevance = None
+        
+        if q:
+            query, relevance = search_packages(query, q)
         
         if destination:
             query = query.filter(TravelPackage.destination.ilike(f'%{destination}%'))
@@ -50,54 +86,46 @@ def get_packages():
                 return jsonify({'error': 'Invalid available_to date format. Use YYYY-MM-DD'}), 400
         
         # Apply sorting
-        if sort_by:
-            if sort_by == 'price_asc':
-                query = query.order_by(TravelPackage.price.asc())
-            elif sort_by == 'price_desc':
-                query = query.order_by(TravelPackage.price.desc())
-            elif sort_by == 'duration_asc':
-                query = query.order_by(TravelPackage.duration_days.asc())
-            elif sort_by == 'duration_desc':
-                query = query.order_by(TravelPackage.duration_days.desc())
-            elif sort_by == 'rating_desc':
-                # For rating sorting, we'll need to join with reviews and calculate average
-                # For now, we'll sort by creation date as a fallback
-                query = query.order_by(TravelPackage.created_at.desc())
+        order = SORT_ORDERS.get(sort_by)
+        
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            response = jsonify(cursor_page(
+                query, order or newest_first(TravelPackage), per_page,
+                lambda packages: {'packages': [package.to_dict() for package in packages]}
+            ))
+            return add_validators(response, etag), 200
+        
+        if order:
+            query = query.order_by(*order_clauses(order))
+        elif relevance is not None:
+            # Search results default to best match first
+            query = query.order_by(relevance, TravelPackage.id.asc())
         
         # Paginate results
         packages = query.paginate(
             page=page, per_page=per_page, error_out=False
         )
         
-        # Add average rating to each package
-        package_list = []
-        for package in packages.items:
-            package_dict = package.to_dict()
-            
-            # Calculate average rating
-            reviews = Review.query.filter_by(package_id=package.id).all()
-            if reviews:
-                avg_rating = sum(review.rating for review in reviews) / len(reviews)
-                package_dict['average_rating'] = round(avg_rating, 1)
-                package_dict['total_reviews'] = len(reviews)
-            else:
-                package_dict['average_rating'] = 0
-                package_dict['total_reviews'] = 0
-            
-            package_list.append(package_dict)
+        # Ratings come from the denormalized counters in to_dict
+        package_list = [package.to_dict() for package in packages.items]
         
-        return jsonify({
+        response = jsonify({
             'packages': package_list,
             'total': packages.total,
             'pages': packages.pages,
             'current_page': page,
             'per_page': per_page
-        }), 200
+        })
+        return add_validators(response, etag), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @packages_bp.route('/<int:package_id>', methods=['GET'])
+@response_cache.cached(lambda package_id: f'packages:detail:{package_id}')
 def get_package(package_id):
     try:
         package = TravelPackage.query.get(package_id)
@@ -105,23 +133,92 @@ def get_package(package_id):
         if not package or not package.is_active:
             return jsonify({'error': 'Package not found'}), 404
         
+        # Answer revalidation before serializing anything
+        etag = make_etag('package', package.id, package.version)
+        response = not_modified(etag, package.last_modified)
+        if response:
+            return response
+        
         package_dict = package.to_dict()
         
-        # Add reviews and ratings
+        # Add reviews
         reviews = Review.query.filter_by(package_id=package_id).all()
-        if reviews:
-            avg_rating = sum(review.rating for review in reviews) / len(reviews)
-            package_dict['average_rating'] = round(avg_rating, 1)
-            package_dict['total_reviews'] = len(reviews)
-            package_dict['reviews'] = [review.to_dict() for review in reviews]
-        else:
-            package_dict['average_rating'] = 0
-            package_dict['total_reviews'] = 0
-            package_dict['reviews'] = []
+        package_dict['reviews'] = [review.to_dict() for review in reviews]
         
-        return jsonify({
+        response = jsonify({
             'success': True,
             'package': package_dict
+        })
+        return add_validators(response, etag, package.last_modified), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Packages one multi-package availability request may ask for
+MAX_AVAILABILITY_PACKAGES = 50
+
+def _month_range(month):
+    """First and last day of a 'YYYY-MM' month, the current one when month is empty"""
+    first = datetime.strptime(month, '%Y-%m').date() if month else date.today().replace(day=1)
+    return first, first.replace(day=calendar.monthrange(first.year, first.month)[1])
+
+def _availability_json(package, seat_calendar, first, last):
+    return {
+        'package_id': package.id,
+        'capacity': seat_calendar.capacity,
+        'days': [
+            {'date': day.isoformat(), 'remaining': remaining, 'price': seat_calendar.price}
+            for day, remaining in seat_calendar.days(max(first, date.today()), last)
+        ]
+    }
+
+@packages_bp.route('/<int:package_id>/availability', methods=['GET'])
+def get_package_availability(package_id):
+    try:
+        package = TravelPackage.query.get(package_id)
+        if not package or not package.is_active:
+            return jsonify({'error': 'Package not found'}), 404
+        
+        try:
+            first, last = _month_range(request.args.get('month'))
+        except ValueError:
+            return jsonify({'error': 'Invalid month format. Use YYYY-MM'}), 400
+        
+        seat_calendar = availability_index.calendars([package])[package.id]
+        return jsonify({
+            'month': first.strftime('%Y-%m'),
+            **_availability_json(package, seat_calendar, first, last)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@packages_bp.route('/availability', methods=['GET'])
+def get_packages_availability():
+    try:
+        try:
+            package_ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip()]
+        except ValueError:
+            return jsonify({'error': 'ids must be a comma-separated list of package ids'}), 400
+        if not package_ids:
+            return jsonify({'error': 'ids is required'}), 400
+        if len(package_ids) > MAX_AVAILABILITY_PACKAGES:
+            return jsonify({'error': f'At most {MAX_AVAILABILITY_PACKAGES} packages per request'}), 400
+        
+        try:
+            first, last = _month_range(request.args.get('month'))
+        except ValueError:
+            return jsonify({'error': 'Invalid month format. Use YYYY-MM'}), 400
+        
+        packages = TravelPackage.query.filter_by(is_active=True).filter(TravelPackage.id.in_(package_ids)).all()
+        calendars = availability_index.calendars(packages)
+        by_id = {package.id: package for package in packages}
+        return jsonify({
+            'month': first.strftime('%Y-%m'),
+            'packages': [
+                _availability_json(by_id[package_id], calendars[package_id], first, last)
+                for package_id in dict.fromkeys(package_ids) if package_id in by_id
+            ]
         }), 200
         
     except Exception as e:
@@ -129,15 +226,9 @@ def get_package(package_id):
 
 @packages_bp.route('/', methods=['POST'])
 @jwt_required()
+@roles_required(UserRole.ADMIN, UserRole.TRAVEL_AGENT)
 def create_package():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        # Check if user is admin or travel agent
-        if user.role not in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
-            return jsonify({'error': 'Insufficient permissions'}), 403
-        
         data = request.get_json()
         
         # Validate required fields
@@ -172,7 +263,9 @@ def create_package():
         )
         
         db.session.add(package)
+        index_package(package)
         db.session.commit()
+        response_cache.invalidate('packages:list', 'packages:destinations')
         
         return jsonify({
             'message': 'Package created successfully',
@@ -185,15 +278,9 @@ def create_package():
 
 @packages_bp.route('/<int:package_id>', methods=['PUT'])
 @jwt_required()
+@roles_required(UserRole.ADMIN, UserRole.TRAVEL_AGENT)
 def update_package(package_id):
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        # Check if user is admin or travel agent
-        if user.role not in [UserRole.ADMIN, UserRole.TRAVEL_AGENT]:
-            return jsonify({'error': 'Insufficient permissions'}), 403
-        
         package = TravelPackage.query.get(package_id)
         if not package:
             return jsonify({'error': 'Package not found'}), 404
@@ -212,7 +299,7 @@ def update_package(package_id):
         if 'price' in data:
             package.price = data['price']
         if 'max_travelers' in data:
-            package.max_travelers = data['max_travelers']
+            change_capacity(package, data['max_travelers'])
         if 'available_from' in data:
             try:
                 package.available_from = datetime.strptime(data['available_from'], '%Y-%m-%d').date()
@@ -232,35 +319,39 @@ def update_package(package_id):
         if 'is_active' in data:
             package.is_active = data['is_active']
         
+        index_package(package)
         db.session.commit()
+        response_cache.invalidate('packages:list', 'packages:destinations', f'packages:detail:{package_id}')
         
         return jsonify({
             'message': 'Package updated successfully',
             'package': package.to_dict()
         }), 200
         
+    except CapacityBelowBookings as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @packages_bp.route('/<int:package_id>', methods=['DELETE'])
 @jwt_required()
+@roles_required(UserRole.ADMIN)
 def delete_package(package_id):
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        # Check if user is admin
-        if user.role != UserRole.ADMIN:
-            return jsonify({'error': 'Insufficient permissions'}), 403
-        
         package = TravelPackage.query.get(package_id)
         if not package:
             return jsonify({'error': 'Package not found'}), 404
         
         # Hard delete - remove from database
+        remove_package(package.id)
         db.session.delete(package)
         db.session.commit()
+        response_cache.invalidate(
+            'packages:list', 'packages:destinations',
+            f'packages:detail:{package_id}', f'reviews:package:{package_id}'
+        )
         
         return jsonify({'message': 'Package deleted successfully'}), 200
         
@@ -269,6 +360,7 @@ def delete_package(package_id):
         return jsonify({'error': str(e)}), 500
 
 @packages_bp.route('/destinations', methods=['GET'])
+@response_cache.cached('packages:destinations')
 def get_destinations():
     try:
         destinations = db.session.query(TravelPackage.destination).filter_by(is_active=True).distinct().all()
@@ -1,22 +1,27 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Payment, Booking, User, UserRole, PaymentStatus
-import razorpay
-import os
+from sqlalchemy import insert
+from models import db, Payment, Booking, UserRole, PaymentStatus, WebhookEvent
+from authz import current_role, roles_required
+from pagination import cursor_page, newest_first, InvalidCursor
+from ratelimit import rate_limiter
+from idempotency import idempotent
+from gateway import payment_gateway, to_paise, GatewayRejected, GatewayUnavailable, unavailable_response
+from jobs import enqueue
+from inventory import confirm_paid_booking
+from datetime import datetime
+import hashlib
 import json
 
 payments_bp = Blueprint('payments', __name__)
 
-# Initialize Razorpay client
-razorpay_client = razorpay.Client(
-    auth=(os.getenv('RAZORPAY_KEY_ID'), os.getenv('RAZORPAY_KEY_SECRET'))
-)
-
 @payments_bp.route('/create-order', methods=['POST'])
 @jwt_required()
+@rate_limiter.limit()
+@idempotent
 def create_payment_order():
     try:
-        user_id = get_jwt_identity()
+        user_id = int(get_jwt_identity())
         data = request.get_json()
         
         if 'booking_id' not in data:
@@ -41,7 +46,7 @@ def create_payment_order():
         
         # Create Razorpay order
         order_data = {
-            'amount': int(booking.total_amount * 100),  # Convert to paise
+            'amount': to_paise(booking.total_amount),
             'currency': 'INR',
             'receipt': f'booking_{booking.id}',
             'notes': {
@@ -51,7 +56,7 @@ def create_payment_order():
             }
         }
         
-        razorpay_order = razorpay_client.order.create(data=order_data)
+        razorpay_order = payment_gateway.create_order(order_data)
         
         # Create or update payment record
         if existing_payment:
@@ -78,6 +83,12 @@ def create_payment_order():
             'payment_id': payment.id
         }), 200
         
+    except GatewayUnavailable as e:
+        db.session.rollback()
+        return unavailable_response(e)
+    except GatewayRejected as e:
+        db.session.rollback()
+        return jsonify({'error': f'Payment gateway rejected the order: {e}'}), 502
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -86,7 +97,7 @@ def create_payment_order():
 @jwt_required()
 def verify_payment():
     try:
-        user_id = get_jwt_identity()
+        user_id = int(get_jwt_identity())
         data = request.get_json()
         
         required_fields = ['razorpay_payment_id', 'razorpay_order_id', 'razorpay_signature']
@@ -95,15 +106,9 @@ def verify_payment():
                 return jsonify({'error': f'{field} is required'}), 400
         
         # Verify payment signature
-        params_dict = {
-            'razorpay_order_id': data['razorpay_order_id'],
-            'razorpay_payment_id': data['razorpay_payment_id'],
-            'razorpay_signature': data['razorpay_signature']
-        }
-        
-        try:
-            razorpay_client.utility.verify_payment_signature(params_dict)
-        except Exception as e:
+        if not payment_gateway.verify_payment_signature(
+            data['razorpay_order_id'], data['razorpay_payment_id'], data['razorpay_signature']
+        ):
             return jsonify({'error': 'Payment verification failed'}), 400
         
         # Find payment record
@@ -118,13 +123,22 @@ def verify_payment():
         if payment.booking.user_id != user_id:
             return jsonify({'error': 'Access denied'}), 403
         
+        if payment.status == PaymentStatus.REFUNDED:
+            return jsonify({'error': 'Payment has already been refunded'}), 400
+        
         # Update payment status
         payment.razorpay_payment_id = data['razorpay_payment_id']
         payment.status = PaymentStatus.COMPLETED
         payment.payment_method = 'razorpay'
         
-        # Update booking status
-        payment.booking.status = 'confirmed'
+        # Confirm the booking, or refund if its seats went while it was cancelled
+        if not confirm_paid_booking(payment):
+            db.session.commit()
+            return jsonify({
+                'error': 'The seats for this booking are no longer available; the payment will be refunded',
+                'payment': payment.to_dict(),
+                'booking': payment.booking.to_dict()
+            }), 409
         
         db.session.commit()
         
@@ -138,19 +152,43 @@ def verify_payment():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@payments_bp.route('/webhook', methods=['POST'])
+def razorpay_webhook():
+    try:
+        body = request.get_data()
+        if not payment_gateway.verify_webhook_signature(body, request.headers.get('X-Razorpay-Signature', '')):
+            return jsonify({'error': 'Invalid signature'}), 400
+        
+        # Store the raw event in a single insert; `flask process-webhooks` applies it
+        event_id = request.headers.get('X-Razorpay-Event-Id') or hashlib.sha256(body).hexdigest()
+        db.session.execute(insert(WebhookEvent).values(
+            event_id=event_id,
+            payload=body.decode('utf-8'),
+            received_at=datetime.utcnow()
+        ))
+        db.session.commit()
+        
+        return jsonify({'status': 'accepted'}), 200
+        
+    except UnicodeDecodeError:
+        return jsonify({'error': 'Body must be UTF-8 JSON'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @payments_bp.route('/status/<int:payment_id>', methods=['GET'])
 @jwt_required()
 def get_payment_status(payment_id):
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user_id = int(get_jwt_identity())
+        role = current_role()
         
         payment = Payment.query.get(payment_id)
         if not payment:
             return jsonify({'error': 'Payment not found'}), 404
         
         # Check if user owns the payment or is admin
-        if payment.booking.user_id != user_id and user.role != UserRole.ADMIN:
+        if payment.booking.user_id != user_id and role != UserRole.ADMIN:
             return jsonify({'error': 'Access denied'}), 403
         
         return jsonify({'payment': payment.to_dict()}), 200
@@ -162,15 +200,15 @@ def get_payment_status(payment_id):
 @jwt_required()
 def get_booking_payments(booking_id):
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user_id = int(get_jwt_identity())
+        role = current_role()
         
         booking = Booking.query.get(booking_id)
         if not booking:
             return jsonify({'error': 'Booking not found'}), 404
         
         # Check if user owns the booking or is admin
-        if booking.user_id != user_id and user.role != UserRole.ADMIN:
+        if booking.user_id != user_id and role != UserRole.ADMIN:
             return jsonify({'error': 'Access denied'}), 403
         
         payments = Payment.query.filter_by(booking_id=booking_id).all()
@@ -183,15 +221,9 @@ def get_booking_payments(booking_id):
 
 @payments_bp.route('/refund', methods=['POST'])
 @jwt_required()
+@roles_required(UserRole.ADMIN, message='Admin access required')
 def create_refund():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        # Check if user is admin
-        if user.role != UserRole.ADMIN:
-            return jsonify({'error': 'Admin access required'}), 403
-        
         data = request.get_json()
         
         if 'payment_id' not in data:
@@ -204,36 +236,19 @@ def create_refund():
         if payment.status != PaymentStatus.COMPLETED:
             return jsonify({'error': 'Payment is not completed'}), 400
         
-        # Create Razorpay refund
-        refund_data = {
-            'payment_id': payment.razorpay_payment_id,
-            'amount': int(payment.amount * 100),  # Convert to paise
-            'notes': {
-                'reason': data.get('reason', 'Refund requested by admin'),
-                'booking_id': payment.booking_id
-            }
-        }
-        
-        try:
-            razorpay_refund = razorpay_client.payment.refund(
-                payment.razorpay_payment_id, refund_data
-            )
-        except Exception as e:
-            return jsonify({'error': f'Refund failed: {str(e)}'}), 500
-        
-        # Update payment status
-        payment.status = PaymentStatus.REFUNDED
-        
-        # Update booking status
-        payment.booking.status = 'cancelled'
-        
+        # The gateway call runs on a job worker; one refund job per payment at a time
+        job = enqueue('refund_payment', {
+            'payment_id': payment.id,
+            'reason': data.get('reason', 'Refund requested by admin')
+        }, key=f'refund:{payment.id}')
         db.session.commit()
         
         return jsonify({
-            'message': 'Refund processed successfully',
-            'refund_id': razorpay_refund['id'],
+            'message': 'Refund queued',
+            'job_id': job.id,
+            'status_url': f'/api/admin/jobs/{job.id}',
             'payment': payment.to_dict()
-        }), 200
+        }), 202
         
     except Exception as e:
         db.session.rollback()
@@ -241,15 +256,9 @@ def create_refund():
 
 @payments_bp.route('/all', methods=['GET'])
 @jwt_required()
+@roles_required(UserRole.ADMIN, message='Admin access required')
 def get_all_payments():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        # Check if user is admin
-        if user.role != UserRole.ADMIN:
-            return jsonify({'error': 'Admin access required'}), 403
-        
         # Get query parameters
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
@@ -269,6 +278,13 @@ def get_all_payments():
         if booking_id:
             query = query.filter_by(booking_id=booking_id)
         
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            return jsonify(cursor_page(
+                query, newest_first(Payment), per_page,
+                lambda payments: {'payments': [payment.to_dict() for payment in payments]}
+            )), 200
+        
         # Paginate results
         payments = query.paginate(
             page=page, per_page=per_page, error_out=False
@@ -284,5 +300,7 @@ def get_all_payments():
             'per_page': per_page
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,10 +1,19 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.exc import IntegrityError
 from models import db, Review, TravelPackage, User, UserRole, Booking, BookingStatus
+from authz import current_role, roles_required
+from ratings import adjust_rating_stats
+from pagination import cursor_page, newest_first, InvalidCursor
+from cache import response_cache, make_etag, not_modified, add_validators
 from datetime import datetime
 
 reviews_bp = Blueprint('reviews', __name__)
 
+def invalidate_package_reviews(package_id):
+    """Drop cached catalog responses that embed a package's reviews or rating"""
+    response_cache.invalidate('packages:list', f'packages:detail:{package_id}', f'reviews:package:{package_id}')
+
 @reviews_bp.route('/', methods=['POST'])
 @jwt_required()
 def create_review():
@@ -56,18 +65,25 @@ def create_review():
         )
         
         db.session.add(review)
+        adjust_rating_stats(review.package_id, rating, 1)
         db.session.commit()
+        invalidate_package_reviews(review.package_id)
         
         return jsonify({
             'message': 'Review created successfully',
             'review': review.to_dict()
         }), 201
         
+    except IntegrityError:
+        # A concurrent request stored the user's review first
+        db.session.rollback()
+        return jsonify({'error': 'You have already reviewed this package'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @reviews_bp.route('/package/<int:package_id>', methods=['GET'])
+@response_cache.cached(lambda package_id: f'reviews:package:{package_id}')
 def get_package_reviews(package_id):
     try:
         # Check if package exists
@@ -79,32 +95,42 @@ def get_package_reviews(package_id):
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
         
+        # Answer revalidation before loading any reviews
+        etag = make_etag('reviews', package.id, package.version, sorted(request.args.items(multi=True)))
+        response = not_modified(etag, package.last_modified)
+        if response:
+            return response
+        
         # Get reviews
-        reviews = Review.query.filter_by(package_id=package_id).paginate(
+        query = Review.query.filter_by(package_id=package_id)
+        
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            response = jsonify(cursor_page(
+                query, newest_first(Review), per_page,
+                lambda reviews: {'reviews': [review.to_dict() for review in reviews]}
+            ))
+            return add_validators(response, etag, package.last_modified), 200
+        
+        reviews = query.paginate(
             page=page, per_page=per_page, error_out=False
         )
         
         review_list = [review.to_dict() for review in reviews.items]
         
-        # Calculate average rating
-        all_reviews = Review.query.filter_by(package_id=package_id).all()
-        if all_reviews:
-            avg_rating = sum(review.rating for review in all_reviews) / len(all_reviews)
-            total_reviews = len(all_reviews)
-        else:
-            avg_rating = 0
-            total_reviews = 0
-        
-        return jsonify({
+        response = jsonify({
             'reviews': review_list,
-            'average_rating': round(avg_rating, 1),
-            'total_reviews': total_reviews,
+            'average_rating': package.average_rating,
+            'total_reviews': package.total_reviews,
             'total': reviews.total,
             'pages': reviews.pages,
             'current_page': page,
             'per_page': per_page
-        }), 200
+        })
+        return add_validators(response, etag, package.last_modified), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -125,29 +151,33 @@ def get_review(review_id):
 def update_review(review_id):
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        role = current_role()
         
         review = Review.query.get(review_id)
         if not review:
             return jsonify({'error': 'Review not found'}), 404
         
         # Check if user owns the review or is admin
-        if review.user_id != user_id and user.role != UserRole.ADMIN:
+        if review.user_id != user_id and role != UserRole.ADMIN:
             return jsonify({'error': 'Access denied'}), 403
         
         data = request.get_json()
         
         # Update allowed fields
+        rating_delta = 0
         if 'rating' in data:
             rating = data['rating']
             if not isinstance(rating, int) or rating < 1 or rating > 5:
                 return jsonify({'error': 'Rating must be an integer between 1 and 5'}), 400
+            rating_delta = rating - review.rating
             review.rating = rating
         
         if 'comment' in data:
             review.comment = data['comment']
         
+        adjust_rating_stats(review.package_id, rating_delta, 0)
         db.session.commit()
+        invalidate_package_reviews(review.package_id)
         
         return jsonify({
             'message': 'Review updated successfully',
@@ -163,18 +193,21 @@ def update_review(review_id):
 def delete_review(review_id):
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        role = current_role()
         
         review = Review.query.get(review_id)
         if not review:
             return jsonify({'error': 'Review not found'}), 404
         
         # Check if user owns the review or is admin
-        if review.user_id != user_id and user.role != UserRole.ADMIN:
+        if review.user_id != user_id and role != UserRole.ADMIN:
             return jsonify({'error': 'Access denied'}), 403
         
+        package_id = review.package_id
+        adjust_rating_stats(package_id, -review.rating, -1)
         db.session.delete(review)
         db.session.commit()
+        invalidate_package_reviews(package_id)
         
         return jsonify({'message': 'Review deleted successfully'}), 200
         
@@ -193,7 +226,16 @@ def get_user_reviews():
         per_page = request.args.get('per_page', 10, type=int)
         
         # Get user's reviews
-        reviews = Review.query.filter_by(user_id=user_id).paginate(
+        query = Review.query.filter_by(user_id=user_id)
+        
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            return jsonify(cursor_page(
+                query, newest_first(Review), per_page,
+                lambda reviews: {'reviews': [review.to_dict() for review in reviews]}
+            )), 200
+        
+        reviews = query.paginate(
             page=page, per_page=per_page, error_out=False
         )
         
@@ -207,20 +249,16 @@ def get_user_reviews():
             'per_page': per_page
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @reviews_bp.route('/all', methods=['GET'])
 @jwt_required()
+@roles_required(UserRole.ADMIN)
 def get_all_reviews():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
-        
-        # Check if user is admin
-        if user.role != UserRole.ADMIN:
-            return jsonify({'error': 'Insufficient permissions'}), 403
-        
         # Get query parameters
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
@@ -236,6 +274,13 @@ def get_all_reviews():
         if user_filter:
             query = query.filter_by(user_id=user_filter)
         
+        # Keyset pagination when a cursor is supplied
+        if 'cursor' in request.args:
+            return jsonify(cursor_page(
+                query, newest_first(Review), per_page,
+                lambda reviews: {'reviews': [review.to_dict() for review in reviews]}
+            )), 200
+        
         # Paginate results
         reviews = query.paginate(
             page=page, per_page=per_page, error_out=False
@@ -251,5 +296,7 @@ def get_all_reviews():
             'per_page': per_page
         }), 200
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
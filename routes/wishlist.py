@@ -1,5 +1,6 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.exc import IntegrityError
 from models import db, User, TravelPackage, Wishlist
 from datetime import datetime
 
@@ -76,6 +77,10 @@ def add_to_wishlist():
             'message': 'Added to wishlist successfully'
         }), 201
         
+    except IntegrityError:
+        # A concurrent request added the package first
+        db.session.rollback()
+        return jsonify({'error': 'Package already in wishlist'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,129 @@
+"""
+Full-text package search
+
+Packages are searchable over title, destination, description and includes.
+On SQLite the text lives in the travel_packages_fts FTS5 table, which the
+package write handlers keep in sync through index_package() and
+remove_package(). On MySQL the FULLTEXT index ix_travel_packages_fulltext is
+maintained by the database, so those calls are no-ops there. Other databases
+fall back to unranked substring matching.
+"""
+
+import json
+import re
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Float, Integer, false, or_, text
+from models import db, TravelPackage
+
+# bm25() weights for title, destination, description and includes
+FTS_WEIGHTS = (10.0, 5.0, 1.0, 1.0)
+
+INSERT_SQL = text(
+    "INSERT INTO travel_packages_fts (rowid, title, destination, description, includes) "
+    "VALUES (:id, :title, :destination, :description, :includes)"
+)
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def _includes_text(includes):
+    """Flatten the JSON list stored in TravelPackage.includes into plain text"""
+    if not includes:
+        return ''
+    try:
+        return ' '.join(str(item) for item in json.loads(includes))
+    except (json.JSONDecodeError, TypeError):
+        return includes
+
+
+def _match_expression(q):
+    """Turn free text into an FTS5 query that ANDs prefix matches of each word"""
+    terms = re.findall(r'\w+', q)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def _index_row(package):
+    return {
+        'id': package.id,
+        'title': package.title,
+        'destination': package.destination,
+        'description': package.description or '',
+        'includes': _includes_text(package.includes)
+    }
+
+
+def index_package(package):
+    """Add or refresh a package in the search index within the current transaction"""
+    if _dialect() != 'sqlite':
+        return
+    db.session.flush()
+    remove_package(package.id)
+    db.session.execute(INSERT_SQL, _index_row(package))
+
+
+def remove_package(package_id):
+    """Drop a package from the search index within the current transaction"""
+    if _dialect() != 'sqlite':
+        return
+    db.session.execute(text("DELETE FROM travel_packages_fts WHERE rowid = :id"), {'id': package_id})
+
+
+def search_packages(query, q):
+    """
+    Restrict a TravelPackage query to packages matching ``q``.
+
+    Returns the filtered query and an ORDER BY clause that ranks the matches by
+    relevance, best first.
+    """
+    dialect = _dialect()
+
+    if dialect == 'sqlite':
+        match = _match_expression(q)
+        if not match:
+            return query.filter(false()), None
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        matches = text(
+            f"SELECT rowid AS package_id, bm25(travel_packages_fts, {weights}) AS rank "
+            "FROM travel_packages_fts WHERE travel_packages_fts MATCH :match"
+        ).bindparams(match=match).columns(package_id=Integer, rank=Float).subquery('search_matches')
+        query = query.join(matches, matches.c.package_id == TravelPackage.id)
+        # bm25() scores are negative, lower is more relevant
+        return query, matches.c.rank.asc()
+
+    if dialect == 'mysql':
+        against = ("MATCH (travel_packages.title, travel_packages.destination, travel_packages.description, "
+                   "travel_packages.includes) AGAINST (:search_q IN NATURAL LANGUAGE MODE)")
+        query = query.filter(text(against).bindparams(search_q=q))
+        return query, text(f"{against} DESC").bindparams(search_q=q)
+
+    pattern = f'%{q}%'
+    query = query.filter(or_(
+        TravelPackage.title.ilike(pattern),
+        TravelPackage.destination.ilike(pattern),
+        TravelPackage.description.ilike(pattern),
+        TravelPackage.includes.ilike(pattern)
+    ))
+    return query, None
+
+
+def rebuild_search_index():
+    """Repopulate the search index from the travel_packages table"""
+    if _dialect() != 'sqlite':
+        return 0
+    db.session.execute(text("DELETE FROM travel_packages_fts"))
+    packages = TravelPackage.query.all()
+    if packages:
+        db.session.execute(INSERT_SQL, [_index_row(package) for package in packages])
+    db.session.commit()
+    return len(packages)
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index_command():
+    """Repopulate the full-text package search index"""
+    indexed = rebuild_search_index()
+    click.echo(f'Indexed {indexed} packages')
@@ -0,0 +1,208 @@
+"""
+Production tuning for the SQLite database used by app_sqlite.py
+
+SQLite's defaults suit a single short-lived process: a rollback journal that
+makes readers wait for writers, and a full fsync on every commit. The
+'production' profile sets, on every new connection:
+
+    journal_mode=WAL      readers no longer block behind a writer, and the
+                          reverse; commits append to the write-ahead log
+    synchronous=NORMAL    fsync at checkpoints instead of every commit; still
+                          safe against corruption, a power cut may lose the
+                          last commits
+    busy_timeout          writers queue for the lock instead of failing
+                          with 'database is locked'
+    cache_size            page cache per connection
+    mmap_size             read pages through a memory map, skipping a copy
+    temp_store=MEMORY     sorts and temporary indexes stay off disk
+
+It also sizes the connection pool for a threaded server. Each pooled
+connection keeps its page cache warm, and requests beyond the pool wait up
+to SQLITE_POOL_TIMEOUT seconds instead of opening yet more connections that
+would only queue for the single write lock.
+
+WAL is a property of the database file, so switching back to the default
+profile leaves the file in WAL mode until `PRAGMA journal_mode=DELETE`.
+
+Call engine_options() for SQLALCHEMY_ENGINE_OPTIONS before db.init_app(),
+and init_app() after it. Compare the two profiles on this machine with:
+
+    python sqlite_profile.py bench --threads 8 --seconds 3
+
+Configuration:
+    SQLITE_PROFILE       'default' (SQLite's own settings) or 'production'
+    SQLITE_BUSY_TIMEOUT  milliseconds a writer waits for the lock (default 5000)
+    SQLITE_CACHE_SIZE    page cache per connection in KiB (default 65536)
+    SQLITE_MMAP_SIZE     bytes of the file memory-mapped (default 268435456)
+    SQLITE_POOL_SIZE     pooled connections (default 8)
+    SQLITE_POOL_TIMEOUT  seconds a request waits for a connection (default 30)
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import tempfile
+import time
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+from database import db
+
+PROFILES = ('default', 'production')
+
+DEFAULTS = {
+    'SQLITE_PROFILE': 'default',
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_CACHE_SIZE': 65536,
+    'SQLITE_MMAP_SIZE': 268435456,
+    'SQLITE_POOL_SIZE': 8,
+    'SQLITE_POOL_TIMEOUT': 30,
+}
+
+
+def _setting(config, name):
+    value = config.get(name)
+    return DEFAULTS[name] if value is None else value
+
+
+def _profile(config):
+    profile = _setting(config, 'SQLITE_PROFILE')
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown SQLITE_PROFILE: {profile}')
+    return profile
+
+
+def _is_file_database(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def pragmas(config):
+    """PRAGMA name -> value applied to each new connection under the production profile"""
+    return {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': int(_setting(config, 'SQLITE_BUSY_TIMEOUT')),
+        # Negative sizes are in KiB rather than pages
+        'cache_size': -int(_setting(config, 'SQLITE_CACHE_SIZE')),
+        'mmap_size': int(_setting(config, 'SQLITE_MMAP_SIZE')),
+        'temp_store': 'MEMORY',
+    }
+
+
+def apply_pragmas(dbapi_connection, values):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in values.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def engine_options(config, uri=None):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured profile; empty unless production on a file database"""
+    uri = uri or config.get('SQLALCHEMY_DATABASE_URI')
+    if _profile(config) != 'production' or not uri or not _is_file_database(uri):
+        return {}
+    return {
+        'poolclass': QueuePool,
+        'pool_size': int(_setting(config, 'SQLITE_POOL_SIZE')),
+        'max_overflow': 0,
+        'pool_timeout': float(_setting(config, 'SQLITE_POOL_TIMEOUT')),
+        'connect_args': {
+            # Pooled connections move between request threads
+            'check_same_thread': False,
+            'timeout': int(_setting(config, 'SQLITE_BUSY_TIMEOUT')) / 1000,
+        },
+    }
+
+
+def tune_engine(engine, config):
+    """Apply the production pragmas to every connection the engine opens"""
+    values = pragmas(config)
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, values)
+
+
+def init_app(app):
+    """Tune the app's SQLite engine when SQLITE_PROFILE is 'production'; call after db.init_app()"""
+    for name, value in DEFAULTS.items():
+        app.config.setdefault(name, value)
+    if _profile(app.config) != 'production':
+        return
+
+    with app.app_context():
+        engine = db.engine
+    if _is_file_database(engine.url):
+        tune_engine(engine, app.config)
+
+
+def _bench_workload(engine, rows, seconds, threads, write_share):
+    """(reads, writes, lock errors) completed by the threads within the time limit"""
+    deadline = time.perf_counter() + seconds
+
+    def worker(seed):
+        rng = random.Random(seed)
+        reads = writes = errors = 0
+        while time.perf_counter() < deadline:
+            row = rng.randrange(rows)
+            try:
+                if rng.random() < write_share:
+                    with engine.begin() as conn:
+                        conn.execute(text('UPDATE seats SET remaining = remaining - 1 WHERE id = :id'), {'id': row})
+                    writes += 1
+                else:
+                    with engine.connect() as conn:
+                        conn.execute(text('SELECT day, remaining FROM seats WHERE package_id = :p'),
+                                     {'p': row % 100}).all()
+                    reads += 1
+            except OperationalError:
+                errors += 1
+        return reads, writes, errors
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(worker, range(threads)))
+    return tuple(sum(column) for column in zip(*results))
+
+
+def bench(threads, seconds, rows):
+    """Read-only, write-only and mixed throughput of a file database under each profile"""
+    workloads = (('reads', 0.0), ('writes', 1.0), ('mixed 80/20', 0.2))
+    for profile in PROFILES:
+        config = {'SQLITE_PROFILE': profile, 'SQLITE_POOL_SIZE': threads}
+        with tempfile.TemporaryDirectory() as tmp:
+            uri = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+            engine = create_engine(uri, **engine_options(config, uri))
+            if profile == 'production':
+                tune_engine(engine, config)
+            with engine.begin() as conn:
+                conn.execute(text('CREATE TABLE seats (id INTEGER PRIMARY KEY, package_id INTEGER, '
+                                  'day TEXT, remaining INTEGER)'))
+                conn.execute(text('CREATE INDEX ix_seats_package ON seats (package_id)'))
+                conn.execute(text('INSERT INTO seats (id, package_id, day, remaining) '
+                                  'VALUES (:id, :package_id, :day, 20)'),
+                             [{'id': i, 'package_id': i % 100, 'day': f'2026-{i % 12 + 1:02d}-01'}
+                              for i in range(rows)])
+            for name, write_share in workloads:
+                reads, writes, errors = _bench_workload(engine, rows, seconds, threads, write_share)
+                print(f'{profile:<10} {name:<12} {reads / seconds:>9.0f} reads/s {writes / seconds:>8.0f} writes/s'
+                      f'  ({errors} lock errors)')
+            engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('mode', choices=['bench'])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--rows', type=int, default=10000)
+    args = parser.parse_args()
+    bench(args.threads, args.seconds, args.rows)
+
+
+if __name__ == '__main__':
+    main()
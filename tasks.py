@@ -0,0 +1,74 @@
+"""
+Background tasks run by `flask run-jobs` workers
+
+Each task receives its job's payload as keyword arguments and makes its
+database changes without committing; the worker commits them together with
+the job's outcome. Tasks may run more than once, so each one checks the
+current state before acting. reconcile_payments is the exception: it commits
+each batch with its checkpoint, so a retry carries on where it stopped.
+"""
+
+from flask import current_app
+from gateway import payment_gateway, to_paise, GatewayRejected
+from jobs import enqueue, task, PermanentJobError
+from models import db, Payment, PaymentStatus, BookingStatus
+from reconcile import reconcile, start_run
+from inventory import set_booking_status
+
+
+@task('refund_payment')
+def refund_payment(payment_id, reason):
+    """Refund a completed payment in full and cancel its booking"""
+    payment = db.session.get(Payment, payment_id)
+    if not payment:
+        raise PermanentJobError('Payment not found')
+    if payment.status == PaymentStatus.REFUNDED:
+        return {'skipped': 'Payment already refunded'}
+    if payment.status != PaymentStatus.COMPLETED:
+        raise PermanentJobError('Payment is not completed')
+
+    # The refund's receipt identifies it at the gateway. An earlier attempt may
+    # have been refunded there and then died, or failed to commit, before
+    # recording it; look before sending a second one.
+    receipt = f'refund_payment_{payment.id}'
+    # GatewayUnavailable propagates and the job is retried
+    try:
+        razorpay_refund = next((refund for refund in payment_gateway.fetch_refunds(payment.razorpay_payment_id)
+                                if refund.get('receipt') == receipt), None)
+        if razorpay_refund is None:
+            razorpay_refund = payment_gateway.refund(payment.razorpay_payment_id, {
+                'payment_id': payment.razorpay_payment_id,
+                'amount': to_paise(payment.amount),
+                'receipt': receipt,
+                'notes': {
+                    'reason': reason,
+                    'booking_id': payment.booking_id
+                }
+            })
+    except GatewayRejected as e:
+        raise PermanentJobError(f'Refund failed: {e}')
+
+    payment.status = PaymentStatus.REFUNDED
+    set_booking_status(payment.booking, BookingStatus.CANCELLED)
+    return {'refund_id': razorpay_refund['id'], 'payment_id': payment.id}
+
+
+@task('send_email')
+def send_email(to, subject, body):
+    """Send a plain-text email through Flask-Mail"""
+    from flask_mail import Message  # Optional dependency, only needed for email tasks
+
+    mail = current_app.extensions.get('mail')
+    if mail is None:
+        raise PermanentJobError('Mail is not configured')
+    mail.send(Message(subject, recipients=[to], body=body))
+    return {'to': to}
+
+
+@task('reconcile_payments')
+def reconcile_payments():
+    """Check the next RECONCILE_BATCHES_PER_JOB batches of the current run, then queue the rest"""
+    run = reconcile(start_run(), max_batches=current_app.config.get('RECONCILE_BATCHES_PER_JOB', 20))
+    if run.finished_at is None:
+        enqueue('reconcile_payments')
+    return run.to_dict()
@@ -0,0 +1,83 @@
+"""
+In-process tests for the composite admin dashboard endpoint
+"""
+
+from datetime import date
+
+from cache import response_cache
+from conftest import make_user, make_package, auth_headers
+from database import db
+from models import Booking, Payment, Review, UserRole
+
+
+def seed(admin, count):
+    package = make_package()
+    for i in range(count):
+        booking = Booking(user_id=admin.id, package_id=package.id, booking_date=date.today(),
+                          number_of_travelers=1, total_amount=100.0 * (i + 1))
+        db.session.add(booking)
+        db.session.flush()
+        db.session.add(Payment(booking_id=booking.id, amount=booking.total_amount))
+    db.session.add(Review(user_id=admin.id, package_id=package.id, rating=4, comment='Lovely'))
+    db.session.commit()
+    return package
+
+
+def test_dashboard_assembles_every_section(client, count_queries):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    package = seed(admin, 7)
+    package_id, package_title = package.id, package.title
+    headers = auth_headers(admin)
+
+    db.session.expire_all()
+    with count_queries() as statements:
+        response = client.get('/api/admin/dashboard?per_page=3', headers=headers)
+    assert response.status_code == 200
+    data = response.get_json()
+
+    # One admin lookup for the whole request instead of one per section
+    assert sum('FROM users' in s and 'users.id = ?' in s for s in statements) == 1
+    assert data['errors'] == {}
+    assert data['stats']['bookings']['total'] == 7
+    assert [b['total_amount'] for b in data['recent_bookings']['bookings']] == [700.0, 600.0, 500.0, 400.0, 300.0]
+    assert data['recent_bookings']['bookings'][0]['package']['title'] == package_title
+    assert data['recent_reviews']['reviews'][0]['package']['id'] == package_id
+    assert len(data['payments']['payments']) == 3
+    assert data['payments']['next_cursor']
+    assert data['users']['next_cursor'] is None
+
+    assert set(data['timings_ms']) == {'stats', 'recent_bookings', 'recent_reviews',
+                                       'users', 'packages', 'payments', 'total'}
+    assert response.headers['Server-Timing'].startswith('stats;dur=')
+
+
+def test_next_cursor_continues_on_the_list_endpoint(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    seed(admin, 5)
+    headers = auth_headers(admin)
+
+    first = client.get('/api/admin/dashboard?sections=payments&per_page=2', headers=headers).get_json()
+    rest = client.get(f"/api/payments/all?per_page=10&cursor={first['payments']['next_cursor']}",
+                      headers=headers).get_json()
+    assert [p['id'] for p in first['payments']['payments'] + rest['payments']] == [5, 4, 3, 2, 1]
+
+
+def test_dashboard_shares_the_stats_cache(app, client):
+    app.config['RESPONSE_CACHE_BACKEND'] = 'memory'
+    response_cache.init_app(app)
+    response_cache.clear()
+    admin = make_user('admin', role=UserRole.ADMIN)
+    headers = auth_headers(admin)
+
+    client.get('/api/admin/stats', headers=headers)
+    client.get('/api/admin/dashboard?sections=stats', headers=headers)
+    assert response_cache.stats()['endpoints']['admin_stats'] == {'hits': 1, 'misses': 1}
+
+
+def test_dashboard_rejects_unknown_sections_and_non_admins(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+
+    response = client.get('/api/admin/dashboard?sections=stats,secrets', headers=auth_headers(admin))
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Unknown sections: secrets'
+    assert client.get('/api/admin/dashboard', headers=auth_headers(make_user('traveler'))).status_code == 403
@@ -0,0 +1,85 @@
+"""
+In-process tests for the aggregated admin statistics endpoint
+"""
+
+from datetime import date, datetime, timedelta
+
+from cache import response_cache
+from conftest import make_user, make_package, auth_headers
+from database import db
+from models import Booking, BookingStatus, Review, UserRole
+
+
+def make_booking(user, package, status, amount, created_at=None):
+    db.session.add(Booking(
+        user_id=user.id,
+        package_id=package.id,
+        booking_date=date.today(),
+        number_of_travelers=1,
+        total_amount=amount,
+        status=status,
+        created_at=created_at or datetime.utcnow()
+    ))
+
+
+def test_stats_are_computed_in_sql(client, count_queries):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    traveler = make_user('traveler')
+    traveler.is_active = False
+    package = make_package()
+    make_package('Retired Package', is_active=False)
+
+    make_booking(traveler, package, BookingStatus.COMPLETED, 1500.0)
+    make_booking(traveler, package, BookingStatus.COMPLETED, 250.5, created_at=datetime.utcnow() - timedelta(days=60))
+    make_booking(admin, package, BookingStatus.PENDING, 900.0)
+    make_booking(admin, package, BookingStatus.CANCELLED, 400.0)
+    db.session.add(Review(user_id=traveler.id, package_id=package.id, rating=5))
+    db.session.commit()
+    headers = auth_headers(admin)
+
+    db.session.expire_all()
+    with count_queries() as statements:
+        response = client.get('/api/admin/stats', headers=headers)
+    assert response.status_code == 200
+    # One query for the admin check, two for the statistics
+    assert len(statements) == 3
+
+    assert response.get_json() == {
+        'users': {'total': 2, 'active': 1, 'inactive': 1},
+        'packages': {'total': 2, 'active': 1, 'inactive': 1},
+        'bookings': {'total': 4, 'pending': 1, 'confirmed': 0, 'completed': 2,
+                     'cancelled': 1, 'recent_30_days': 3},
+        'reviews': {'total': 1},
+        'revenue': {'total': 1750.5}
+    }
+
+
+def test_stats_on_empty_database(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+
+    data = client.get('/api/admin/stats', headers=auth_headers(admin)).get_json()
+    assert data['bookings']['total'] == 0
+    assert data['revenue']['total'] == 0
+
+
+def test_stats_are_cached_for_the_configured_ttl(app, client):
+    app.config['RESPONSE_CACHE_BACKEND'] = 'memory'
+    app.config['ADMIN_STATS_CACHE_TTL'] = 10
+    response_cache.init_app(app)
+    response_cache.clear()
+    admin = make_user('admin', role=UserRole.ADMIN)
+    headers = auth_headers(admin)
+
+    def counters():
+        return response_cache.stats()['endpoints'].get('admin_stats')
+
+    first = client.get('/api/admin/stats', headers=headers).get_json()
+    assert client.get('/api/admin/stats', headers=headers).get_json() == first
+    assert counters() == {'hits': 1, 'misses': 1}
+    # Non-admins are still turned away before the cache is consulted
+    assert client.get('/api/admin/stats', headers=auth_headers(make_user('traveler'))).status_code == 403
+    assert counters() == {'hits': 1, 'misses': 1}
+
+    app.config['ADMIN_STATS_CACHE_TTL'] = 0
+    assert client.get('/api/admin/stats', headers=headers).status_code == 200
+    assert counters() == {'hits': 1, 'misses': 1}
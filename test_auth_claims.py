@@ -0,0 +1,97 @@
+"""
+In-process tests for role claims in access tokens and token revocation
+"""
+
+import time
+from types import SimpleNamespace
+
+from flask_jwt_extended import create_access_token, decode_token
+
+import authz
+from conftest import make_user, auth_headers
+from database import db
+from models import User, UserRole
+
+
+def login(client, username):
+    response = client.post('/api/auth/login', json={'username': username, 'password': 'password123'})
+    assert response.status_code == 200
+    return response.get_json()['access_token']
+
+
+def bearer(token):
+    return {'Authorization': f'Bearer {token}'}
+
+
+def test_login_token_carries_role_and_active_claims(client):
+    make_user('agent', role=UserRole.TRAVEL_AGENT)
+
+    claims = decode_token(login(client, 'agent'))
+    assert claims['role'] == 'travel_agent'
+    assert claims['active'] is True
+    assert claims['ver'] == 0
+
+
+def test_role_checks_do_not_load_the_user(client, count_queries):
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    client.get('/api/payments/all', headers=headers)
+
+    with count_queries() as statements:
+        assert client.get('/api/payments/all', headers=headers).status_code == 200
+        assert client.get('/api/admin/users/1', headers=headers).status_code == 200
+    # Roles come from the token and the admin's own record from the identity cache
+    assert sum('FROM users' in s for s in statements) == 0
+
+    traveler = auth_headers(make_user('traveler'))
+    response = client.get('/api/payments/all', headers=traveler)
+    assert response.status_code == 403
+    assert response.get_json()['error'] == 'Admin access required'
+
+
+def test_deactivation_revokes_issued_tokens(client):
+    admin = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    traveler = make_user('traveler')
+    token = login(client, 'traveler')
+    assert client.get('/api/auth/profile', headers=bearer(token)).status_code == 200
+
+    assert client.post(f'/api/admin/users/{traveler.id}/deactivate', headers=admin).status_code == 200
+
+    response = client.get('/api/auth/profile', headers=bearer(token))
+    assert response.status_code == 401
+    assert response.get_json()['msg'] == 'Token has been revoked'
+
+
+def test_role_change_revokes_the_old_role_claim(client):
+    admin = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    agent = make_user('agent', role=UserRole.TRAVEL_AGENT)
+    token = login(client, 'agent')
+    assert client.get('/api/bookings/all', headers=bearer(token)).status_code == 200
+
+    assert client.put(f'/api/admin/users/{agent.id}', json={'role': 'end_user'}, headers=admin).status_code == 200
+    assert client.get('/api/bookings/all', headers=bearer(token)).status_code == 401
+
+    assert client.get('/api/bookings/all', headers=bearer(login(client, 'agent'))).status_code == 403
+
+
+def test_revocation_from_another_process_applies_after_the_ttl(app, client, monkeypatch):
+    make_user('traveler')
+    token = login(client, 'traveler')
+    now = [time.monotonic()]
+    monkeypatch.setattr(authz, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    assert client.get('/api/auth/profile', headers=bearer(token)).status_code == 200
+
+    # Another worker deactivated the user; this process still has the version cached
+    db.session.query(User).update({'token_version': User.token_version + 1, 'is_active': False})
+    db.session.commit()
+    assert client.get('/api/auth/profile', headers=bearer(token)).status_code == 200
+
+    now[0] += app.config.get('AUTH_VERSION_TTL', 5) + 1
+    assert client.get('/api/auth/profile', headers=bearer(token)).status_code == 401
+
+
+def test_tokens_without_claims_fall_back_to_the_database(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    headers = bearer(create_access_token(identity=str(admin.id)))
+
+    assert client.get('/api/reviews/all', headers=headers).status_code == 200
+    assert client.delete('/api/packages/999', headers=headers).status_code == 404
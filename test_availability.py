@@ -0,0 +1,107 @@
+"""
+In-process tests for the precomputed availability calendars
+"""
+
+from datetime import date, timedelta
+
+from conftest import make_user, make_package, auth_headers
+from availability import availability_index
+from database import db
+from inventory import reserve_seats
+
+DAY = date.today() + timedelta(days=10)
+MONTH = DAY.strftime('%Y-%m')
+
+
+def book(client, user, package, travelers):
+    return client.post('/api/bookings/', headers=auth_headers(user), json={
+        'package_id': package.id, 'booking_date': DAY.isoformat(), 'number_of_travelers': travelers
+    })
+
+
+def seats_on(response, day=DAY):
+    return {entry['date']: entry['remaining'] for entry in response.get_json()['days']}[day.isoformat()]
+
+
+def inventory_queries(statements):
+    return [statement for statement in statements if 'FROM package_inventory' in statement]
+
+
+def test_calendar_is_built_once_and_follows_bookings(client, count_queries):
+    package = make_package(max_travelers=6)
+    user = make_user('traveler')
+    url = f'/api/packages/{package.id}/availability?month={MONTH}'
+
+    assert seats_on(client.get(url)) == 6
+    booking_id = book(client, user, package, 4).get_json()['booking']['id']
+
+    with count_queries() as statements:
+        response = client.get(url)
+    assert seats_on(response) == 2
+    assert inventory_queries(statements) == []
+
+    client.post(f'/api/bookings/{booking_id}/cancel', headers=auth_headers(user))
+    with count_queries() as statements:
+        assert seats_on(client.get(url)) == 6
+    assert inventory_queries(statements) == []
+
+
+def test_rolled_back_reservation_leaves_calendar_alone(client):
+    package = make_package(max_travelers=6)
+    url = f'/api/packages/{package.id}/availability?month={MONTH}'
+    client.get(url)
+
+    reserve_seats(package, DAY, 5)
+    db.session.rollback()
+    assert seats_on(client.get(url)) == 6
+
+
+def test_expired_calendar_is_rebuilt_from_the_ledger(app, client, count_queries):
+    package = make_package(max_travelers=6)
+    url = f'/api/packages/{package.id}/availability?month={MONTH}'
+    client.get(url)
+
+    # Undo the local patch, as if another worker process had taken the seats
+    reserve_seats(package, DAY, 5)
+    db.session.commit()
+    availability_index._calendars.get(package.id).apply(DAY, 5)
+    assert seats_on(client.get(url)) == 6
+
+    app.config['AVAILABILITY_INDEX_TTL'] = 0
+    with count_queries() as statements:
+        assert seats_on(client.get(url)) == 1
+    assert len(inventory_queries(statements)) == 1
+
+
+def test_long_availability_window_stays_compact(client):
+    package = make_package(available_from=date.today(), available_to=date.today() + timedelta(days=3 * 365))
+    client.get(f'/api/packages/{package.id}/availability')
+
+    seat_calendar = availability_index._calendars.get(package.id)
+    assert len(seat_calendar.seats) == 3 * 365 + 1
+    assert seat_calendar.seats.itemsize == 2
+
+
+def test_multi_package_calendar_in_one_query(client, count_queries):
+    packages = [make_package(f'Package {number}', max_travelers=4 + number, price=100.0 * (number + 1))
+                for number in range(3)]
+    book(client, make_user('traveler'), packages[1], 3)
+    ids = ','.join(str(package.id) for package in packages)
+
+    with count_queries() as statements:
+        response = client.get(f'/api/packages/availability?ids={ids},999&month={MONTH}')
+    assert response.status_code == 200
+    assert len(inventory_queries(statements)) == 1
+
+    results = response.get_json()['packages']
+    assert [result['package_id'] for result in results] == [package.id for package in packages]
+    assert [result['capacity'] for result in results] == [4, 5, 6]
+    day = {entry['date']: entry for entry in results[1]['days']}[DAY.isoformat()]
+    assert day == {'date': DAY.isoformat(), 'remaining': 2, 'price': 200.0}
+
+
+def test_multi_package_calendar_validates_ids(client):
+    assert client.get('/api/packages/availability').status_code == 400
+    assert client.get('/api/packages/availability?ids=1,x').status_code == 400
+    too_many = ','.join(str(number) for number in range(1, 52))
+    assert client.get(f'/api/packages/availability?ids={too_many}').status_code == 400
@@ -0,0 +1,89 @@
+"""
+In-process tests for booking list serialization: eager loading, sideloading
+and sparse fieldsets
+"""
+
+from datetime import date
+
+from conftest import make_user, make_package, auth_headers
+from database import db
+from models import Booking, UserRole
+
+
+def make_bookings(users, packages, count):
+    for i in range(count):
+        db.session.add(Booking(
+            user_id=users[i % len(users)].id,
+            package_id=packages[i % len(packages)].id,
+            booking_date=date.today(),
+            number_of_travelers=1,
+            total_amount=packages[i % len(packages)].price
+        ))
+    db.session.commit()
+
+
+def list_bookings(client, headers, count_queries, query=''):
+    db.session.expire_all()
+    with count_queries() as statements:
+        response = client.get(f'/api/admin/bookings?per_page=50{query}', headers=headers)
+    assert response.status_code == 200
+    return response.get_json(), len(statements)
+
+
+def test_query_count_does_not_grow_with_page_size(client, count_queries):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    users = [admin] + [make_user(f'traveler{i}') for i in range(4)]
+    packages = [make_package(f'Package {i}') for i in range(6)]
+    headers = auth_headers(admin)
+
+    # Warm the per-process token version cache so both measurements match
+    list_bookings(client, headers, count_queries)
+    make_bookings(users, packages, 5)
+    _, small = list_bookings(client, headers, count_queries)
+    make_bookings(users, packages, 15)
+    data, large = list_bookings(client, headers, count_queries)
+
+    assert len(data['bookings']) == 20
+    assert large == small
+
+
+def test_default_shape_embeds_package_and_user(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    package = make_package('Bali Retreat')
+    make_bookings([admin], [package], 2)
+
+    booking = client.get('/api/admin/bookings', headers=auth_headers(admin)).get_json()['bookings'][0]
+    assert booking['package']['title'] == 'Bali Retreat'
+    assert booking['user']['username'] == 'admin'
+    assert booking['status'] == 'pending'
+    assert 'packages' not in booking
+
+
+def test_sideload_returns_each_package_once(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    packages = [make_package('Bali Retreat'), make_package('Paris City Break')]
+    make_bookings([admin], packages, 6)
+
+    data = client.get('/api/admin/bookings?sideload=package', headers=auth_headers(admin)).get_json()
+    assert sorted(data['packages']) == sorted(str(p.id) for p in packages)
+    assert data['packages'][str(packages[0].id)]['title'] == 'Bali Retreat'
+    assert all('package' not in b and 'user' in b for b in data['bookings'])
+    assert 'users' not in data
+
+
+def test_fields_and_expand_trim_the_payload(client):
+    user = make_user('traveler')
+    make_bookings([user], [make_package()], 3)
+
+    data = client.get('/api/bookings/?fields=status&expand=&cursor=', headers=auth_headers(user)).get_json()
+    assert [sorted(b) for b in data['bookings']] == [['id', 'status']] * 3
+
+
+def test_unknown_listing_arguments_are_rejected(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    headers = auth_headers(admin)
+
+    response = client.get('/api/bookings/all?expand=payments', headers=headers)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Unknown expand: payments'
+    assert client.get('/api/admin/bookings?fields=password_hash', headers=headers).status_code == 400
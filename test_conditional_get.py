@@ -0,0 +1,86 @@
+"""
+In-process tests for ETag / Last-Modified revalidation of package and review reads
+"""
+
+from datetime import date
+
+from conftest import make_user, make_package, auth_headers
+from database import db
+from models import Booking, BookingStatus, UserRole
+
+
+def test_package_detail_revalidates_with_etag(client, count_queries):
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    package = make_package()
+    url = f'/api/packages/{package.id}'
+
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert not etag.startswith('W/')
+    assert first.headers['Last-Modified']
+
+    db.session.expire_all()
+    with count_queries() as statements:
+        second = client.get(url, headers={'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.data == b''
+    # Only the package row is read; reviews are never loaded
+    assert len(statements) == 1
+
+    client.put(url, json={'price': 1500.0}, headers=headers)
+    third = client.get(url, headers={'If-None-Match': etag})
+    assert third.status_code == 200
+    assert third.headers['ETag'] != etag
+
+
+def test_review_writes_change_package_and_review_etags(client):
+    reviewer = make_user('alice')
+    package = make_package()
+    db.session.add(Booking(user_id=reviewer.id, package_id=package.id, booking_date=date.today(),
+                           number_of_travelers=1, total_amount=1000.0, status=BookingStatus.COMPLETED))
+    db.session.commit()
+    urls = [f'/api/packages/{package.id}', f'/api/reviews/package/{package.id}', '/api/packages/']
+    etags = {url: client.get(url).headers['ETag'] for url in urls}
+
+    for url, etag in etags.items():
+        assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    response = client.post('/api/reviews/', json={'package_id': package.id, 'rating': 4},
+                           headers=auth_headers(reviewer))
+    assert response.status_code == 201
+
+    for url, etag in etags.items():
+        assert client.get(url, headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_listing_etag_depends_on_query_args(client):
+    make_package()
+
+    etag = client.get('/api/packages/?page=1').headers['ETag']
+    assert client.get('/api/packages/?page=1', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/packages/?page=2', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_if_modified_since(client):
+    package = make_package()
+    url = f'/api/packages/{package.id}'
+    last_modified = client.get(url).headers['Last-Modified']
+
+    assert client.get(url, headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert client.get(url, headers={'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'}).status_code == 200
+
+
+def test_package_edits_bump_version_and_listing_etag(client):
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    package = make_package()
+    assert package.version == 1
+    etag = client.get('/api/packages/').headers['ETag']
+
+    # Two edits inside the same second still get distinct versions
+    client.put(f'/api/packages/{package.id}', json={'price': 1500.0}, headers=headers)
+    client.put(f'/api/packages/{package.id}', json={'price': 1600.0}, headers=headers)
+    db.session.refresh(package)
+    assert package.version == 3
+
+    assert client.get('/api/packages/', headers={'If-None-Match': etag}).status_code == 200
@@ -0,0 +1,152 @@
+"""
+In-process tests for the daily metrics rollup and /api/admin/metrics
+"""
+
+from datetime import date, datetime, timedelta
+
+from conftest import make_user, make_package, auth_headers
+from database import db
+from metrics import backfill_metrics
+from models import Booking, BookingStatus, DailyMetric, Payment, PaymentStatus, Review, UserRole
+
+
+def rollup():
+    """Current rollup rows as {(day, package_id): {counter: value}}, leaving out zeros"""
+    db.session.expire_all()
+    rows = {
+        (row.day, row.package_id): {name: getattr(row, name) for name in DailyMetric.COUNTERS
+                                    if getattr(row, name)}
+        for row in DailyMetric.query.all()
+    }
+    return {key: counters for key, counters in rows.items() if counters}
+
+
+def test_write_paths_update_the_rollup_incrementally(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    traveler = make_user('traveler')
+    package = make_package()
+    today = date.today()
+
+    response = client.post('/api/bookings/', json={
+        'package_id': package.id,
+        'booking_date': (today + timedelta(days=10)).isoformat(),
+        'number_of_travelers': 2
+    }, headers=auth_headers(traveler))
+    assert response.status_code == 201
+    booking_id = response.get_json()['booking']['id']
+
+    assert client.put(f'/api/admin/bookings/{booking_id}/status', json={'status': 'completed'},
+                      headers=auth_headers(admin)).status_code == 200
+
+    db.session.add(Payment(booking_id=booking_id, amount=2000.0, status=PaymentStatus.COMPLETED))
+    db.session.commit()
+
+    assert client.post('/api/reviews/', json={'package_id': package.id, 'rating': 4},
+                       headers=auth_headers(traveler)).status_code == 201
+
+    assert rollup() == {
+        (today, DailyMetric.SITE_WIDE): {'new_users': 2},
+        (today, package.id): {'bookings_completed': 1, 'revenue': 2000.0,
+                              'reviews': 1, 'review_rating_sum': 4}
+    }
+
+    payment = Payment.query.one()
+    payment.status = PaymentStatus.REFUNDED
+    db.session.delete(Review.query.one())
+    db.session.commit()
+    assert rollup()[(today, package.id)] == {'bookings_completed': 1}
+
+
+def test_rolled_back_writes_leave_the_rollup_untouched(client):
+    user = make_user('traveler')
+    package = make_package()
+
+    db.session.add(Booking(user_id=user.id, package_id=package.id, booking_date=date.today(),
+                           number_of_travelers=1, total_amount=100.0))
+    db.session.flush()
+    db.session.rollback()
+
+    assert (date.today(), package.id) not in rollup()
+
+
+def test_backfill_matches_incremental_rollup(client):
+    users = [make_user(f'traveler{i}') for i in range(3)]
+    packages = [make_package(f'Package {i}') for i in range(2)]
+    for i, user in enumerate(users):
+        created_at = datetime(2026, 3, 1 + i, 10, 0)
+        user.created_at = created_at
+        booking = Booking(user_id=user.id, package_id=packages[i % 2].id, booking_date=date(2026, 5, 1),
+                          number_of_travelers=1, total_amount=500.0, created_at=created_at,
+                          status=[BookingStatus.PENDING, BookingStatus.COMPLETED, BookingStatus.CANCELLED][i])
+        db.session.add(booking)
+        db.session.flush()
+        db.session.add(Payment(booking_id=booking.id, amount=500.0, created_at=created_at,
+                               status=PaymentStatus.COMPLETED))
+        db.session.add(Review(user_id=user.id, package_id=booking.package_id, rating=3 + i,
+                              created_at=created_at))
+    db.session.commit()
+    incremental = rollup()
+
+    DailyMetric.query.delete()
+    db.session.commit()
+    assert backfill_metrics() == len(incremental)
+    assert rollup() == incremental
+
+    # A ranged backfill only rewrites rows inside the range
+    DailyMetric.query.filter(DailyMetric.day == date(2026, 3, 1)).update({'revenue': 0})
+    db.session.commit()
+    backfill_metrics(date(2026, 3, 2), date(2026, 3, 3))
+    assert rollup()[(date(2026, 3, 1), packages[0].id)].get('revenue') is None
+    backfill_metrics(date(2026, 3, 1), date(2026, 3, 1))
+    assert rollup() == incremental
+
+
+def test_metrics_endpoint_reads_only_the_rollup(client, count_queries):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    package = make_package()
+    other = make_package('Other Package')
+    for day, package_id, counters in [
+        (date(2026, 2, 2), package.id, {'bookings_confirmed': 2, 'revenue': 300.0, 'reviews': 2, 'review_rating_sum': 9}),
+        (date(2026, 2, 4), other.id, {'bookings_pending': 1}),
+        (date(2026, 2, 10), package.id, {'bookings_cancelled': 1}),
+        (date(2026, 2, 10), DailyMetric.SITE_WIDE, {'new_users': 3}),
+    ]:
+        db.session.add(DailyMetric(day=day, package_id=package_id, **counters))
+    db.session.commit()
+    headers = auth_headers(admin)
+
+    db.session.expire_all()
+    with count_queries() as statements:
+        response = client.get('/api/admin/metrics?from=2026-02-01&to=2026-02-14&granularity=week',
+                              headers=headers)
+    assert response.status_code == 200
+    assert [s for s in statements if 'FROM users' not in s] == [
+        s for s in statements if 'daily_metrics' in s
+    ]
+
+    data = response.get_json()
+    assert [p['period'] for p in data['series']] == ['2026-01-26', '2026-02-02', '2026-02-09']
+    assert data['series'][0]['bookings']['total'] == 0
+    assert data['series'][1]['bookings'] == {'pending': 1, 'confirmed': 2, 'cancelled': 0,
+                                             'completed': 0, 'total': 3}
+    assert data['series'][1]['average_rating'] == 4.5
+    assert data['totals']['new_users'] == 3
+    assert data['totals']['revenue'] == 300.0
+
+    data = client.get(f'/api/admin/metrics?from=2026-02-01&to=2026-02-28&granularity=month&package_id={other.id}',
+                      headers=headers).get_json()
+    assert len(data['series']) == 1
+    assert data['totals']['bookings']['total'] == 1
+    assert data['totals']['new_users'] == 3
+
+
+def test_metrics_endpoint_validates_arguments(client):
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+
+    assert client.get('/api/admin/metrics?granularity=hour', headers=headers).status_code == 400
+    assert client.get('/api/admin/metrics?from=2026-13-01', headers=headers).status_code == 400
+    assert client.get('/api/admin/metrics?from=2026-02-02&to=2026-02-01', headers=headers).status_code == 400
+
+    data = client.get('/api/admin/metrics', headers=headers).get_json()
+    assert len(data['series']) == 30
+    assert data['to'] == date.today().isoformat()
@@ -0,0 +1,164 @@
+"""
+In-process tests for Idempotency-Key handling on booking and payment-order creation
+"""
+
+from datetime import date, datetime, timedelta
+
+from conftest import make_user, make_package, make_booking, auth_headers
+from database import db
+from idempotency import purge_expired_keys
+from models import Booking, IdempotencyKey, Payment
+
+
+def booking_request(package, **overrides):
+    data = {'package_id': package.id, 'booking_date': (date.today() + timedelta(days=7)).isoformat(),
+            'number_of_travelers': 2}
+    data.update(overrides)
+    return data
+
+
+def test_retried_booking_is_created_once(client):
+    user = make_user('traveler')
+    package = make_package()
+    headers = {**auth_headers(user), 'Idempotency-Key': 'booking-1'}
+
+    first = client.post('/api/bookings/', json=booking_request(package), headers=headers)
+    retry = client.post('/api/bookings/', json=booking_request(package), headers=headers)
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+    assert Booking.query.count() == 1
+
+
+def test_requests_without_key_are_not_deduplicated(client):
+    user = make_user('traveler')
+    package = make_package()
+
+    for _ in range(2):
+        client.post('/api/bookings/', json=booking_request(package), headers=auth_headers(user))
+    assert Booking.query.count() == 2
+    assert IdempotencyKey.query.count() == 0
+
+
+def test_keys_are_scoped_to_the_user(client):
+    package = make_package()
+    for username in ('alice', 'bob'):
+        headers = {**auth_headers(make_user(username)), 'Idempotency-Key': 'same-key'}
+        assert client.post('/api/bookings/', json=booking_request(package), headers=headers).status_code == 201
+    assert Booking.query.count() == 2
+
+
+def test_key_reused_for_different_request_is_rejected(client):
+    user = make_user('traveler')
+    package = make_package()
+    headers = {**auth_headers(user), 'Idempotency-Key': 'booking-1'}
+
+    client.post('/api/bookings/', json=booking_request(package), headers=headers)
+    response = client.post('/api/bookings/', json=booking_request(package, number_of_travelers=3), headers=headers)
+    assert response.status_code == 422
+    assert Booking.query.count() == 1
+
+
+def test_client_errors_are_replayed(client):
+    user = make_user('traveler')
+    headers = {**auth_headers(user), 'Idempotency-Key': 'bad-booking'}
+
+    first = client.post('/api/bookings/', json={'package_id': 1}, headers=headers)
+    retry = client.post('/api/bookings/', json={'package_id': 1}, headers=headers)
+    assert first.status_code == retry.status_code == 400
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+
+
+def test_duplicate_of_a_running_request_gets_conflict(app, client):
+    app.config.update(IDEMPOTENCY_WAIT=0.1, IDEMPOTENCY_POLL_INTERVAL=0.01)
+    user = make_user('traveler')
+    package = make_package()
+    body = booking_request(package)
+    headers = {**auth_headers(user), 'Idempotency-Key': 'booking-1'}
+
+    # Claim the key as a request still running elsewhere would
+    client.post('/api/bookings/', json=body, headers=headers)
+    IdempotencyKey.query.update({'status_code': None, 'response_body': None,
+                                 'locked_until': datetime.utcnow() + timedelta(minutes=1)})
+    db.session.commit()
+
+    response = client.post('/api/bookings/', json=body, headers=headers)
+    assert response.status_code == 409
+    assert 'Retry-After' in response.headers
+    assert Booking.query.count() == 1
+
+
+def test_abandoned_claim_is_taken_over(client):
+    user = make_user('traveler')
+    package = make_package()
+    body = booking_request(package)
+    headers = {**auth_headers(user), 'Idempotency-Key': 'booking-1'}
+
+    client.post('/api/bookings/', json=body, headers=headers)
+    Booking.query.delete()
+    IdempotencyKey.query.update({'status_code': None, 'response_body': None,
+                                 'locked_until': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+    response = client.post('/api/bookings/', json=body, headers=headers)
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+    assert Booking.query.count() == 1
+
+
+def test_expired_key_runs_the_view_again(client):
+    user = make_user('traveler')
+    package = make_package()
+    headers = {**auth_headers(user), 'Idempotency-Key': 'booking-1'}
+
+    client.post('/api/bookings/', json=booking_request(package), headers=headers)
+    IdempotencyKey.query.update({'expires_at': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+    response = client.post('/api/bookings/', json=booking_request(package), headers=headers)
+    assert response.status_code == 201
+    assert Booking.query.count() == 2
+    assert IdempotencyKey.query.count() == 1
+
+
+def test_purge_deletes_only_expired_keys(app):
+    now = datetime.utcnow()
+    db.session.add_all([
+        IdempotencyKey(user_id=1, key=f'key-{number}', request_hash='x' * 64, status_code=201,
+                       expires_at=now + timedelta(hours=1 if number % 2 else -1))
+        for number in range(10)
+    ])
+    db.session.commit()
+
+    assert purge_expired_keys(batch_size=3) == 5
+    assert IdempotencyKey.query.count() == 5
+
+
+def test_retried_payment_order_hits_gateway_once(client, fake_razorpay):
+    user = make_user('traveler')
+    booking = make_booking(user)
+    headers = {**auth_headers(user), 'Idempotency-Key': 'order-1'}
+
+    first = client.post('/api/payments/create-order', json={'booking_id': booking.id}, headers=headers)
+    retry = client.post('/api/payments/create-order', json={'booking_id': booking.id}, headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.get_json()['order_id'] == first.get_json()['order_id']
+    assert len(fake_razorpay.orders) == 1
+    assert Payment.query.count() == 1
+
+
+def test_gateway_failure_is_not_stored(client, fake_razorpay):
+    user = make_user('traveler')
+    booking = make_booking(user)
+    headers = {**auth_headers(user), 'Idempotency-Key': 'order-1'}
+
+    fake_razorpay.fail_next(503, 503, 503)
+    assert client.post('/api/payments/create-order', json={'booking_id': booking.id},
+                       headers=headers).status_code == 503
+    assert IdempotencyKey.query.count() == 0
+
+    response = client.post('/api/payments/create-order', json={'booking_id': booking.id}, headers=headers)
+    assert response.status_code == 200
+    assert len(fake_razorpay.orders) == 1
@@ -0,0 +1,204 @@
+"""
+In-process tests for the per-date seat inventory and the availability calendar
+"""
+
+from datetime import date, timedelta
+import hashlib
+import hmac
+
+import pytest
+
+from conftest import make_user, make_package, make_booking, auth_headers
+from database import db
+from inventory import SoldOut, reserve_seats, set_booking_status
+from models import Booking, BookingStatus, Job, PackageInventory, Payment, PaymentStatus, TravelPackage, UserRole
+from tasks import refund_payment
+
+DAY = date.today() + timedelta(days=10)
+
+
+def book(client, user, package, travelers, day=DAY):
+    return client.post('/api/bookings/', headers=auth_headers(user), json={
+        'package_id': package.id, 'booking_date': day.isoformat(), 'number_of_travelers': travelers
+    })
+
+
+def remaining(package, day=DAY):
+    return db.session.query(PackageInventory.remaining).filter_by(package_id=package.id, day=day).scalar()
+
+
+def test_bookings_take_seats_until_the_date_is_sold_out(client):
+    package = make_package(max_travelers=5)
+    user = make_user('traveler')
+
+    assert book(client, user, package, 3).status_code == 201
+    assert remaining(package) == 2
+
+    response = book(client, user, package, 3)
+    assert response.status_code == 409
+    assert response.get_json()['remaining'] == 2
+    assert Booking.query.count() == 1
+
+    assert book(client, user, package, 2).status_code == 201
+    assert remaining(package) == 0
+    # Other dates are unaffected
+    assert book(client, user, package, 5, day=DAY + timedelta(days=1)).status_code == 201
+
+
+def test_conditional_decrement_never_oversells(app):
+    package = make_package(max_travelers=4)
+    reserve_seats(package, DAY, 3)
+    with pytest.raises(SoldOut) as e:
+        reserve_seats(package, DAY, 2)
+    assert e.value.remaining == 1
+    assert remaining(package) == 1
+
+
+def test_first_reservation_counts_existing_bookings(app):
+    package = make_package(max_travelers=8)
+    make_booking(make_user('early'), package, booking_date=DAY, number_of_travelers=5)
+    make_booking(make_user('cancelled'), package, booking_date=DAY, number_of_travelers=3,
+                 status=BookingStatus.CANCELLED)
+
+    reserve_seats(package, DAY, 2)
+    assert remaining(package) == 1
+
+
+def test_cancel_releases_and_reinstating_takes_seats_again(client):
+    package = make_package(max_travelers=4)
+    user = make_user('traveler')
+    booking_id = book(client, user, package, 4).get_json()['booking']['id']
+
+    assert client.post(f'/api/bookings/{booking_id}/cancel', headers=auth_headers(user)).status_code == 200
+    assert remaining(package) == 4
+
+    other = make_user('other')
+    assert book(client, other, package, 3).status_code == 201
+
+    admin = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    response = client.put(f'/api/admin/bookings/{booking_id}/status', json={'status': 'confirmed'}, headers=admin)
+    assert response.status_code == 409
+    assert db.session.get(Booking, booking_id).status == BookingStatus.CANCELLED
+    assert remaining(package) == 1
+
+
+def test_status_changes_between_active_states_keep_seats(app):
+    package = make_package(max_travelers=4)
+    reserve_seats(package, DAY, 2)
+    booking = make_booking(make_user('traveler'), package, booking_date=DAY, number_of_travelers=2)
+
+    set_booking_status(booking, BookingStatus.CONFIRMED)
+    set_booking_status(booking, BookingStatus.COMPLETED)
+    assert remaining(package) == 2
+
+
+def test_refund_releases_seats(app, fake_razorpay):
+    package = make_package(max_travelers=4)
+    reserve_seats(package, DAY, 2)
+    booking = make_booking(make_user('traveler'), package, booking_date=DAY, number_of_travelers=2,
+                           status=BookingStatus.CONFIRMED)
+    payment = Payment(booking_id=booking.id, amount=booking.total_amount, razorpay_payment_id='pay_1',
+                      status=PaymentStatus.COMPLETED)
+    db.session.add(payment)
+    db.session.commit()
+
+    refund_payment(payment.id, 'Customer request')
+    db.session.commit()
+    assert remaining(package) == 4
+
+
+def test_raising_max_travelers_frees_seats_on_booked_dates(client):
+    package = make_package(max_travelers=4, available_from=date.today(),
+                           available_to=date.today() + timedelta(days=90))
+    user = make_user('traveler')
+    assert book(client, user, package, 2).status_code == 201
+
+    admin = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    assert client.put(f'/api/packages/{package.id}', json={'max_travelers': 20}, headers=admin).status_code == 200
+    assert remaining(package) == 18
+    assert book(client, user, package, 10).status_code == 201
+    assert remaining(package) == 8
+
+    month = DAY.strftime('%Y-%m')
+    body = client.get(f'/api/packages/{package.id}/availability?month={month}').get_json()
+    assert body['capacity'] == 20
+    assert {day['date']: day['remaining'] for day in body['days']}[DAY.isoformat()] == 8
+
+
+def test_lowering_max_travelers_below_bookings_is_rejected(client):
+    package = make_package(max_travelers=6)
+    user = make_user('traveler')
+    assert book(client, user, package, 4).status_code == 201
+
+    admin = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    response = client.put(f'/api/packages/{package.id}', json={'max_travelers': 3}, headers=admin)
+    assert response.status_code == 400
+    assert DAY.isoformat() in response.get_json()['error']
+    assert db.session.get(TravelPackage, package.id).max_travelers == 6
+    assert remaining(package) == 2
+
+    assert client.put(f'/api/packages/{package.id}', json={'max_travelers': 4}, headers=admin).status_code == 200
+    assert remaining(package) == 0
+
+
+def pay(client, user, booking_id):
+    """Create an order for the booking and return the body for /api/payments/verify"""
+    order = client.post('/api/payments/create-order', json={'booking_id': booking_id},
+                        headers=auth_headers(user)).get_json()
+    signature = hmac.new(b'rzp_test_secret', f"{order['order_id']}|pay_1".encode(), hashlib.sha256).hexdigest()
+    return {'razorpay_order_id': order['order_id'], 'razorpay_payment_id': 'pay_1', 'razorpay_signature': signature}
+
+
+def test_paying_a_cancelled_booking_whose_seats_were_sold_queues_a_refund(client, fake_razorpay):
+    package = make_package(max_travelers=4)
+    alice, bob = make_user('alice'), make_user('bob')
+    booking_id = book(client, alice, package, 4).get_json()['booking']['id']
+    verify = pay(client, alice, booking_id)
+    client.post(f'/api/bookings/{booking_id}/cancel', headers=auth_headers(alice))
+    assert book(client, bob, package, 4).status_code == 201
+
+    response = client.post('/api/payments/verify', json=verify, headers=auth_headers(alice))
+    assert response.status_code == 409
+    assert db.session.get(Booking, booking_id).status == BookingStatus.CANCELLED
+    assert remaining(package) == 0
+    job = Job.query.filter_by(task='refund_payment').one()
+    assert job.key == f"refund:{response.get_json()['payment']['id']}"
+
+
+def test_paying_a_cancelled_booking_with_seats_left_reinstates_it(client, fake_razorpay):
+    package = make_package(max_travelers=4)
+    alice = make_user('alice')
+    booking_id = book(client, alice, package, 4).get_json()['booking']['id']
+    verify = pay(client, alice, booking_id)
+    client.post(f'/api/bookings/{booking_id}/cancel', headers=auth_headers(alice))
+
+    response = client.post('/api/payments/verify', json=verify, headers=auth_headers(alice))
+    assert response.status_code == 200
+    assert db.session.get(Booking, booking_id).status == BookingStatus.CONFIRMED
+    assert remaining(package) == 0
+    assert Job.query.count() == 0
+
+
+def test_month_calendar_in_one_query(client, count_queries):
+    package = make_package(max_travelers=6, available_from=date.today(),
+                           available_to=date.today() + timedelta(days=90))
+    user = make_user('traveler')
+    book(client, user, package, 4)
+    month = DAY.strftime('%Y-%m')
+
+    with count_queries() as statements:
+        response = client.get(f'/api/packages/{package.id}/availability?month={month}')
+    assert response.status_code == 200
+    assert len([statement for statement in statements if 'package_inventory' in statement]) == 1
+    assert response.get_json()['days'][0]['price'] == package.price
+
+    days = {day['date']: day['remaining'] for day in response.get_json()['days']}
+    assert days[DAY.isoformat()] == 2
+    assert set(days.values()) == {2, 6}
+    assert min(days) >= date.today().isoformat()
+
+
+def test_calendar_rejects_bad_month(client):
+    package = make_package()
+    assert client.get(f'/api/packages/{package.id}/availability?month=2024-13').status_code == 400
+    assert client.get('/api/packages/999/availability').status_code == 404
@@ -0,0 +1,147 @@
+"""
+In-process tests for the database-backed job queue and queued refunds
+"""
+
+from datetime import datetime, timedelta
+
+from conftest import make_user, make_booking, auth_headers
+from database import db
+from gateway import payment_gateway
+from jobs import PermanentJobError, claim_job, enqueue, run_job, task, work
+from models import BookingStatus, Job, JobStatus, Payment, PaymentStatus, UserRole
+from tasks import refund_payment
+
+calls = []
+
+
+@task('test_record')
+def record(value):
+    calls.append(value)
+    return {'recorded': value}
+
+
+@task('test_permanent_failure')
+def permanent_failure():
+    raise PermanentJobError('Cannot be fixed by retrying')
+
+
+def completed_payment():
+    booking = make_booking(make_user('traveler'))
+    payment = Payment(booking_id=booking.id, amount=booking.total_amount, razorpay_payment_id='pay_9',
+                      status=PaymentStatus.COMPLETED)
+    db.session.add(payment)
+    db.session.commit()
+    return payment
+
+
+def test_refund_is_queued_and_run_by_a_worker(client, fake_razorpay):
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    payment = completed_payment()
+
+    response = client.post('/api/payments/refund', json={'payment_id': payment.id}, headers=headers)
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+    assert fake_razorpay.requests == []
+    assert response.get_json()['payment']['status'] == 'completed'
+
+    # A second click does not queue a second refund
+    again = client.post('/api/payments/refund', json={'payment_id': payment.id}, headers=headers)
+    assert again.get_json()['job_id'] == job_id
+
+    assert work(burst=True) == 1
+    job = client.get(f'/api/admin/jobs/{job_id}', headers=headers).get_json()['job']
+    assert job['status'] == 'succeeded'
+    refund = fake_razorpay.refunds[job['result']['refund_id']]
+    assert (refund['payment_id'], refund['amount']) == ('pay_9', 200000)
+
+    db.session.expire_all()
+    payment = db.session.get(Payment, payment.id)
+    assert payment.status == PaymentStatus.REFUNDED
+    assert payment.booking.status == BookingStatus.CANCELLED
+
+
+def test_failed_refund_is_retried_then_dead_lettered(app, client, fake_razorpay):
+    app.config.update(JOB_MAX_ATTEMPTS=2, JOB_RETRY_BACKOFF=0, RAZORPAY_MAX_RETRIES=0)
+    payment_gateway.init_app(app)
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    payment = completed_payment()
+    job_id = client.post('/api/payments/refund', json={'payment_id': payment.id},
+                         headers=headers).get_json()['job_id']
+
+    fake_razorpay.fail_next(503, 503)
+    assert work(burst=True) == 2
+    job = db.session.get(Job, job_id)
+    db.session.refresh(job)
+    assert (job.status, job.attempts) == (JobStatus.DEAD, 2)
+    assert 'GatewayUnavailable' in job.last_error
+    assert db.session.get(Payment, payment.id).status == PaymentStatus.COMPLETED
+
+    dead = client.get('/api/admin/jobs?status=dead', headers=headers).get_json()['jobs']
+    assert [j['id'] for j in dead] == [job_id]
+
+    assert client.post(f'/api/admin/jobs/{job_id}/retry', headers=headers).status_code == 200
+    assert work(burst=True) == 1
+    db.session.expire_all()
+    assert db.session.get(Job, job_id).status == JobStatus.SUCCEEDED
+    assert db.session.get(Payment, payment.id).status == PaymentStatus.REFUNDED
+
+
+def test_retried_refund_is_not_sent_twice(app, fake_razorpay):
+    payment = completed_payment()
+    # The first attempt refunded at the gateway, then its worker died before committing
+    first = refund_payment(payment.id, 'Customer request')
+    db.session.rollback()
+    assert db.session.get(Payment, payment.id).status == PaymentStatus.COMPLETED
+
+    fake_razorpay.requests.clear()
+    again = refund_payment(payment.id, 'Customer request')
+    db.session.commit()
+    assert again['refund_id'] == first['refund_id']
+    assert fake_razorpay.requests == [('GET', '/v1/payments/pay_9/refunds')]
+    assert len(fake_razorpay.refunds) == 1
+    assert db.session.get(Payment, payment.id).status == PaymentStatus.REFUNDED
+
+
+def test_permanent_errors_skip_retries(app):
+    job = enqueue('test_permanent_failure')
+    db.session.commit()
+
+    work(burst=True)
+    db.session.refresh(job)
+    assert (job.status, job.attempts) == (JobStatus.DEAD, 1)
+    assert job.last_error == 'PermanentJobError: Cannot be fixed by retrying'
+
+
+def test_jobs_commit_with_the_enqueuing_transaction(app):
+    calls.clear()
+    enqueue('test_record', {'value': 'rolled back'})
+    db.session.rollback()
+    enqueue('test_record', {'value': 'kept'})
+    db.session.commit()
+
+    work(burst=True)
+    assert calls == ['kept']
+
+
+def test_expired_claims_are_taken_over(app):
+    calls.clear()
+    job = enqueue('test_record', {'value': 1})
+    db.session.commit()
+
+    stalled = claim_job('worker-a')
+    assert stalled.id == job.id
+    assert claim_job('worker-b') is None
+
+    # worker-a died; once the visibility timeout passes another worker runs the job
+    db.session.query(Job).update({'locked_until': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    taken = claim_job('worker-b')
+    assert (taken.id, taken.locked_by, taken.attempts) == (job.id, 'worker-b', 2)
+    assert run_job(taken, 'worker-b')
+
+    # A late finish from the original worker is ignored
+    stalled_copy = Job(id=job.id, attempts=1, max_attempts=5, task='test_record', payload='{"value": 1}')
+    run_job(stalled_copy, 'worker-a')
+    db.session.expire_all()
+    assert db.session.get(Job, job.id).status == JobStatus.SUCCEEDED
+    assert db.session.get(Job, job.id).locked_by == 'worker-b'
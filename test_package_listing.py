@@ -0,0 +1,110 @@
+"""
+In-process tests for the package listing endpoint
+"""
+
+from sqlalchemy import event
+
+from conftest import make_user, make_package
+from database import db
+from models import Review
+from ratings import adjust_rating_stats
+
+
+def add_reviews(package, users, ratings):
+    for user, rating in zip(users, ratings):
+        db.session.add(Review(user_id=user.id, package_id=package.id, rating=rating))
+        adjust_rating_stats(package.id, rating, 1)
+    db.session.commit()
+
+
+def test_listing_includes_rating_aggregates(client):
+    users = [make_user(f'reviewer{i}') for i in range(3)]
+    rated = make_package('Rated Package')
+    make_package('Unrated Package')
+    add_reviews(rated, users, [5, 4, 4])
+
+    response = client.get('/api/packages/')
+    assert response.status_code == 200
+
+    packages = {p['title']: p for p in response.get_json()['packages']}
+    assert packages['Rated Package']['average_rating'] == 4.3
+    assert packages['Rated Package']['total_reviews'] == 3
+    assert packages['Unrated Package']['average_rating'] == 0
+    assert packages['Unrated Package']['total_reviews'] == 0
+
+
+def test_listing_query_count_is_independent_of_page_size(client, count_queries):
+    users = [make_user(f'reviewer{i}') for i in range(3)]
+    for i in range(3):
+        add_reviews(make_package(f'Package {i}'), users, [3, 4, 5])
+
+    with count_queries() as small_page:
+        assert client.get('/api/packages/?per_page=50').status_code == 200
+
+    for i in range(3, 30):
+        add_reviews(make_package(f'Package {i}'), users, [3, 4, 5])
+
+    with count_queries() as large_page:
+        response = client.get('/api/packages/?per_page=50')
+    assert response.status_code == 200
+    assert len(response.get_json()['packages']) == 30
+
+    # Catalog version for the ETag, one page query and one COUNT for
+    # pagination, whatever the page size
+    assert len(large_page) == len(small_page)
+    assert len(large_page) <= 3
+
+
+def test_rating_desc_sorts_by_smoothed_score(client):
+    users = [make_user(f'reviewer{i}') for i in range(4)]
+    add_reviews(make_package('One Perfect Review'), users[:1], [5])
+    add_reviews(make_package('Many Good Reviews'), users, [5, 5, 4, 5])
+    add_reviews(make_package('Poorly Rated'), users[:2], [1, 2])
+    make_package('Unrated')
+
+    response = client.get('/api/packages/?sort_by=rating_desc')
+    assert response.status_code == 200
+
+    titles = [p['title'] for p in response.get_json()['packages']]
+    assert titles == ['Many Good Reviews', 'One Perfect Review', 'Unrated', 'Poorly Rated']
+
+
+def test_rating_desc_is_served_from_index(client):
+    make_package()
+    executed = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        executed.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        assert client.get('/api/packages/?sort_by=rating_desc').status_code == 200
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    statement, parameters = next((s, p) for s, p in executed if 'ORDER BY' in s)
+    plan = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+    plan = ' '.join(row[-1] for row in plan)
+    assert 'ix_travel_packages_active_rating' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_package_lists_are_parsed_once_per_version(client, monkeypatch):
+    import models
+
+    package = make_package(includes='["Hotel", "Breakfast"]', images='["a.jpg"]')
+    parsed = []
+    load_json_list = models._load_json_list
+    monkeypatch.setattr(models, '_load_json_list', lambda value: parsed.append(value) or load_json_list(value))
+
+    for _ in range(3):
+        assert client.get('/api/packages/').get_json()['packages'][0]['includes'] == ['Hotel', 'Breakfast']
+    assert len(parsed) == 3
+
+    package.includes = '["Hotel"]'
+    db.session.commit()
+    assert client.get('/api/packages/').get_json()['packages'][0]['includes'] == ['Hotel']
+    assert len(parsed) == 6
+
+    package.to_dict()['images'].append('b.jpg')
+    assert package.to_dict()['images'] == ['a.jpg']
@@ -0,0 +1,72 @@
+"""
+In-process tests for full-text package search
+"""
+
+from conftest import make_user, make_package, auth_headers
+from models import UserRole
+from search import rebuild_search_index
+
+PACKAGE = {
+    'duration_days': 5,
+    'price': 1200.0,
+    'max_travelers': 8,
+    'available_from': '2030-01-01',
+    'available_to': '2030-12-31'
+}
+
+
+def create(client, headers, **fields):
+    response = client.post('/api/packages/', json={**PACKAGE, **fields}, headers=headers)
+    assert response.status_code == 201
+    return response.get_json()['package']['id']
+
+
+def search(client, q):
+    response = client.get(f'/api/packages/?q={q}')
+    assert response.status_code == 200
+    return [p['title'] for p in response.get_json()['packages']]
+
+
+def test_search_covers_all_text_fields_and_ranks_by_relevance(client):
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    create(client, headers, title='Alpine Ski Week', destination='Zermatt, Switzerland',
+           description='Ski the Matterhorn slopes', includes=['Ski pass'])
+    create(client, headers, title='Lake Geneva Escape', destination='Montreux, Switzerland',
+           description='Includes a day trip to the ski resorts', includes=['Boat cruise'])
+    create(client, headers, title='Paris City Break', destination='Paris, France',
+           description='Museums and cafes', includes=['Louvre tickets'])
+
+    assert search(client, 'ski') == ['Alpine Ski Week', 'Lake Geneva Escape']
+    assert search(client, 'switzerland') == ['Alpine Ski Week', 'Lake Geneva Escape']
+    assert search(client, 'louvre') == ['Paris City Break']
+    assert search(client, 'mus') == ['Paris City Break']
+    assert search(client, 'ski paris') == []
+
+
+def test_search_index_follows_updates_and_deletes(client):
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    package_id = create(client, headers, title='Tokyo Adventure', destination='Tokyo, Japan')
+
+    assert client.put(f'/api/packages/{package_id}', json={'title': 'Kyoto Temples'},
+                      headers=headers).status_code == 200
+    assert search(client, 'tokyo') == ['Kyoto Temples']
+    assert search(client, 'adventure') == []
+
+    assert client.delete(f'/api/packages/{package_id}', headers=headers).status_code == 200
+    assert search(client, 'kyoto') == []
+
+
+def test_search_punctuation_is_not_query_syntax(client):
+    make_package('Bali Retreat')
+    rebuild_search_index()
+
+    assert search(client, 'bali"') == ['Bali Retreat']
+    assert search(client, '"*') == []
+
+
+def test_rebuild_search_index_indexes_existing_packages(client):
+    make_package('Santorini Sunset', includes='["Wine tasting"]')
+    assert search(client, 'santorini') == []
+
+    assert rebuild_search_index() == 1
+    assert search(client, 'wine') == ['Santorini Sunset']
@@ -0,0 +1,113 @@
+"""
+In-process tests for keyset (cursor) pagination on list endpoints
+"""
+
+from datetime import date, datetime
+
+import pagination
+from conftest import make_user, make_package, auth_headers
+from database import db
+from models import Booking, Payment, UserRole
+
+
+def make_bookings(user, package, count, created_at=None):
+    bookings = []
+    for i in range(count):
+        booking = Booking(
+            user_id=user.id,
+            package_id=package.id,
+            booking_date=date.today(),
+            number_of_travelers=1,
+            total_amount=package.price,
+            created_at=created_at or datetime(2026, 1, 1 + i % 28, 12, 0)
+        )
+        db.session.add(booking)
+        bookings.append(booking)
+    db.session.commit()
+    return bookings
+
+
+def walk(client, url, headers, key):
+    """Follow next_cursor until exhausted, returning the ids in order"""
+    ids, cursor, pages = [], '', 0
+    while cursor is not None:
+        response = client.get(f'{url}&cursor={cursor}', headers=headers)
+        assert response.status_code == 200
+        data = response.get_json()
+        ids.extend(item['id'] for item in data[key])
+        cursor = data['next_cursor']
+        pages += 1
+    return ids, pages
+
+
+def test_cursor_walk_returns_every_booking_once_newest_first(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    bookings = make_bookings(admin, make_package(), 23)
+
+    ids, pages = walk(client, '/api/admin/bookings?per_page=5', auth_headers(admin), 'bookings')
+
+    expected = [b.id for b in sorted(bookings, key=lambda b: (b.created_at, b.id), reverse=True)]
+    assert ids == expected
+    assert pages == 5
+
+
+def test_cursor_breaks_ties_on_id(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    package = make_package()
+    bookings = make_bookings(admin, package, 7, created_at=datetime(2026, 3, 1, 9, 30))
+    for booking in bookings:
+        db.session.add(Payment(booking_id=booking.id, amount=100.0, created_at=booking.created_at))
+    db.session.commit()
+
+    ids, _ = walk(client, '/api/payments/all?per_page=3', auth_headers(admin), 'payments')
+    assert len(ids) == 7
+    assert ids == sorted(ids, reverse=True)
+
+
+def test_cursor_mode_skips_count_unless_requested(client, count_queries):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    make_bookings(admin, make_package(), 4)
+    headers = auth_headers(admin)
+
+    with count_queries() as statements:
+        data = client.get('/api/admin/bookings?per_page=2&cursor=', headers=headers).get_json()
+    assert data['total'] is None
+    assert not any('count(' in s.lower() for s in statements)
+
+    data = client.get('/api/admin/bookings?per_page=2&cursor=&include_total=true', headers=headers).get_json()
+    assert data['total'] == 4
+
+
+def test_cursor_follows_package_sort_order(client):
+    for price in [500, 100, 300, 100, 200]:
+        make_package(price=price)
+
+    prices = []
+    cursor = ''
+    while cursor is not None:
+        data = client.get(f'/api/packages/?sort_by=price_asc&per_page=2&cursor={cursor}').get_json()
+        prices.extend(p['price'] for p in data['packages'])
+        cursor = data['next_cursor']
+    assert prices == [100, 100, 200, 300, 500]
+
+
+def test_invalid_cursor_is_rejected(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+
+    response = client.get('/api/reviews/all?cursor=not-a-cursor', headers=auth_headers(admin))
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid cursor'
+
+
+def test_cursor_page_size_is_clamped(client, monkeypatch):
+    monkeypatch.setattr(pagination, 'MAX_PER_PAGE', 4)
+    admin = make_user('admin', role=UserRole.ADMIN)
+    make_bookings(admin, make_package(), 6)
+    headers = auth_headers(admin)
+
+    for per_page, size in (('0', 1), ('-1', 1), ('50', 4)):
+        response = client.get(f'/api/admin/bookings?per_page={per_page}&cursor=', headers=headers)
+        assert response.status_code == 200
+        assert len(response.get_json()['bookings']) == size
+        assert response.get_json()['per_page'] == size
+        assert response.get_json()['next_cursor'] is not None
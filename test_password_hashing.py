@@ -0,0 +1,93 @@
+"""
+In-process tests for pooled password hashing, configurable parameters and
+rehash on login
+"""
+
+import threading
+
+import passwords
+from conftest import make_user, auth_headers
+from database import db
+from models import User
+from passwords import HashingPool
+
+
+def login(client, username='traveler', password='password123'):
+    return client.post('/api/auth/login', json={'username': username, 'password': password})
+
+
+def stored_hash(username='traveler'):
+    db.session.expire_all()
+    return User.query.filter_by(username=username).one().password_hash
+
+
+def test_hashing_runs_on_the_pool(client, monkeypatch):
+    make_user('traveler')
+    threads = []
+    verify = passwords.verify_password
+
+    def recording_verify(pwhash, password):
+        threads.append(threading.current_thread().name)
+        return verify(pwhash, password)
+
+    monkeypatch.setattr(passwords, 'verify_password', recording_verify)
+    assert login(client).status_code == 200
+    assert login(client, password='wrong').status_code == 401
+    assert len(threads) == 2
+    assert all(name.startswith('password-hash') for name in threads)
+
+
+def test_login_rehashes_to_the_current_parameters(app, client):
+    make_user('traveler')
+    assert stored_hash().startswith('scrypt:1024:8:1$')
+
+    app.config.update(PASSWORD_HASH_ALGORITHM='pbkdf2', PASSWORD_HASH_COST=2000)
+    assert login(client, password='wrong').status_code == 401
+    assert stored_hash().startswith('scrypt:1024:8:1$')
+
+    assert login(client).status_code == 200
+    upgraded = stored_hash()
+    assert upgraded.startswith('pbkdf2:sha256:2000$')
+
+    # Already current: no second rehash
+    assert login(client).status_code == 200
+    assert stored_hash() == upgraded
+
+
+def test_bcrypt_hashes_verify_and_rehash(app, client):
+    app.config.update(PASSWORD_HASH_ALGORITHM='bcrypt', PASSWORD_HASH_COST=4)
+    make_user('traveler')
+    assert stored_hash().startswith('$2b$04$')
+    assert login(client).status_code == 200
+
+    app.config['PASSWORD_HASH_COST'] = 5
+    assert login(client).status_code == 200
+    assert stored_hash().startswith('$2b$05$')
+
+
+def test_full_pool_answers_503(app, client):
+    user = make_user('traveler')
+    original = stored_hash()
+    app.extensions['password_hasher'] = pool = HashingPool(workers=1, queue_depth=0)
+    started, release = threading.Event(), threading.Event()
+
+    def occupy():
+        started.set()
+        release.wait(5)
+
+    worker = threading.Thread(target=pool.run, args=(occupy,))
+    worker.start()
+    started.wait(5)
+    try:
+        response = login(client)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        response = client.post('/api/auth/change-password', headers=auth_headers(user),
+                               json={'current_password': 'password123', 'new_password': 'changed456'})
+        assert response.status_code == 503
+    finally:
+        release.set()
+        worker.join()
+
+    assert stored_hash() == original
+    assert login(client).status_code == 200
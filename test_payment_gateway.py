@@ -0,0 +1,138 @@
+"""
+In-process tests for the Razorpay gateway adapter against the local fake server
+"""
+
+import hashlib
+import hmac
+
+import pytest
+
+import gateway
+from conftest import make_user, make_booking, auth_headers
+from database import db
+from gateway import CircuitBreaker, GatewayRejected, GatewayUnavailable, RazorpayGateway, payment_gateway
+from models import Payment, PaymentStatus
+
+
+def test_create_order_and_verify(client, fake_razorpay):
+    user = make_user('traveler')
+    booking = make_booking(user)
+    headers = auth_headers(user)
+
+    response = client.post('/api/payments/create-order', json={'booking_id': booking.id}, headers=headers)
+    assert response.status_code == 200
+    order = response.get_json()
+    assert order['amount'] == 200000
+    assert fake_razorpay.orders[order['order_id']]['receipt'] == f'booking_{booking.id}'
+
+    signature = hmac.new(b'rzp_test_secret', f"{order['order_id']}|pay_1".encode(), hashlib.sha256).hexdigest()
+    verify = {'razorpay_order_id': order['order_id'], 'razorpay_payment_id': 'pay_1'}
+    response = client.post('/api/payments/verify', json={**verify, 'razorpay_signature': 'forged'}, headers=headers)
+    assert response.status_code == 400
+    response = client.post('/api/payments/verify', json={**verify, 'razorpay_signature': signature}, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    assert db.session.get(Payment, order['payment_id']).status == PaymentStatus.COMPLETED
+
+
+def test_order_amount_is_rounded_to_paise(client, fake_razorpay):
+    user = make_user('traveler')
+    booking = make_booking(user, number_of_travelers=3, total_amount=2499.99 * 3)
+
+    response = client.post('/api/payments/create-order', json={'booking_id': booking.id}, headers=auth_headers(user))
+    assert response.get_json()['amount'] == 749997
+
+
+def test_connections_are_reused(fake_razorpay):
+    client = RazorpayGateway('key', 'secret', base_url=fake_razorpay.base_url, backoff=0)
+    for _ in range(5):
+        client.create_order({'amount': 1000, 'currency': 'INR'})
+    client.close()
+    assert fake_razorpay.connections == 1
+
+
+def test_transient_failures_are_retried(fake_razorpay):
+    client = RazorpayGateway('key', 'secret', base_url=fake_razorpay.base_url, backoff=0, max_retries=2)
+    fake_razorpay.fail_next(503, 502)
+    assert client.create_order({'amount': 1000})['status'] == 'created'
+    assert len(fake_razorpay.requests) == 3
+
+    # Client errors are not retried
+    with pytest.raises(GatewayRejected, match='atleast INR 1.00'):
+        client.create_order({'amount': 1})
+    assert len(fake_razorpay.requests) == 4
+
+
+def test_refunds_are_not_repeated_after_a_server_error(fake_razorpay):
+    client = RazorpayGateway('key', 'secret', base_url=fake_razorpay.base_url, backoff=0, max_retries=2)
+    fake_razorpay.fail_next(500)
+    with pytest.raises(GatewayUnavailable):
+        client.refund('pay_1', {'amount': 1000})
+    assert len(fake_razorpay.requests) == 1
+    assert fake_razorpay.refunds == {}
+
+
+def test_slow_gateway_times_out(fake_razorpay):
+    fake_razorpay.latency = 0.3
+    client = RazorpayGateway('key', 'secret', base_url=fake_razorpay.base_url, backoff=0,
+                             read_timeout=0.05, max_retries=1)
+    with pytest.raises(GatewayUnavailable, match='timed out'):
+        client.create_order({'amount': 1000})
+    assert len(fake_razorpay.requests) == 2
+
+
+def test_open_breaker_fails_fast_until_reset(app, client, fake_razorpay, monkeypatch):
+    app.config.update(RAZORPAY_MAX_RETRIES=0, RAZORPAY_BREAKER_THRESHOLD=2, RAZORPAY_BREAKER_RESET=30)
+    payment_gateway.init_app(app)
+    user = make_user('traveler')
+    booking = make_booking(user)
+    headers = auth_headers(user)
+
+    fake_razorpay.fail_next(500, 500)
+    for _ in range(2):
+        response = client.post('/api/payments/create-order', json={'booking_id': booking.id}, headers=headers)
+        assert response.status_code == 503
+    assert payment_gateway.client.breaker.state == 'open'
+
+    response = client.post('/api/payments/create-order', json={'booking_id': booking.id}, headers=headers)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '30'
+    assert len(fake_razorpay.requests) == 2
+
+    # After the reset timeout one trial call closes the breaker again
+    now = gateway.time.monotonic() + 31
+    monkeypatch.setattr(gateway.time, 'monotonic', lambda: now)
+    response = client.post('/api/payments/create-order', json={'booking_id': booking.id}, headers=headers)
+    assert response.status_code == 200
+    assert payment_gateway.client.breaker.state == 'closed'
+
+
+def test_half_open_breaker_admits_a_single_trial(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(gateway.time, 'monotonic', lambda: now[0])
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    with pytest.raises(GatewayUnavailable):
+        breaker.before_call()
+
+    now[0] += 10
+    breaker.before_call()
+    with pytest.raises(GatewayUnavailable):
+        breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_owner_can_read_payment_status_and_booking_payments(client):
+    user = make_user('traveler')
+    booking = make_booking(user)
+    payment = Payment(booking_id=booking.id, amount=booking.total_amount, razorpay_order_id='order_1')
+    db.session.add(payment)
+    db.session.commit()
+
+    headers = auth_headers(user)
+    assert client.get(f'/api/payments/status/{payment.id}', headers=headers).status_code == 200
+    response = client.get(f'/api/payments/booking/{booking.id}', headers=headers)
+    assert response.status_code == 200
+    assert [p['id'] for p in response.get_json()['payments']] == [payment.id]
+    other = auth_headers(make_user('other'))
+    assert client.get(f'/api/payments/status/{payment.id}', headers=other).status_code == 403
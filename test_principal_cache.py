@@ -0,0 +1,69 @@
+"""
+In-process tests for the request- and process-scoped user identity cache
+"""
+
+from flask_jwt_extended import create_access_token
+
+import authz
+from conftest import make_user, auth_headers
+from database import db
+from models import User, UserRole
+
+
+def test_one_user_lookup_per_request(client, count_queries):
+    user = make_user('traveler')
+    # A token without claims makes both the revocation check and the handler need the user
+    headers = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+    db.session.expire_all()
+
+    with count_queries() as statements:
+        response = client.get('/api/auth/profile', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['user']['username'] == 'traveler'
+    assert len(statements) == 1
+
+    with count_queries() as statements:
+        assert client.get('/api/auth/profile', headers=headers).status_code == 200
+    assert statements == []
+
+
+def test_profile_update_invalidates_the_cache(client):
+    headers = auth_headers(make_user('traveler'))
+    assert client.get('/api/auth/profile', headers=headers).get_json()['user']['phone_number'] == '+1234567890'
+
+    response = client.put('/api/auth/profile', json={'phone_number': '+919876543210'}, headers=headers)
+    assert response.status_code == 200
+    assert client.get('/api/auth/profile', headers=headers).get_json()['user']['phone_number'] == '+919876543210'
+
+
+def test_admin_user_writes_invalidate_the_cache(client):
+    admin = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    traveler = make_user('traveler')
+    url = f'/api/admin/users/{traveler.id}'
+    assert client.get(url, headers=admin).get_json()['user']['is_active'] is True
+
+    for action, expected in [('deactivate', False), ('activate', True)]:
+        assert client.post(f'{url}/{action}', headers=admin).status_code == 200
+        assert client.get(url, headers=admin).get_json()['user']['is_active'] is expected
+
+    assert client.put(f'{url}/toggle-status', headers=admin).status_code == 200
+    assert client.get(url, headers=admin).get_json()['user']['is_active'] is False
+
+    assert client.put(url, json={'email': 'new@example.com'}, headers=admin).status_code == 200
+    assert client.get(url, headers=admin).get_json()['user']['email'] == 'new@example.com'
+
+    assert client.delete(url, headers=admin).status_code == 200
+    assert client.get(url, headers=admin).status_code == 404
+
+
+def test_principals_are_read_only(client):
+    user = make_user('traveler')
+    principal = authz.Principal(db.session.get(User, user.id))
+
+    assert principal.to_dict() == user.to_dict()
+    try:
+        principal.email = 'changed@example.com'
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError('Principal accepted an assignment')
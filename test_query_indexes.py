@@ -0,0 +1,132 @@
+"""
+EXPLAIN QUERY PLAN checks that the main query of each hot endpoint uses an index
+"""
+
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from conftest import make_user, make_package, make_booking, auth_headers
+from database import db
+from models import BookingStatus, Itinerary, Payment, Review, UserRole, Wishlist
+
+
+@pytest.fixture
+def capture(app):
+    """Context manager recording (statement, parameters) for every query sent to the engine"""
+    @contextmanager
+    def recorder():
+        queries = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            queries.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield queries
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return recorder
+
+
+def assert_uses_index(queries, marker, table, index):
+    """The first query containing marker searches table through index"""
+    statement, parameters = next((s, p) for s, p in queries if marker in s)
+    rows = db.session.connection().exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    plan = ' | '.join(row[-1] for row in rows)
+    assert f'SEARCH {table} USING' in plan and index in plan, plan
+    return plan
+
+
+def test_user_bookings_by_status(client, capture):
+    user = make_user('traveler')
+    make_booking(user)
+    with capture() as queries:
+        assert client.get('/api/bookings/?status=pending', headers=auth_headers(user)).status_code == 200
+    assert_uses_index(queries, 'FROM bookings', 'bookings', 'ix_bookings_user_status')
+
+
+def test_seats_already_booked_on_a_date(client, capture):
+    package = make_package()
+    with capture() as queries:
+        response = client.post('/api/bookings/', headers=auth_headers(make_user('traveler')), json={
+            'package_id': package.id, 'number_of_travelers': 2,
+            'booking_date': (date.today() + timedelta(days=5)).isoformat()
+        })
+    assert response.status_code == 201
+    assert_uses_index(queries, 'sum(bookings.number_of_travelers)', 'bookings', 'ix_bookings_package_status')
+
+
+def test_package_list_sorted_by_price(client, capture):
+    make_package('Cheap', price=500.0)
+    make_package('Dear', price=5000.0)
+    with capture() as queries:
+        assert client.get('/api/packages/?sort_by=price_asc').status_code == 200
+    plan = assert_uses_index(queries, 'ORDER BY travel_packages.price', 'travel_packages',
+                             'ix_travel_packages_active_price')
+    assert 'TEMP B-TREE FOR ORDER BY' not in plan
+
+
+def test_package_reviews(client, capture):
+    package = make_package()
+    db.session.add(Review(user_id=make_user('critic').id, package_id=package.id, rating=4))
+    db.session.commit()
+    with capture() as queries:
+        assert client.get(f'/api/reviews/package/{package.id}').status_code == 200
+    assert_uses_index(queries, 'FROM reviews', 'reviews', 'ix_reviews_package_created')
+
+
+def test_existing_review_check(client, capture):
+    user = make_user('critic')
+    package = make_package()
+    make_booking(user, package, status=BookingStatus.COMPLETED)
+    with capture() as queries:
+        response = client.post('/api/reviews/', json={'package_id': package.id, 'rating': 5},
+                               headers=auth_headers(user))
+    assert response.status_code == 201
+    assert_uses_index(queries, 'reviews.user_id = ? AND reviews.package_id = ?', 'reviews',
+                      'sqlite_autoindex_reviews_1')
+
+
+def test_second_review_is_refused_by_the_constraint(app):
+    user = make_user('critic')
+    package = make_package()
+    db.session.add(Review(user_id=user.id, package_id=package.id, rating=4))
+    db.session.commit()
+    db.session.add(Review(user_id=user.id, package_id=package.id, rating=2))
+    with pytest.raises(Exception):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_booking_payments(client, capture):
+    booking = make_booking(make_user('traveler'))
+    db.session.add(Payment(booking_id=booking.id, amount=booking.total_amount))
+    db.session.commit()
+    admin = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    with capture() as queries:
+        assert client.get(f'/api/payments/booking/{booking.id}', headers=admin).status_code == 200
+    assert_uses_index(queries, 'FROM payments', 'payments', 'ix_payments_booking_id')
+
+
+def test_user_wishlist(client, capture):
+    user = make_user('traveler')
+    db.session.add(Wishlist(user_id=user.id, package_id=make_package().id))
+    db.session.commit()
+    with capture() as queries:
+        assert client.get('/api/wishlist/', headers=auth_headers(user)).status_code == 200
+    assert_uses_index(queries, 'FROM wishlist', 'wishlist', 'sqlite_autoindex_wishlist_1')
+
+
+def test_booking_itineraries_in_day_order(client, capture):
+    booking = make_booking(make_user('traveler'))
+    db.session.add_all([Itinerary(booking_id=booking.id, day_number=day, title=f'Day {day}') for day in (2, 1)])
+    db.session.commit()
+    admin = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    with capture() as queries:
+        assert client.get(f'/api/itineraries/booking/{booking.id}', headers=admin).status_code == 200
+    plan = assert_uses_index(queries, 'FROM itineraries', 'itineraries', 'ix_itineraries_booking_day')
+    assert 'TEMP B-TREE FOR ORDER BY' not in plan
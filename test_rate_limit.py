@@ -0,0 +1,99 @@
+"""
+In-process tests for the sliding-window rate limiter
+"""
+
+from types import SimpleNamespace
+
+import ratelimit
+from conftest import make_user, make_package, auth_headers
+from models import UserRole
+from ratelimit import MemoryRateLimitStore, rate_limiter
+
+
+def login(client, ip='10.0.0.1'):
+    return client.post('/api/auth/login', json={'username': 'nobody', 'password': 'wrong'},
+                       environ_base={'REMOTE_ADDR': ip})
+
+
+def test_login_is_limited_per_ip(app, client):
+    rate_limiter.clear()
+    app.config['RATE_LIMITS'] = {'auth.login': {'ip': '3/minute'}}
+
+    assert [login(client).status_code for _ in range(4)] == [401, 401, 401, 429]
+    response = login(client)
+    assert response.get_json()['error'] == 'Too many requests, please retry later'
+    assert 1 <= int(response.headers['Retry-After']) <= 60
+
+    # Another address has its own window
+    assert login(client, ip='10.0.0.2').status_code == 401
+
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    stats = client.get('/api/admin/rate-limits/stats', headers=headers).get_json()
+    assert stats['endpoints']['auth.login'] == {'allowed': 4, 'limited': 2}
+
+
+def test_blueprint_limits_apply_to_each_route_separately(app, client):
+    app.config['RATE_LIMITS'] = {'auth': {'ip': '1/minute'}}
+
+    assert login(client).status_code == 401
+    assert login(client).status_code == 429
+    response = client.post('/api/auth/register', json={}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    assert response.status_code == 400
+    response = client.post('/api/auth/register', json={}, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+    assert response.status_code == 429
+
+
+def test_bookings_are_limited_per_user(app, client):
+    app.config['RATE_LIMITS'] = {'bookings.create_booking': {'user': '2/minute'}}
+    package = make_package()
+    booking = {'package_id': package.id, 'booking_date': package.available_to.isoformat(),
+               'number_of_travelers': 1}
+
+    first, second = auth_headers(make_user('first')), auth_headers(make_user('second'))
+    assert [client.post('/api/bookings/', json=booking, headers=first).status_code
+            for _ in range(3)] == [201, 201, 429]
+    assert client.post('/api/bookings/', json=booking, headers=second).status_code == 201
+
+    # Other booking routes are not limited
+    assert client.get('/api/bookings/', headers=first).status_code == 200
+
+
+def test_request_rejected_by_one_scope_counts_against_none(app, client):
+    app.config['RATE_LIMITS'] = {'bookings.create_booking': {'user': '5/minute', 'ip': '1/minute'}}
+    package = make_package()
+    booking = {'package_id': package.id, 'booking_date': package.available_to.isoformat(),
+               'number_of_travelers': 1}
+    headers = auth_headers(make_user('traveler'))
+
+    def post(address):
+        return client.post('/api/bookings/', json=booking, headers=headers,
+                           environ_base={'REMOTE_ADDR': address}).status_code
+
+    assert [post('10.0.0.1'), post('10.0.0.1')] == [201, 429]
+    # The per-IP rejection did not use up any of the user's budget
+    assert [post(f'10.0.1.{n}') for n in range(5)] == [201, 201, 201, 201, 429]
+
+
+def test_limits_can_be_switched_off(app, client):
+    app.config.update(RATE_LIMITS={'auth.login': {'ip': '1/minute'}}, RATE_LIMIT_ENABLED=False)
+    assert [login(client).status_code for _ in range(3)] == [401, 401, 401]
+
+
+def test_previous_window_is_weighted_by_its_overlap(monkeypatch):
+    now = [6000.0]
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(time=lambda: now[0]))
+    store = MemoryRateLimitStore()
+
+    assert all(store.hit('ip:x:auth.login', 10, 60)[0] for _ in range(10))
+    assert store.hit('ip:x:auth.login', 10, 60) == (False, 60)
+
+    # Halfway through the next window half of the previous ten still count
+    now[0] += 90
+    assert all(store.hit('ip:x:auth.login', 10, 60)[0] for _ in range(5))
+    allowed, retry_after = store.hit('ip:x:auth.login', 10, 60)
+    assert not allowed
+    assert retry_after == 6
+
+    # Two windows later the key starts over
+    now[0] += 120
+    assert store.hit('ip:x:auth.login', 10, 60) == (True, 0)
@@ -0,0 +1,162 @@
+"""
+In-process tests for payment reconciliation against the fake gateway
+"""
+
+import csv
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import make_user, make_booking, auth_headers
+from database import db
+from gateway import GatewayUnavailable
+from jobs import work
+from metrics import backfill_metrics
+from models import (Booking, BookingStatus, DailyMetric, Job, Payment, PaymentStatus, ReconciliationRun,
+                    UserRole)
+from reconcile import reconcile, start_run
+
+
+@pytest.fixture
+def gateway(app, fake_razorpay, tmp_path):
+    app.config.update(RECONCILE_REPORT_DIR=str(tmp_path), RECONCILE_BATCH_SIZE=2, RECONCILE_CONCURRENCY=4)
+    return fake_razorpay
+
+
+def payment_with_order(fake, number, status=PaymentStatus.PENDING, order_status='created',
+                       order_amount=200000, age=timedelta(0)):
+    booking = make_booking(make_user(f'traveler{number}'))
+    order_id = f'order_{number:014d}'
+    fake.orders[order_id] = {'id': order_id, 'entity': 'order', 'amount': order_amount, 'status': order_status}
+    payment = Payment(booking_id=booking.id, amount=booking.total_amount, razorpay_order_id=order_id,
+                      status=status, created_at=datetime.utcnow() - age)
+    db.session.add(payment)
+    db.session.commit()
+    return payment.id
+
+
+def report_rows(run):
+    with open(run.report_path, newline='') as f:
+        return {int(row['payment_id']): row for row in csv.DictReader(f)}
+
+
+def test_reconcile_fixes_clear_cut_statuses_and_reports_the_rest(app, gateway):
+    paid = payment_with_order(gateway, 1, order_status='paid')
+    failed_but_paid = payment_with_order(gateway, 2, status=PaymentStatus.FAILED, order_status='paid')
+    mismatch = payment_with_order(gateway, 3, order_status='paid', order_amount=150000)
+    stale = payment_with_order(gateway, 4, age=timedelta(days=2))
+    fresh = payment_with_order(gateway, 5)
+    unpaid = payment_with_order(gateway, 6, status=PaymentStatus.COMPLETED)
+    matching = payment_with_order(gateway, 7, status=PaymentStatus.COMPLETED, order_status='paid')
+    missing = payment_with_order(gateway, 8)
+    del gateway.orders['order_00000000000008']
+
+    run = start_run()
+    db.session.commit()
+    run = reconcile(run)
+
+    assert run.finished_at is not None
+    assert (run.checked, run.fixed, run.discrepancies) == (8, 3, 6)
+    statuses = {payment.id: payment.status for payment in Payment.query}
+    assert statuses[paid] == statuses[failed_but_paid] == PaymentStatus.COMPLETED
+    assert statuses[stale] == PaymentStatus.FAILED
+    assert statuses[mismatch] == statuses[fresh] == statuses[missing] == PaymentStatus.PENDING
+    assert db.session.get(Payment, paid).booking.status == BookingStatus.CONFIRMED
+    assert db.session.get(Payment, mismatch).booking.status == BookingStatus.PENDING
+
+    rows = report_rows(run)
+    assert set(rows) == {paid, failed_but_paid, mismatch, stale, unpaid, missing}
+    assert {rows[i]['issue'] for i in rows} == {
+        'paid_but_pending', 'paid_but_failed', 'amount_mismatch', 'stale_pending',
+        'completed_but_unpaid', 'missing_order'
+    }
+    assert rows[mismatch]['action'] == 'report'
+    assert rows[mismatch]['gateway_amount'] == '150000'
+    assert matching not in rows
+
+
+def test_amounts_are_compared_in_rounded_paise(app, gateway):
+    booking = make_booking(make_user('traveler'), total_amount=2499.99 * 3)
+    gateway.orders['order_1'] = {'id': 'order_1', 'entity': 'order', 'amount': 749997, 'status': 'paid'}
+    payment = Payment(booking_id=booking.id, amount=booking.total_amount, razorpay_order_id='order_1')
+    db.session.add(payment)
+    db.session.commit()
+
+    run = reconcile(start_run())
+    assert (run.fixed, run.discrepancies) == (1, 1)
+    assert report_rows(run)[payment.id]['issue'] == 'paid_but_pending'
+
+
+def test_fixes_update_the_daily_metrics_rollup(app, gateway):
+    payment_with_order(gateway, 1, order_status='paid')
+    payment_with_order(gateway, 2, age=timedelta(days=2))
+
+    run = start_run()
+    db.session.commit()
+    reconcile(run)
+
+    def rollup():
+        return {(row.day, row.package_id): (row.revenue, row.bookings_pending, row.bookings_confirmed)
+                for row in DailyMetric.query if row.revenue or row.bookings_pending or row.bookings_confirmed}
+
+    live = rollup()
+    assert sorted(live.values()) == [(0, 1, 0), (2000, 0, 1)]
+    backfill_metrics()
+    assert rollup() == live
+
+
+def test_interrupted_run_resumes_from_checkpoint(app, gateway):
+    ids = [payment_with_order(gateway, number, order_status='paid') for number in range(1, 6)]
+
+    run = start_run()
+    db.session.commit()
+    reconcile(run, max_batches=1)
+    assert (run.last_payment_id, run.checked, run.finished_at) == (ids[1], 2, None)
+
+    # Payments added after the run started wait for the next run
+    payment_with_order(gateway, 6, order_status='paid')
+    resumed = start_run()
+    assert resumed.id == run.id
+    reconcile(resumed)
+
+    assert resumed.finished_at is not None
+    assert (resumed.checked, resumed.fixed) == (5, 5)
+    fetched = [path for method, path in gateway.requests if method == 'GET']
+    assert len(fetched) == len(set(fetched)) == 5
+
+
+def test_gateway_outage_keeps_checkpoint(app, gateway):
+    for number in range(1, 4):
+        payment_with_order(gateway, number, order_status='paid')
+
+    run = start_run()
+    db.session.commit()
+    # Every attempt of both fetches in the first batch
+    gateway.fail_next(*[503] * 6)
+    with pytest.raises(GatewayUnavailable):
+        reconcile(run)
+
+    run = db.session.get(ReconciliationRun, run.id)
+    assert (run.last_payment_id, run.checked, run.finished_at) == (0, 0, None)
+    assert Payment.query.filter_by(status=PaymentStatus.COMPLETED).count() == 0
+
+
+def test_queued_reconciliation_runs_in_chained_jobs(app, client, gateway):
+    app.config['RECONCILE_BATCHES_PER_JOB'] = 1
+    for number in range(1, 6):
+        payment_with_order(gateway, number, order_status='paid')
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+
+    response = client.post('/api/admin/reconciliation', headers=headers)
+    assert response.status_code == 202
+    # A second request while the first is queued reuses its job
+    again = client.post('/api/admin/reconciliation', headers=headers)
+    assert again.get_json()['job_id'] == response.get_json()['job_id']
+
+    work(burst=True)
+
+    assert Job.query.filter_by(task='reconcile_payments').count() == 4
+    assert Booking.query.filter_by(status=BookingStatus.CONFIRMED).count() == 5
+    runs = client.get('/api/admin/reconciliation', headers=headers).get_json()['runs']
+    assert len(runs) == 1
+    assert runs[0]['checked'] == 5 and runs[0]['finished_at'] is not None
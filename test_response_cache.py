@@ -0,0 +1,91 @@
+"""
+In-process tests for the public catalog response cache
+"""
+
+from datetime import date
+
+import pytest
+
+from cache import response_cache
+from conftest import make_user, make_package, auth_headers
+from database import db
+from models import Booking, BookingStatus, UserRole
+
+
+@pytest.fixture
+def cached_client(app):
+    app.config['RESPONSE_CACHE_BACKEND'] = 'memory'
+    response_cache.init_app(app)
+    response_cache.clear()
+    return app.test_client()
+
+
+def test_listing_is_served_from_cache_until_a_package_changes(cached_client):
+    headers = auth_headers(make_user('admin', role=UserRole.ADMIN))
+    package = make_package('Paris City Break')
+
+    first = cached_client.get('/api/packages/?per_page=5&page=1')
+    second = cached_client.get('/api/packages/?page=1&per_page=5')
+    assert first.headers['X-Cache'] == 'MISS'
+    assert second.headers['X-Cache'] == 'HIT'
+    assert second.get_json() == first.get_json()
+
+    response = cached_client.put(f'/api/packages/{package.id}', json={'price': 999.0}, headers=headers)
+    assert response.status_code == 200
+
+    third = cached_client.get('/api/packages/?page=1&per_page=5')
+    assert third.headers['X-Cache'] == 'MISS'
+    assert third.get_json()['packages'][0]['price'] == 999.0
+
+
+def test_review_writes_invalidate_only_the_affected_package(cached_client):
+    reviewer = make_user('alice')
+    reviewed = make_package('Reviewed')
+    untouched = make_package('Untouched')
+    db.session.add(Booking(user_id=reviewer.id, package_id=reviewed.id, booking_date=date.today(),
+                           number_of_travelers=1, total_amount=1000.0, status=BookingStatus.COMPLETED))
+    db.session.commit()
+
+    for url in [f'/api/packages/{reviewed.id}', f'/api/packages/{untouched.id}',
+                f'/api/reviews/package/{reviewed.id}']:
+        assert cached_client.get(url).headers['X-Cache'] == 'MISS'
+
+    response = cached_client.post('/api/reviews/', json={'package_id': reviewed.id, 'rating': 5},
+                                  headers=auth_headers(reviewer))
+    assert response.status_code == 201
+
+    assert cached_client.get(f'/api/packages/{untouched.id}').headers['X-Cache'] == 'HIT'
+    detail = cached_client.get(f'/api/packages/{reviewed.id}')
+    assert detail.headers['X-Cache'] == 'MISS'
+    assert detail.get_json()['package']['total_reviews'] == 1
+    reviews = cached_client.get(f'/api/reviews/package/{reviewed.id}')
+    assert reviews.headers['X-Cache'] == 'MISS'
+    assert reviews.get_json()['total_reviews'] == 1
+
+
+def test_errors_are_not_cached_and_stats_are_counted(cached_client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+
+    assert cached_client.get('/api/packages/42').status_code == 404
+    assert cached_client.get('/api/packages/42').headers['X-Cache'] == 'MISS'
+    cached_client.get('/api/packages/destinations')
+    cached_client.get('/api/packages/destinations')
+
+    stats = cached_client.get('/api/admin/cache/stats', headers=auth_headers(admin)).get_json()
+    assert stats['endpoints']['get_package'] == {'hits': 0, 'misses': 2}
+    assert stats['endpoints']['get_destinations'] == {'hits': 1, 'misses': 1}
+
+
+def test_cache_hits_answer_if_none_match(cached_client):
+    package = make_package()
+    url = f'/api/packages/{package.id}'
+
+    etag = cached_client.get(url).headers['ETag']
+    hit = cached_client.get(url)
+    assert hit.headers['X-Cache'] == 'HIT'
+    assert hit.headers['ETag'] == etag
+    assert hit.headers['Last-Modified']
+
+    revalidated = cached_client.get(url, headers={'If-None-Match': etag})
+    assert revalidated.headers['X-Cache'] == 'HIT'
+    assert revalidated.status_code == 304
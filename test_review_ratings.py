@@ -0,0 +1,82 @@
+"""
+In-process tests for the denormalized package rating counters
+"""
+
+from datetime import date
+
+from conftest import make_user, make_package, auth_headers
+from database import db
+from models import Booking, BookingStatus, Review, TravelPackage, UserRole
+from ratings import rebuild_rating_stats, rebuild_ratings_command
+
+
+def complete_trip(user, package):
+    db.session.add(Booking(
+        user_id=user.id,
+        package_id=package.id,
+        booking_date=date.today(),
+        number_of_travelers=1,
+        total_amount=package.price,
+        status=BookingStatus.COMPLETED
+    ))
+    db.session.commit()
+
+
+def test_review_writes_maintain_rating_counters(client):
+    admin = make_user('admin', role=UserRole.ADMIN)
+    package = make_package()
+    package_id = package.id
+    reviewers = [make_user('alice'), make_user('bob')]
+    for reviewer in reviewers:
+        complete_trip(reviewer, package)
+
+    review_ids = []
+    for reviewer, rating in zip(reviewers, [5, 2]):
+        response = client.post('/api/reviews/', json={'package_id': package_id, 'rating': rating},
+                               headers=auth_headers(reviewer))
+        assert response.status_code == 201
+        review_ids.append(response.get_json()['review']['id'])
+
+    package = db.session.get(TravelPackage, package_id)
+    assert (package.rating_sum, package.rating_count) == (7, 2)
+    assert package.average_rating == 3.5
+
+    response = client.put(f'/api/reviews/{review_ids[1]}', json={'rating': 4}, headers=auth_headers(admin))
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert (package.rating_sum, package.rating_count) == (9, 2)
+
+    response = client.delete(f'/api/reviews/{review_ids[0]}', headers=auth_headers(admin))
+    assert response.status_code == 200
+    db.session.expire_all()
+    assert (package.rating_sum, package.rating_count) == (4, 1)
+
+    data = client.get(f'/api/reviews/package/{package_id}').get_json()
+    assert data['average_rating'] == 4.0
+    assert data['total_reviews'] == 1
+
+
+def test_rebuild_rating_stats_recomputes_counters(app):
+    users = [make_user(f'reviewer{i}') for i in range(3)]
+    rated = make_package('Rated')
+    unrated = make_package('Unrated', rating_sum=12, rating_count=3)
+    for user, rating in zip(users, [1, 3, 5]):
+        db.session.add(Review(user_id=user.id, package_id=rated.id, rating=rating))
+    db.session.commit()
+
+    assert rebuild_rating_stats() == 2
+
+    db.session.expire_all()
+    assert (rated.rating_sum, rated.rating_count) == (9, 3)
+    assert (unrated.rating_sum, unrated.rating_count) == (0, 0)
+
+
+def test_rebuild_ratings_command(app):
+    package = make_package(rating_sum=10, rating_count=2)
+
+    result = app.test_cli_runner().invoke(rebuild_ratings_command)
+    assert result.exit_code == 0
+    assert 'Rebuilt rating counters for 1 packages' in result.output
+
+    db.session.expire_all()
+    assert (package.rating_sum, package.rating_count) == (0, 0)
@@ -0,0 +1,82 @@
+"""
+Tests for the SQLite connection profiles in sqlite_profile.py
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+import sqlite_profile
+from database import db
+
+
+def build_app(tmp_path, **config):
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'profile.db'}"
+    app.config.update(config)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_profile.engine_options(app.config)
+    db.init_app(app)
+    sqlite_profile.init_app(app)
+    return app
+
+
+def pragma(name):
+    return db.session.execute(text(f'PRAGMA {name}')).scalar()
+
+
+def test_production_profile_sets_pragmas_on_connect(tmp_path):
+    app = build_app(tmp_path, SQLITE_PROFILE='production', SQLITE_BUSY_TIMEOUT=2500,
+                    SQLITE_CACHE_SIZE=1024)
+    with app.app_context():
+        assert pragma('journal_mode') == 'wal'
+        assert pragma('synchronous') == 1  # NORMAL
+        assert pragma('busy_timeout') == 2500
+        assert pragma('cache_size') == -1024
+        assert pragma('temp_store') == 2  # MEMORY
+        db.engine.dispose()
+
+
+def test_production_profile_pools_connections_for_threads(tmp_path):
+    app = build_app(tmp_path, SQLITE_PROFILE='production', SQLITE_POOL_SIZE=4)
+    with app.app_context():
+        engine = db.engine
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == 4
+
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE counter (id INTEGER PRIMARY KEY, n INTEGER)'))
+        conn.execute(text('INSERT INTO counter (id, n) VALUES (1, 0)'))
+
+    def bump(_):
+        with engine.begin() as conn:
+            conn.execute(text('UPDATE counter SET n = n + 1 WHERE id = 1'))
+
+    # Concurrent writers wait for the lock instead of failing
+    with ThreadPoolExecutor(max_workers=8) as workers:
+        list(workers.map(bump, range(200)))
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT n FROM counter')).scalar() == 200
+    engine.dispose()
+
+
+def test_default_profile_leaves_sqlite_settings_alone(tmp_path):
+    app = build_app(tmp_path)
+    assert app.config['SQLALCHEMY_ENGINE_OPTIONS'] == {}
+    with app.app_context():
+        assert pragma('journal_mode') == 'delete'
+        assert pragma('synchronous') == 2  # FULL
+        db.engine.dispose()
+
+
+def test_in_memory_database_is_not_tuned():
+    config = {'SQLITE_PROFILE': 'production', 'SQLALCHEMY_DATABASE_URI': 'sqlite://'}
+    assert sqlite_profile.engine_options(config) == {}
+
+
+def test_unknown_profile_is_rejected():
+    with pytest.raises(ValueError):
+        sqlite_profile.engine_options({'SQLITE_PROFILE': 'fast',
+                                       'SQLALCHEMY_DATABASE_URI': 'sqlite:///x.db'})
@@ -0,0 +1,163 @@
+"""
+In-process tests for the Razorpay webhook inbox and its batch processor
+"""
+
+import hashlib
+import hmac
+import json
+
+import pytest
+
+from conftest import make_user, make_package, make_booking
+from database import db
+from gateway import payment_gateway
+from inventory import reserve_seats
+from models import BookingStatus, Job, Payment, PaymentStatus, WebhookEvent
+from webhooks import process_webhook_events
+
+SECRET = 'whsec_test'
+
+
+@pytest.fixture
+def signed(app):
+    app.config['RAZORPAY_WEBHOOK_SECRET'] = SECRET
+    payment_gateway.init_app(app)
+
+
+def sign(body):
+    return hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest()
+
+
+def captured(order_id, payment_id='pay_1'):
+    return {'event': 'payment.captured', 'payload': {'payment': {'entity': {
+        'id': payment_id, 'order_id': order_id, 'method': 'upi'
+    }}}}
+
+
+def failed(order_id):
+    return {'event': 'payment.failed', 'payload': {'payment': {'entity': {'id': 'pay_x', 'order_id': order_id}}}}
+
+
+def refunded(payment_id):
+    return {'event': 'refund.processed', 'payload': {'refund': {'entity': {'id': 'rfnd_1', 'payment_id': payment_id}}}}
+
+
+def pending_payment(order_id='order_1', username='traveler'):
+    booking = make_booking(make_user(username))
+    payment = Payment(booking_id=booking.id, amount=booking.total_amount, razorpay_order_id=order_id)
+    db.session.add(payment)
+    db.session.commit()
+    return payment
+
+
+def inbox(*events):
+    """Store events directly, as the endpoint would; (event id, body) pairs or bodies"""
+    for number, event in enumerate(events):
+        event_id, body = event if isinstance(event, tuple) else (f'evt_{number}', event)
+        payload = body if isinstance(body, str) else json.dumps(body)
+        db.session.add(WebhookEvent(event_id=event_id, payload=payload))
+    db.session.commit()
+
+
+def test_signed_webhook_is_stored(client, signed):
+    body = json.dumps(captured('order_1')).encode()
+    response = client.post('/api/payments/webhook', data=body, content_type='application/json',
+                           headers={'X-Razorpay-Signature': sign(body), 'X-Razorpay-Event-Id': 'evt_1'})
+    assert response.status_code == 200
+
+    event = WebhookEvent.query.one()
+    assert event.event_id == 'evt_1'
+    assert json.loads(event.payload) == captured('order_1')
+    assert event.processed_at is None
+
+
+@pytest.mark.parametrize('signature', [None, 'bad'])
+def test_unsigned_webhook_is_rejected(client, signed, signature):
+    headers = {'X-Razorpay-Signature': signature} if signature else {}
+    response = client.post('/api/payments/webhook', data=b'{}', content_type='application/json', headers=headers)
+    assert response.status_code == 400
+    assert WebhookEvent.query.count() == 0
+
+
+def test_webhook_without_secret_is_rejected(client):
+    body = b'{}'
+    response = client.post('/api/payments/webhook', data=body, content_type='application/json',
+                           headers={'X-Razorpay-Signature': sign(body)})
+    assert response.status_code == 400
+
+
+def test_capture_completes_payment_and_confirms_booking(app):
+    payment = pending_payment()
+    inbox(captured('order_1'))
+
+    assert process_webhook_events() == {'applied': 1}
+    payment = db.session.get(Payment, payment.id)
+    assert payment.status == PaymentStatus.COMPLETED
+    assert payment.razorpay_payment_id == 'pay_1'
+    assert payment.payment_method == 'upi'
+    assert payment.booking.status == BookingStatus.CONFIRMED
+    assert WebhookEvent.query.filter(WebhookEvent.processed_at.is_(None)).count() == 0
+
+
+def test_capture_for_sold_out_cancelled_booking_queues_refund(app):
+    package = make_package(max_travelers=2)
+    booking = make_booking(make_user('traveler'), package, status=BookingStatus.CANCELLED)
+    payment = Payment(booking_id=booking.id, amount=booking.total_amount, razorpay_order_id='order_1')
+    db.session.add(payment)
+    reserve_seats(package, booking.booking_date, 2)
+    db.session.commit()
+    inbox(captured('order_1'))
+
+    assert process_webhook_events() == {'refund_queued': 1}
+    payment = db.session.get(Payment, payment.id)
+    assert payment.status == PaymentStatus.COMPLETED
+    assert payment.booking.status == BookingStatus.CANCELLED
+    assert Job.query.filter_by(task='refund_payment', key=f'refund:{payment.id}').count() == 1
+
+
+def test_redelivered_event_is_applied_once(app):
+    pending_payment()
+    inbox(('evt_1', captured('order_1')), ('evt_1', captured('order_1')))
+    assert process_webhook_events() == {'applied': 1, 'duplicate': 1}
+
+    # A redelivery arriving after the first copy was processed
+    inbox(('evt_1', captured('order_1')))
+    assert process_webhook_events() == {'duplicate': 1}
+
+
+def test_late_failure_does_not_undo_capture(app):
+    payment = pending_payment()
+    inbox(captured('order_1'), failed('order_1'))
+
+    assert process_webhook_events() == {'applied': 1, 'ignored': 1}
+    assert db.session.get(Payment, payment.id).status == PaymentStatus.COMPLETED
+
+
+def test_refund_in_same_batch_as_capture(app):
+    payment = pending_payment()
+    inbox(captured('order_1', payment_id='pay_7'), refunded('pay_7'))
+
+    assert process_webhook_events() == {'applied': 2}
+    payment = db.session.get(Payment, payment.id)
+    assert payment.status == PaymentStatus.REFUNDED
+    assert payment.booking.status == BookingStatus.CANCELLED
+
+
+def test_unusable_events_are_marked(app):
+    inbox({'event': 'order.notified', 'payload': {}}, captured('order_missing'), 'not json')
+
+    assert process_webhook_events() == {'ignored': 1, 'unmatched': 1, 'invalid': 1}
+    assert {event.outcome for event in WebhookEvent.query} == {'ignored', 'unmatched', 'invalid'}
+
+
+def test_batch_query_count_does_not_grow_with_events(app, count_queries):
+    for number in range(40):
+        pending_payment(order_id=f'order_{number}', username=f'traveler{number}')
+    inbox(*[captured(f'order_{number}', payment_id=f'pay_{number}') for number in range(40)])
+
+    with count_queries() as statements:
+        assert process_webhook_events(batch_size=100) == {'applied': 40}
+    # Inbox read, duplicate check and payments load, then the read that finds the inbox empty
+    selects = [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+    assert len(selects) == 4
+    assert Payment.query.filter_by(status=PaymentStatus.COMPLETED).count() == 40
@@ -0,0 +1,175 @@
+"""
+Batched processing of Razorpay webhook events
+
+The webhook endpoint only verifies the signature and appends the raw body to
+webhook_events, so a flood of deliveries costs one insert each. This module
+applies them afterwards, batch by batch: each batch loads every payment it
+touches in one query, applies the transitions in memory and commits once,
+together with the processed marks on its inbox rows.
+
+Razorpay redelivers an event until it is acknowledged, so the same event id
+can be in the inbox several times; only the first copy is applied and the
+rest are marked duplicate. Transitions only move payments forward (a late
+payment.failed never undoes a capture), so applying them out of order or
+twice is harmless.
+
+Run `flask process-webhooks --follow` as a long-lived process, or without
+--follow from cron to drain the inbox once.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+import json
+import time
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import or_, update
+from sqlalchemy.orm import joinedload
+from models import db, BookingStatus, Payment, PaymentStatus, WebhookEvent
+from inventory import confirm_paid_booking, set_booking_status
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def _payment_entity(payload):
+    return payload.get('payment', {}).get('entity', {})
+
+
+def _captured(payment, payload):
+    if payment.status not in (PaymentStatus.PENDING, PaymentStatus.FAILED):
+        return 'ignored'
+    entity = _payment_entity(payload)
+    payment.status = PaymentStatus.COMPLETED
+    payment.razorpay_payment_id = entity.get('id') or payment.razorpay_payment_id
+    payment.payment_method = entity.get('method') or 'razorpay'
+    return 'applied' if confirm_paid_booking(payment) else 'refund_queued'
+
+
+def _failed(payment, payload):
+    if payment.status != PaymentStatus.PENDING:
+        return 'ignored'
+    payment.status = PaymentStatus.FAILED
+    return 'applied'
+
+
+def _refunded(payment, payload):
+    if payment.status != PaymentStatus.COMPLETED:
+        return 'ignored'
+    payment.status = PaymentStatus.REFUNDED
+    set_booking_status(payment.booking, BookingStatus.CANCELLED)
+    return 'applied'
+
+
+# Event name -> (how to find the payment, transition)
+HANDLERS = {
+    'payment.captured': (lambda p: ('order', _payment_entity(p).get('order_id')), _captured),
+    'order.paid': (lambda p: ('order', p.get('order', {}).get('entity', {}).get('id')), _captured),
+    'payment.failed': (lambda p: ('order', _payment_entity(p).get('order_id')), _failed),
+    'refund.processed': (lambda p: ('payment', p.get('refund', {}).get('entity', {}).get('payment_id')), _refunded),
+}
+
+
+def _parse(row):
+    """(event name, payload) of an inbox row, or None when the body is not a usable event"""
+    try:
+        body = json.loads(row.payload)
+        return body['event'], body.get('payload') or {}
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def process_batch(rows):
+    """Apply a batch of inbox rows; returns {outcome: count}. The caller commits."""
+    outcomes = defaultdict(list)
+
+    # Event ids already applied by an earlier batch
+    seen = {
+        event_id for (event_id,) in db.session.query(WebhookEvent.event_id).filter(
+            WebhookEvent.event_id.in_({row.event_id for row in rows}),
+            WebhookEvent.processed_at.isnot(None)
+        )
+    }
+
+    events = []
+    for row in rows:
+        if row.event_id in seen:
+            outcomes['duplicate'].append(row.id)
+            continue
+        seen.add(row.event_id)
+        parsed = _parse(row)
+        if parsed is None:
+            outcomes['invalid'].append(row.id)
+        elif parsed[0] not in HANDLERS:
+            outcomes['ignored'].append(row.id)
+        else:
+            name, payload = parsed
+            lookup, transition = HANDLERS[name]
+            events.append((row.id, lookup(payload), transition, payload))
+
+    # Every payment the batch touches, in one query
+    order_ids = {value for _, (kind, value), _, _ in events if kind == 'order' and value}
+    payment_ids = {value for _, (kind, value), _, _ in events if kind == 'payment' and value}
+    payments = Payment.query.options(joinedload(Payment.booking)).filter(or_(
+        Payment.razorpay_order_id.in_(order_ids), Payment.razorpay_payment_id.in_(payment_ids)
+    )).all() if events else []
+    by_key = {}
+
+    def index(payment):
+        for key in (('order', payment.razorpay_order_id), ('payment', payment.razorpay_payment_id)):
+            if key[1]:
+                by_key[key] = payment
+
+    for payment in payments:
+        index(payment)
+
+    for row_id, key, transition, payload in events:
+        payment = by_key.get(key) if key[1] else None
+        if payment is None:
+            outcomes['unmatched'].append(row_id)
+            continue
+        outcomes[transition(payment, payload)].append(row_id)
+        # A capture earlier in the batch makes the payment findable by its payment id
+        index(payment)
+
+    now = datetime.utcnow()
+    for outcome, row_ids in outcomes.items():
+        db.session.execute(
+            update(WebhookEvent).where(WebhookEvent.id.in_(row_ids))
+            .values(processed_at=now, outcome=outcome)
+            .execution_options(synchronize_session=False)
+        )
+    return {outcome: len(row_ids) for outcome, row_ids in outcomes.items()}
+
+
+def process_webhook_events(batch_size=DEFAULT_BATCH_SIZE):
+    """Drain the inbox in batches of batch_size; returns {outcome: count}"""
+    totals = defaultdict(int)
+    while True:
+        rows = WebhookEvent.query.filter(WebhookEvent.processed_at.is_(None)) \
+            .order_by(WebhookEvent.id).limit(batch_size).all()
+        if not rows:
+            return dict(totals)
+        try:
+            for outcome, count in process_batch(rows).items():
+                totals[outcome] += count
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+@click.command('process-webhooks')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Events applied per transaction')
+@click.option('--follow', is_flag=True, help='Keep polling the inbox instead of exiting once it is empty')
+@with_appcontext
+def process_webhooks_command(batch_size, follow):
+    """Apply received payment webhook events"""
+    while True:
+        totals = process_webhook_events(batch_size)
+        if totals or not follow:
+            summary = ', '.join(f'{count} {outcome}' for outcome, count in sorted(totals.items()))
+            click.echo(f'Processed webhook events: {summary or "none"}')
+        if not follow:
+            return
+        time.sleep(current_app.config.get('WEBHOOK_POLL_INTERVAL', 1))